@@ -0,0 +1,178 @@
+"""Times the hot paths of FastStat on synthetic spreadsheets.
+
+    python benchmarks/bench.py [--tiers small,medium] [--repeat 3]
+        [--output results.json] [--baseline baseline.json] [--threshold 0.25]
+
+Spreadsheets of each size tier are generated once (see generate.py) and
+kept in --workdir. Every stage is run --repeat times; the fastest time and
+the peak memory allocated during the stage (as seen by tracemalloc) are
+reported. With --baseline, results are compared to a previous --output
+file and the run fails (exit status 1) if a stage got slower by more than
+--threshold. Everything runs offline."""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate import make_workbook  # noqa: E402
+
+# Number of rows of the spreadsheets of each tier
+TIERS = {'small': 1000, 'medium': 10000, 'large': 100000}
+
+BINS = 3
+
+
+def stages(path):
+    """Stages to be timed on one spreadsheet, in order, as (name, function)
+    pairs. Stages after read_data work on the data frame it returns."""
+
+    from faststat.compute import one_way_anova, two_way_anova
+    from faststat.dataparse import bin_dataframe_generator, filter_numeric_data
+    from faststat.objects import FastStat
+
+    state = {}
+
+    def read_data():
+        state['data_frame'] = FastStat().read_data(path, num_bin=BINS)
+
+    def two_way():
+        data_frame = state['data_frame']
+        groups = [data_frame[data_frame['Genotype'] == level] for level in ('G1', 'G2')]
+        two_way_anova(groups[0], groups[1], 'Genotype', 'G1', 'G2', 'Speed')
+
+    return [('read_data', read_data),
+            ('filter_numeric_data',
+             lambda: filter_numeric_data(state['data_frame'], 'Average Speed')),
+            ('bin_dataframe_generator',
+             lambda: bin_dataframe_generator(state['data_frame'], 'Speed')),
+            ('one_way_anova', lambda: one_way_anova(state['data_frame'], 'Speed')),
+            ('two_way_anova', two_way)]
+
+
+def measure(function, repeat):
+    """Fastest of repeat runs of function, in seconds, and the peak memory
+    allocated by a traced run, in bytes"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows Python code down, so memory is measured in its own run
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), peak
+
+
+def workbook(workdir, tier):
+    path = os.path.join(workdir, f'faststat-bench-{tier}-{TIERS[tier]}.xlsx')
+    if not os.path.isfile(path):
+        make_workbook(path, rows=TIERS[tier], bins=BINS)
+    return path
+
+
+def run(tiers, repeat, workdir):
+    """Runs every stage on the spreadsheet of every tier.
+
+    Returns
+    ---
+
+    dict with the environment and, for each tier, the time and peak memory
+    of each stage"""
+
+    import numpy
+    import pandas
+    import scipy
+
+    results = {'environment': {'python': platform.python_version(),
+                               'numpy': numpy.__version__,
+                               'pandas': pandas.__version__,
+                               'scipy': scipy.__version__,
+                               'machine': platform.machine()},
+               'tiers': {}}
+
+    for tier in tiers:
+        path = workbook(workdir, tier)
+        results['tiers'][tier] = {'rows': TIERS[tier], 'stages': {}}
+        for name, function in stages(path):
+            seconds, peak = measure(function, repeat)
+            results['tiers'][tier]['stages'][name] = {'seconds': seconds, 'peak_bytes': peak}
+            print(f'{tier:<8} {name:<24} {seconds * 1000:10.2f} ms {peak / 1e6:10.2f} MB',
+                  file=sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Stages slower than in baseline by more than threshold (a fraction).
+
+    Returns
+    ---
+
+    list of (tier, stage, baseline seconds, seconds) tuples"""
+
+    regressions = []
+    for tier, tier_results in results['tiers'].items():
+        baseline_stages = baseline.get('tiers', {}).get(tier, {}).get('stages', {})
+        for stage, measurement in tier_results['stages'].items():
+            reference = baseline_stages.get(stage)
+            if reference is None:
+                continue
+            if measurement['seconds'] > reference['seconds'] * (1 + threshold):
+                regressions.append((tier, stage, reference['seconds'], measurement['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the hot paths of FastStat.')
+    parser.add_argument('--tiers', default='small,medium',
+                        help=f"comma separated size tiers, among {', '.join(TIERS)}")
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the fastest is kept')
+    parser.add_argument('--workdir', default=tempfile.gettempdir(),
+                        help='where generated spreadsheets are kept')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown over the baseline flagged as a regression (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    tiers = [tier.strip() for tier in args.tiers.split(',') if tier.strip()]
+    unknown = [tier for tier in tiers if tier not in TIERS]
+    if unknown:
+        parser.error(f"Unknown tiers: {', '.join(unknown)}")
+
+    results = run(tiers, max(1, args.repeat), args.workdir)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, args.threshold)
+        for tier, stage, before, after in regressions:
+            print(f'REGRESSION {tier} {stage}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms '
+                  f'({after / before - 1:+.0%})', file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Generates synthetic spreadsheets in the format FastStat expects.
+
+    python benchmarks/generate.py OUTPUT.xlsx [--rows 1000] [--bins 3]
+        [--genotypes 2] [--treatments 3] [--outlier-rate 0.01] [--seed 0]
+
+Each row is an animal with a Genotype and a Treatment, a Speed measured over
+several bins (one merged header cell over the bin columns), the Average
+Speed of those bins and a Weight. A fraction of the measurements are
+outliers, so Grubbs' test has work to do."""
+
+import argparse
+
+import numpy as np
+from openpyxl import Workbook
+
+
+def make_workbook(path, rows=1000, bins=3, genotypes=2, treatments=3, outlier_rate=0.01,
+                  seed=0):
+    """Writes a synthetic spreadsheet.
+
+    Arguments
+    ---
+
+    path : str
+        Where the xlsx file is written
+
+    rows : int
+        Number of animals
+
+    bins : int
+        Number of bins of the Speed variable. Spreadsheets must be read with
+        the same num_bin (see FastStat.read_data)
+
+    genotypes, treatments : int
+        Number of levels of the Genotype and Treatment factors
+
+    outlier_rate : float
+        Fraction of the measurements replaced by outliers
+
+    seed : int
+        Seed of the random generator, so that files can be reproduced
+
+    Returns
+    ---
+
+    str with path"""
+
+    rng = np.random.default_rng(seed)
+    genotype = rng.integers(genotypes, size=rows)
+    treatment = rng.integers(treatments, size=rows)
+
+    # Each factor shifts the mean, so ANOVA has effects to find
+    means = 10 + genotype + 0.5 * treatment
+    speed = rng.normal(means[:, None], 1.0, size=(rows, bins))
+    weight = rng.normal(30, 2, size=rows)
+
+    outliers = rng.random(speed.shape) < outlier_rate
+    speed[outliers] += rng.choice([-8, 8], size=outliers.sum())
+    average = speed.mean(axis=1)
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Data')
+    # Bins after the first have an empty header, as in a merged cell
+    sheet.append(['Animal', 'Genotype', 'Treatment', 'Speed'] + [None] * (bins - 1) +
+                 ['Average Speed', 'Weight'])
+
+    genotype_names = [f'G{level + 1}' for level in range(genotypes)]
+    for row in range(rows):
+        sheet.append([row + 1, genotype_names[genotype[row]], int(treatment[row])] +
+                     speed[row].tolist() + [float(average[row]), float(weight[row])])
+
+    workbook.save(path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates a synthetic FastStat spreadsheet.')
+    parser.add_argument('output', help='xlsx file to be written')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--bins', type=int, default=3)
+    parser.add_argument('--genotypes', type=int, default=2)
+    parser.add_argument('--treatments', type=int, default=3)
+    parser.add_argument('--outlier-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    make_workbook(args.output, args.rows, args.bins, args.genotypes, args.treatments,
+                  args.outlier_rate, args.seed)
+
+
+if __name__ == '__main__':
+    main()
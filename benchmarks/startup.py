@@ -0,0 +1,100 @@
+"""Measures how long importing the web app takes.
+
+    python benchmarks/startup.py [--repeat 3] [--max-seconds 1.0] [--json]
+
+The app is imported in fresh interpreters with -X importtime, and the
+fastest run is reported with the packages that took the most time. The
+heavy scientific stack is meant to be loaded only when an analysis runs:
+the report fails (exit status 1) if any of HEAVY_MODULES is imported at
+start-up, or if the import takes longer than --max-seconds."""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+# Packages that must not be imported when the app starts
+HEAVY_MODULES = ('pandas', 'scipy', 'matplotlib', 'statsmodels', 'pyarrow', 'numpy')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module='faststat.webapp'):
+    """Imports module in a fresh interpreter with -X importtime.
+
+    Returns
+    ---
+
+    list of (module name, self time, cumulative time) tuples in seconds, in
+    the order reported by the interpreter"""
+
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             cwd=ROOT, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{process.stderr}')
+
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_time) / 1e6, int(cumulative) / 1e6))
+    return imports
+
+
+def summarize(imports, module='faststat.webapp', top=10):
+    """Total import time of module, the packages taking most of it, and the
+    heavy modules that were imported"""
+
+    total = next(cumulative for name, _, cumulative in imports if name == module)
+
+    packages = defaultdict(float)
+    for name, self_time, _ in imports:
+        packages[name.split('.')[0]] += self_time
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    loaded = {name.split('.')[0] for name, _, _ in imports}
+    return {'module': module,
+            'seconds': total,
+            'packages': [{'name': name, 'seconds': seconds} for name, seconds in heaviest],
+            'heavy_modules': [name for name in HEAVY_MODULES if name in loaded]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reports the import time of the web app.')
+    parser.add_argument('--module', default='faststat.webapp', help='module to be imported')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs; the fastest is kept')
+    parser.add_argument('--top', type=int, default=10, help='number of packages listed')
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='fail if importing takes longer than this')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    reports = [summarize(measure(args.module), args.module, args.top)
+               for _ in range(max(1, args.repeat))]
+    report = min(reports, key=lambda report: report['seconds'])
+
+    failures = []
+    if report['heavy_modules']:
+        failures.append('heavy modules imported at start-up: ' + ', '.join(report['heavy_modules']))
+    if args.max_seconds is not None and report['seconds'] > args.max_seconds:
+        failures.append(f"import took {report['seconds']:.3f}s, over {args.max_seconds:.3f}s")
+    report['failures'] = failures
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print(f"import {report['module']}: {report['seconds']:.3f}s "
+              f"(fastest of {len(reports)})")
+        for package in report['packages']:
+            print(f"  {package['name']:<24} {package['seconds']:.3f}s")
+        for failure in failures:
+            print('FAIL: ' + failure)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,466 @@
+import math
+import threading
+from collections import OrderedDict
+
+from faststat.cache import DataCache
+from faststat.metrics import stage
+from faststat.plots import PlotStore, render_interaction_plot
+from faststat.results import analysis_result, table_section
+
+# The modules doing the computations (and pandas, scipy, ... with them) are
+# imported by the functions running analyses, so that importing this module,
+# and starting the web app, does not load them
+
+# Analyses working on one or on two data sets
+ONE_SET_FUNCS = ['Statistical Info', 'One-way ANOVA']
+TWO_SETS_FUNCS = ['Normality Tests', 'Null Hypothesis Tests', 'Resampling Tests', 'Two-way ANOVA']
+# Analyses run over every group of a grid of parameters (see grid.GRID_TESTS)
+GRID_FUNCS = ['Grid: Statistical Info', 'Grid: Normality Tests', 'Grid: Null Hypothesis Tests',
+              'Grid: All Pairs']
+# Analyses over all the rows, with some columns as factors
+FACTOR_FUNCS = ['N-way ANOVA']
+
+# Largest number of combinations of factor levels in an N-way ANOVA, whose
+# design matrix has about as many rows and columns
+MAX_FACTOR_CELLS = 1000
+
+# Keyword arguments of dataparse.DataSet, which cannot be column names in
+# the parms of an analysis
+RESERVED_PARMS = {'df', 'events', 'group_index'}
+
+# Data sets kept by each worker process, with their group index and binned
+# variables, for the next analyses of the same data (see load_info)
+WORKER_DATA_SETS = 2
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+
+class AnalysisError(ValueError):
+    """Raised when an analysis cannot be performed with the chosen inputs.
+    The message is meant to be shown to the user."""
+
+
+def check_size(dataset, label='Dataset'):
+    """Ensures it is possible to perform analysis on a data set"""
+    if dataset.sampling_size() < 2:
+        raise AnalysisError(f"""Insufficient data for {label}. Please check
+                            your input variables or spreadsheet""")
+
+
+def summary_variable(data_frame, stat_property, binned=None):
+    """Finds the bins of stat_property and its Average/Total column"""
+    from faststat.dataparse import BinnedVariable
+
+    if binned is not None:
+        variable = binned.get(stat_property)
+    else:
+        try:
+            variable = BinnedVariable.from_frame(data_frame, stat_property)
+        except AttributeError:
+            variable = None
+
+    if variable is None or variable.summary is None:
+        raise AnalysisError("""Could not identify any final observable
+                            related to bin variable chosen (is it an
+                            Average, or a Total?). Please check your
+                            spreadsheet labeling and correct it.""")
+    return variable
+
+
+def two_way_parameter(parms_1, parms_2):
+    """Finds the parameter that differs between the two data sets of a
+    two-way ANOVA.
+
+    Returns
+    ---
+
+    tuple with the parameter name and its values in each data set"""
+
+    for parm_1, value_1 in parms_1.items():
+        for parm_2, value_2 in parms_2.items():
+            if parm_1 == parm_2 and value_1 != value_2:
+                return parm_1, value_1, value_2
+
+    raise AnalysisError('Cannot perform two-way ANOVA for these two datasets')
+
+
+def run_analysis(data_frame, stat_func, parms, stat_property, group_index=None,
+                 binned=None, plot_store=None):
+    """Runs one of FastStat's analyses on a data frame.
+
+    Arguments
+    ---
+
+    data_frame : pandas.DataFrame
+        Spreadsheet data
+
+    stat_func : str
+        Name of the analysis (see ONE_SET_FUNCS, TWO_SETS_FUNCS and
+        FACTOR_FUNCS)
+
+    parms : dict or list
+        Parameters defining the data set. A list of two dicts for analyses
+        comparing two data sets, and {'columns': [...], 'typ': ...} with the
+        factors and the type of sums of squares for N-way ANOVA
+
+    stat_property : str
+        Name of the property (or bin variable, for ANOVA) to be analyzed
+
+    group_index : GroupIndex
+        Index of data_frame used to build data sets. Optional
+
+    binned : dict
+        BinnedVariable objects of data_frame, keyed by name. Optional
+
+    plot_store : PlotStore
+        Where rendered plots are saved. Plots are not rendered without it
+
+    Returns
+    ---
+
+    dict with the structured results (see results.analysis_result), and the
+    digest of the interaction plot in plot_store (None for analyses without
+    a plot)"""
+    from faststat.compute import display_stat_info, n_way_anova, normality_tests, \
+                                 null_hypothesis_tests, one_way_anova, resampling_tests, \
+                                 two_way_anova
+    from faststat.dataparse import DataSet
+
+    plot = None
+
+    if stat_func == 'Statistical Info':
+        dataset1 = DataSet(data_frame, stat_property, group_index, **parms)
+        check_size(dataset1)
+        sections = [display_stat_info(dataset1)]
+
+    elif stat_func == 'One-way ANOVA':
+        variable = summary_variable(data_frame, stat_property, binned)
+        dataset1 = DataSet(data_frame, variable.summary, group_index, **parms)
+        check_size(dataset1)
+        table = one_way_anova(dataset1.data_frame, stat_property, variable)
+        sections = [table_section('One-way ANOVA', table, p_column='P')]
+
+    elif stat_func in ['Normality Tests', 'Null Hypothesis Tests']:
+        dataset1 = DataSet(data_frame, stat_property, group_index, **parms[0])
+        dataset2 = DataSet(data_frame, stat_property, group_index, **parms[1])
+        check_size(dataset1, 'Dataset 1')
+        check_size(dataset2, 'Dataset 2')
+
+        sections = [normality_tests(dataset1, dataset2),
+                    display_stat_info(dataset1),
+                    display_stat_info(dataset2)]
+
+        if stat_func == 'Null Hypothesis Tests':
+            sections.append(null_hypothesis_tests(dataset1, dataset2))
+
+    elif stat_func == 'Resampling Tests':
+        dataset1 = DataSet(data_frame, stat_property, group_index, **parms[0])
+        dataset2 = DataSet(data_frame, stat_property, group_index, **parms[1])
+        check_size(dataset1, 'Dataset 1')
+        check_size(dataset2, 'Dataset 2')
+
+        sections = [display_stat_info(dataset1),
+                    display_stat_info(dataset2)] + resampling_tests(dataset1, dataset2)
+
+    elif stat_func == 'Two-way ANOVA':
+        variable = summary_variable(data_frame, stat_property, binned)
+        dataset1 = DataSet(data_frame, variable.summary, group_index, **parms[0])
+        dataset2 = DataSet(data_frame, variable.summary, group_index, **parms[1])
+        check_size(dataset1, 'Dataset 1')
+        check_size(dataset2, 'Dataset 2')
+
+        parameter, value_a, value_b = two_way_parameter(parms[0], parms[1])
+        try:
+            table, cell_means = two_way_anova(dataset1.data_frame, dataset2.data_frame,
+                                              parameter, value_a, value_b,
+                                              stat_property, variable)
+        except ValueError:
+            raise AnalysisError("""Error due to non-numeric data. Please check
+                                your spreadsheet.""")
+        sections = [table_section('Two-way ANOVA', table)]
+
+        if plot_store is not None:
+            png = render_interaction_plot(cell_means, 'bin', parameter, stat_property)
+            plot = plot_store.save(png)
+
+    elif stat_func == 'N-way ANOVA':
+        factors = parms.get('columns') or []
+        if not factors:
+            raise AnalysisError('Please choose at least one column.')
+        for name in factors + [stat_property]:
+            if name not in data_frame.columns:
+                raise AnalysisError(f'Could not find {name} in data frame.')
+        if math.prod(data_frame[factor].nunique() for factor in factors) > MAX_FACTOR_CELLS:
+            raise AnalysisError(f'Too many combinations of levels of {", ".join(factors)} '
+                                f'(at most {MAX_FACTOR_CELLS}).')
+
+        try:
+            table = n_way_anova(data_frame, stat_property, factors, parms.get('typ', 2))
+        except (TypeError, ValueError):
+            raise AnalysisError(f"""Insufficient or non-numeric data for
+                                {stat_property}. Please check your input
+                                variables or spreadsheet""")
+        sections = [table_section('N-way ANOVA', table)]
+
+    else:
+        raise AnalysisError(f'Unknown analysis: {stat_func}')
+
+    return analysis_result(stat_func, stat_property, sections), plot
+
+
+def load_source(source):
+    """Returns the data frame of a (cache folder, data hash) pair, memory
+    mapped from the DataCache, or source itself if it is a data frame"""
+    if not isinstance(source, tuple):
+        return source
+
+    folder, data_hash = source
+    with stage('load_data'):
+        data_frame = DataCache(folder).load(data_hash)
+    if data_frame is None:
+        raise AnalysisError('Data is no longer available. Please upload your spreadsheet again.')
+    return data_frame
+
+
+def load_info(source):
+    """Returns a FastStat object holding the data frame of source (see
+    load_source). Those loaded from the cache are kept by the process, up to
+    WORKER_DATA_SETS of them, so that the group index and binned variables
+    built for a data set are reused by the following jobs on it."""
+    from faststat.objects import FastStat
+
+    if not isinstance(source, tuple):
+        return FastStat.from_frame(source)
+
+    data_hash = source[1]
+    with _loaded_lock:
+        info = _loaded.get(data_hash)
+        if info is not None:
+            _loaded.move_to_end(data_hash)
+            return info
+
+    info = FastStat.from_frame(load_source(source), data_hash)
+    with _loaded_lock:
+        _loaded[data_hash] = info
+        while len(_loaded) > WORKER_DATA_SETS:
+            _loaded.popitem(last=False)
+    return info
+
+
+def run_cached_analysis(source, stat_func, parms, stat_property, plot_folder=None):
+    """Runs an analysis in a worker process. The data frame is memory mapped
+    from the DataCache when source is a (cache folder, data hash) pair, so
+    it does not have to be pickled and sent to the worker. Plots are rendered
+    in the worker as well and saved to the PlotStore in plot_folder.
+
+    Arguments
+    ---
+
+    source : tuple or pandas.DataFrame
+        Location of the data in the cache, or the data frame itself
+
+    stat_func, parms, stat_property :
+        See run_analysis
+
+    Returns
+    ---
+
+    See run_analysis"""
+
+    info = load_info(source)
+    plot_store = PlotStore(plot_folder) if plot_folder is not None else None
+
+    with stage('analysis', stat_func=stat_func) as span:
+        span.rows = len(info.data_frame)
+        return run_analysis(info.data_frame, stat_func, parms, stat_property,
+                            info.group_index, info.binned, plot_store)
+
+
+def run_grid_analysis(data_frame, stat_func, columns, stat_property, workers=1):
+    """Runs an analysis over every group of a grid (see grid.run_grid).
+
+    Arguments
+    ---
+
+    data_frame : pandas.DataFrame
+        Spreadsheet data
+
+    stat_func : str
+        One of GRID_FUNCS
+
+    columns : list
+        Names of the grouping columns
+
+    stat_property : str
+        Name of the property to be analyzed
+
+    workers : int
+        Number of processes running pairwise tests
+
+    Returns
+    ---
+
+    See run_analysis. Grids have no plot"""
+    from faststat.grid import run_grid
+
+    if not columns:
+        raise AnalysisError('Please choose at least one column.')
+
+    try:
+        with stage('analysis', stat_func=stat_func) as span:
+            span.rows = len(data_frame)
+            result = run_grid(data_frame, stat_func[len('Grid: '):], columns, stat_property,
+                              workers=workers)
+    except (AttributeError, ValueError):
+        raise AnalysisError(f"""Insufficient or non-numeric data for
+                            {stat_property}. Please check your input
+                            variables or spreadsheet""")
+
+    result['analysis'] = stat_func
+    return result, None
+
+
+def run_cached_grid(source, stat_func, columns, stat_property, workers=1):
+    """Runs an analysis over every group of a grid in a worker process (see
+    run_cached_analysis and run_grid_analysis)"""
+
+    return run_grid_analysis(load_info(source).data_frame, stat_func, columns, stat_property,
+                             workers)
+
+
+def run_cached_summary(source, columns, stat_property):
+    """Builds the statistics of stat_property in every group of columns in a
+    worker process (see run_cached_analysis), for the first 'Grid:
+    Statistical Info' on a data set. They are sent back to be kept with the
+    data set, which updates them as rows are appended (see
+    FastStat.grid_summary).
+
+    Returns
+    ---
+
+    IncrementalSummary, and its result"""
+
+    try:
+        summary = load_info(source).grid_summary(columns, stat_property)
+        return summary, summary.result()
+    except AnalysisError:
+        raise
+    except (AttributeError, ValueError):
+        raise AnalysisError(f"""Insufficient or non-numeric data for {stat_property}.
+                            Please check your input variables or spreadsheet""")
+
+
+def parse_spec(spec):
+    """Checks the specification of an analysis, as given to run_batch.
+
+    Arguments
+    ---
+
+    spec : dict
+        'stat_func', 'parms' and 'property' of the analysis. parms is a dict
+        of column values for analyses of one data set, a list of two such
+        dicts for analyses of two data sets, {'columns': [...]} for grids,
+        and {'columns': [...], 'typ': 1, 2 or 3} for N-way ANOVA, typ being
+        optional
+
+    Returns
+    ---
+
+    tuple with stat_func, parms and property"""
+
+    def valid_values(values):
+        # Column names and the scalar values selecting a group
+        return (isinstance(values, dict) and
+                all(isinstance(name, str) and name not in RESERVED_PARMS and
+                    isinstance(value, (str, int, float, bool))
+                    for name, value in values.items()))
+
+    if not isinstance(spec, dict):
+        raise AnalysisError('An analysis must be an object with stat_func, parms and property.')
+
+    stat_func = spec.get('stat_func')
+    parms = spec.get('parms', {})
+    stat_property = spec.get('property')
+
+    if not isinstance(stat_property, str):
+        raise AnalysisError('The property to be analyzed is missing.')
+
+    if stat_func in ONE_SET_FUNCS:
+        valid = valid_values(parms)
+    elif stat_func in TWO_SETS_FUNCS:
+        valid = (isinstance(parms, list) and len(parms) == 2 and
+                 all(valid_values(p) for p in parms))
+    elif stat_func in GRID_FUNCS:
+        valid = (isinstance(parms, dict) and isinstance(parms.get('columns'), list) and
+                 all(isinstance(column, str) for column in parms['columns']))
+    elif stat_func in FACTOR_FUNCS:
+        valid = (isinstance(parms, dict) and set(parms) <= {'columns', 'typ'} and
+                 isinstance(parms.get('columns'), list) and
+                 all(isinstance(column, str) for column in parms['columns']) and
+                 parms.get('typ', 2) in (1, 2, 3) and not isinstance(parms.get('typ'), bool))
+    else:
+        raise AnalysisError(f'Unknown analysis: {stat_func}')
+
+    if not valid:
+        raise AnalysisError(f'Invalid parms for {stat_func}. Column names must be strings '
+                            f'(other than {", ".join(sorted(RESERVED_PARMS))}) and their '
+                            f'values single strings or numbers.')
+
+    return stat_func, parms, stat_property
+
+
+def run_batch(source, specs, plot_folder=None, workers=1):
+    """Runs several analyses over the same data frame, in a worker process.
+    The data frame is loaded, and its GroupIndex and binned variables built,
+    once for the whole batch, and kept for later jobs (see load_info). An
+    analysis that fails does not stop the others.
+
+    Arguments
+    ---
+
+    source : tuple or pandas.DataFrame
+        Location of the data in the cache, or the data frame itself
+
+    specs : list
+        (stat_func, parms, property) of each analysis (see parse_spec)
+
+    plot_folder : str
+        Folder of the PlotStore where plots are saved. Plots are not
+        rendered without it
+
+    workers : int
+        Number of processes running pairwise tests of grids
+
+    Returns
+    ---
+
+    list with a (result, plot) tuple for each analysis, or the message of
+    the error it raised"""
+
+    info = load_info(source)
+    data_frame = info.data_frame
+    group_index = info.group_index
+    binned = info.binned
+    plot_store = PlotStore(plot_folder) if plot_folder is not None else None
+
+    outcomes = []
+    for stat_func, parms, stat_property in specs:
+        try:
+            if stat_func in GRID_FUNCS:
+                outcome = run_grid_analysis(data_frame, stat_func, parms['columns'],
+                                            stat_property, workers)
+            else:
+                with stage('analysis', stat_func=stat_func) as span:
+                    span.rows = len(data_frame)
+                    outcome = run_analysis(data_frame, stat_func, parms, stat_property,
+                                           group_index, binned, plot_store)
+        except (AttributeError, KeyError, ValueError) as error:
+            # AnalysisError, or columns missing from the spreadsheet
+            outcome = str(error)
+        except TypeError as error:
+            # Values of the wrong type for their column
+            outcome = f'TypeError: {error}'
+        outcomes.append(outcome)
+
+    return outcomes
@@ -0,0 +1,324 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+class GroupStatistics:
+    """Sufficient statistics of a variable split in groups: number of
+    samples, sum and sum of squares per group. They are obtained in a single
+    vectorized pass over the data, and every ANOVA quantity (SS, DF, F, P)
+    can be derived from them without going back to the samples.
+
+    Groups may be defined by several factors, in which case the statistics
+    are stored per cell in arrays with one axis per factor (empty cells
+    have a count of zero), and marginal statistics of any factor are
+    obtained by summing over the other axes.
+
+    Sums are accumulated over values - shift, which keeps sums of squares
+    well conditioned when the mean is large compared to the spread. None of
+    the derived sums of squares depend on shift.
+
+    Attributes
+    ---
+
+    levels : list
+        Sorted levels of each factor
+
+    counts, sums, sums_sq : np.ndarray
+        Number of samples, sum and sum of squares of (values - shift) for
+        each cell
+
+    shift : float
+        Constant subtracted from the values before accumulating
+    """
+
+    def __init__(self, levels, counts, sums, sums_sq, shift=0.0):
+        self._levels = [np.asarray(level) for level in levels]
+        self._counts = np.asarray(counts, dtype=float)
+        self._sums = np.asarray(sums, dtype=float)
+        self._sums_sq = np.asarray(sums_sq, dtype=float)
+        self._shift = float(shift)
+
+    @classmethod
+    def from_values(cls, values, *groups):
+        """Builds the statistics from samples and their group labels.
+
+        Arguments
+        ---
+
+        values : array-like
+            Numeric samples, without NaN
+
+        groups : array-like
+            Label of each sample for every factor defining the groups
+
+        Returns
+        ---
+
+        GroupStatistics"""
+
+        values = np.asarray(values, dtype=float)
+        factorized = [pd.factorize(np.asarray(group), sort=True) for group in groups]
+        levels = [labels for _, labels in factorized]
+        shape = tuple(len(labels) for labels in levels)
+        codes = np.ravel_multi_index([codes for codes, _ in factorized], shape)
+
+        shift = values[0] if values.size else 0.0
+        centred = values - shift
+        cells = int(np.prod(shape))
+
+        counts = np.bincount(codes, minlength=cells).reshape(shape)
+        sums = np.bincount(codes, weights=centred, minlength=cells).reshape(shape)
+        sums_sq = np.bincount(codes, weights=centred**2, minlength=cells).reshape(shape)
+
+        return cls(levels, counts, sums, sums_sq, shift)
+
+    def marginal(self, *axes):
+        """Returns the statistics grouped by the factors in axes only"""
+        others = tuple(axis for axis in range(self._counts.ndim) if axis not in axes)
+        return GroupStatistics([self._levels[axis] for axis in sorted(axes)],
+                               self._counts.sum(axis=others),
+                               self._sums.sum(axis=others),
+                               self._sums_sq.sum(axis=others),
+                               self._shift)
+
+    @property
+    def levels(self):
+        return self._levels
+
+    @property
+    def labels(self):
+        """Group labels of a statistics built from a single factor"""
+        return self._levels[0]
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def sums(self):
+        return self._sums
+
+    @property
+    def sums_sq(self):
+        return self._sums_sq
+
+    @property
+    def shift(self):
+        return self._shift
+
+    def size(self):
+        return self._counts.sum()
+
+    def means(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._sums / self._counts + self._shift
+
+    def grand_mean(self):
+        return self._sums.sum() / self.size() + self._shift
+
+    def ss_within(self):
+        """Sum of squared deviations from the group means"""
+        nonempty = self._counts > 0
+        return np.sum(self._sums_sq[nonempty] -
+                      self._sums[nonempty]**2 / self._counts[nonempty])
+
+    def ss_total(self):
+        """Sum of squared deviations from the grand mean"""
+        return self._sums_sq.sum() - self._sums.sum()**2 / self.size()
+
+    def ss_between(self):
+        """Sum of squared deviations of the group (or cell) means from the
+        grand mean, weighted by group size"""
+        nonempty = self._counts > 0
+        centred_means = self._sums[nonempty] / self._counts[nonempty]
+        grand = self._sums.sum() / self.size()
+        return np.sum(self._counts[nonempty] * (centred_means - grand)**2)
+
+
+def effect_coding(num_levels):
+    """Sum-to-zero (effect) coding of a factor: one column per level but the
+    last, which is coded as -1 in every column. This coding makes main
+    effects and interactions orthogonal in balanced designs and is required
+    for Type III sums of squares."""
+    return np.vstack([np.eye(num_levels - 1), -np.ones((1, num_levels - 1))])
+
+
+def factorial_terms(num_factors):
+    """All main effects and interactions of a full factorial design, as
+    tuples of factor positions, lower order terms first"""
+    return [term for order in range(1, num_factors + 1)
+            for term in combinations(range(num_factors), order)]
+
+
+def design_matrix(cell_stats):
+    """Builds the compact design matrix of a full factorial model. Rows are
+    the non-empty cells of cell_stats rather than samples, so its size does
+    not depend on the number of samples.
+
+    Returns
+    ---
+
+    np.ndarray with the design matrix, intercept in the first column
+
+    dict mapping each term to the positions of its columns"""
+
+    shape = cell_stats.counts.shape
+    cells = np.nonzero(cell_stats.counts.ravel() > 0)[0]
+    indices = np.unravel_index(cells, shape)
+    coded = [effect_coding(levels)[index] for levels, index in zip(shape, indices)]
+
+    blocks = [np.ones((cells.size, 1))]
+    columns = {}
+    position = 1
+    for term in factorial_terms(len(shape)):
+        block = np.ones((cells.size, 1))
+        for factor in term:
+            # Row-wise Kronecker product gives the interaction columns
+            block = (block[:, :, None] * coded[factor][:, None, :]).reshape(cells.size, -1)
+        blocks.append(block)
+        columns[term] = np.arange(position, position + block.shape[1])
+        position += block.shape[1]
+
+    return np.hstack(blocks), columns
+
+
+def factorial_anova(cell_stats, names, typ=2):
+    """N-way factorial ANOVA for balanced or unbalanced designs.
+
+    The model is fitted by weighted least squares on the cell means, with
+    cell sizes as weights, which gives the same sums of squares as an
+    ordinary least squares fit over all the samples: the residual sum of
+    squares is the within-cell SS plus the weighted lack of fit of the cell
+    means. Empty cells are allowed, and degrees of freedom are taken from
+    the rank of each model.
+
+    Arguments
+    ---
+
+    cell_stats : GroupStatistics
+        Statistics over all the factors
+
+    names : tuple
+        Names of the factors, used to label the table
+
+    typ : int
+        Type of sums of squares: 1 (sequential), 2 (each term adjusted for
+        all terms that do not contain it) or 3 (each term adjusted for all
+        the others). Use 2 by default
+
+    Returns
+    ---
+
+    pandas.DataFrame with SS, DF, F and PR(>F) for every main effect and
+    interaction, plus the residual"""
+
+    if typ not in (1, 2, 3):
+        raise ValueError(f"Unknown type of sums of squares: {typ}")
+
+    design, columns = design_matrix(cell_stats)
+    nonempty = cell_stats.counts > 0
+    weights = np.sqrt(cell_stats.counts[nonempty])
+    cell_means = cell_stats.sums[nonempty] / cell_stats.counts[nonempty]
+
+    weighted_design = design * weights[:, None]
+    weighted_means = cell_means * weights
+
+    def fit(terms):
+        """Residual sum of squares and rank of a model with the given terms"""
+        selected = np.concatenate([[0]] + [columns[term] for term in terms])
+        matrix = weighted_design[:, selected]
+        coefficients, _, rank, _ = np.linalg.lstsq(matrix, weighted_means, rcond=None)
+        residuals = weighted_means - matrix @ coefficients
+        return residuals @ residuals, rank
+
+    terms = list(columns)
+    rss_full, rank_full = fit(terms)
+    ss_residual = cell_stats.ss_within() + rss_full
+    df_residual = int(cell_stats.size()) - rank_full
+
+    ss, df = [], []
+    for position, term in enumerate(terms):
+        if typ == 1:
+            reduced = terms[:position]
+            complete = terms[:position + 1]
+        elif typ == 2:
+            reduced = [other for other in terms
+                       if other != term and not set(term) <= set(other)]
+            complete = reduced + [term]
+        else:
+            reduced = [other for other in terms if other != term]
+            complete = terms
+        rss_reduced, rank_reduced = fit(reduced)
+        rss_complete, rank_complete = fit(complete)
+        ss.append(rss_reduced - rss_complete)
+        df.append(rank_complete - rank_reduced)
+
+    ss = np.array(ss)
+    df = np.array(df)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        f_values = (ss / df) / (ss_residual / df_residual)
+    p_values = stats.f.sf(f_values, df, df_residual)
+
+    results = {'SS': list(ss) + [ss_residual],
+               'DF': list(df) + [df_residual],
+               'F': list(f_values) + [''],
+               'PR(>F)': list(p_values) + ['']}
+    columns = ['SS', 'DF', 'F', 'PR(>F)']
+    index = [':'.join(names[factor] for factor in term) for term in terms]
+
+    return pd.DataFrame(results, columns=columns, index=index + ['Residual'])
+
+
+def one_way_table(group_stats):
+    """Builds a one-way ANOVA table from group statistics.
+
+    Arguments
+    ---
+
+    group_stats : GroupStatistics
+
+    Returns
+    ---
+
+    pandas.DataFrame with SS, DF, F and P for Between, Within and Total"""
+
+    table = factorial_anova(group_stats, ('Between',))
+    ss_between, ss_within = table['SS']
+    df_between, df_within = table['DF']
+
+    results = {'SS': [ss_between, ss_within, ss_between + ss_within],
+               'DF': [df_between, df_within, ''],
+               'F': [table['F'].iloc[0], '', ''],
+               'P': [table['PR(>F)'].iloc[0], '', '']}
+    columns = ['SS', 'DF', 'F', 'P']
+
+    return pd.DataFrame(results, columns=columns, index=['Between',
+                                                         'Within', 'Total'])
+
+
+def two_way_table(cell_stats, names, typ=2):
+    """Builds a two-way ANOVA table, with interaction, from cell statistics.
+
+    Arguments
+    ---
+
+    cell_stats : GroupStatistics
+        Statistics over two factors
+
+    names : tuple
+        Names of the two factors, used to label the table
+
+    typ : int
+        Type of sums of squares (see factorial_anova). All types agree for
+        balanced designs
+
+    Returns
+    ---
+
+    pandas.DataFrame with SS, DF, F and PR(>F) for each factor, their
+    interaction and the residual"""
+
+    return factorial_anova(cell_stats, names, typ)
@@ -0,0 +1,307 @@
+import re
+from functools import wraps
+
+from flask import g, request, jsonify, url_for
+
+from faststat import app, bcrypt, db, metrics
+from faststat.analysis import AnalysisError, parse_spec, run_batch
+from faststat.controller import ALLOWED_EXTENSIONS, data_cache, data_store, job_queue, \
+                                job_source, plot_store, result_cache
+from faststat.db_models import ApiDataset, User
+from faststat.jobs import JobTimeout
+from faststat.memo import result_key
+from faststat.objects import FastStat
+
+# Prefix of the routes of this version of the API
+API_PREFIX = '/api/v1'
+
+# Data sets uploaded through the API are kept in the DataStore under this
+# prefix, the id of their user and their hash, rather than under a browser
+# session
+API_SESSION = 'api:'
+
+# Most analyses accepted in one call
+MAX_SPECS = 100
+
+# Values of a column are listed in its schema only up to this many
+MAX_VALUES = 100
+
+DATA_ID = re.compile(r'[0-9a-f]{64}')
+
+
+def api_error(message, status=400):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+def token_required(view):
+    """Lets only requests with a valid API token in their Authorization
+    header ("Bearer <token>") through, keeping their user in g.api_user.
+    Browser sessions are not accepted, so that other sites cannot make
+    the browser of a logged-in user call the API."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        user = User.from_api_token(token.strip()) if scheme.lower() == 'bearer' else None
+        if user is None:
+            response = api_error('A valid API token is expected in the Authorization header.', 401)
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response
+        g.api_user = user
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def store_key(data_id):
+    return API_SESSION + f'{g.api_user.id}:' + data_id
+
+
+def job_owner():
+    return API_SESSION + str(g.api_user.id)
+
+
+def add_dataset(info):
+    """Records that the current user may use the data set of info"""
+    owned = g.api_user.datasets.filter_by(data_hash=info.data_hash).first()
+    if owned is None:
+        db.session.add(ApiDataset(user=g.api_user, data_hash=info.data_hash,
+                                  file_name=info.file_name))
+        db.session.commit()
+
+
+def api_dataset(data_id):
+    """Returns the FastStat object of a data set the current user uploaded
+    through the API, or None. Data sets released from memory, or uploaded
+    before a restart, are reloaded from the DataCache."""
+
+    if not DATA_ID.fullmatch(data_id):
+        return None
+    owned = g.api_user.datasets.filter_by(data_hash=data_id).first()
+    if owned is None:
+        return None
+
+    key = store_key(data_id)
+    info = data_store.get(key)
+    if info.data_frame is None:
+        info = FastStat.from_cache(data_cache, data_id, owned.file_name)
+        if info is None:
+            data_store.remove(key)
+            return None
+        data_store.put(key, info)
+
+    return info
+
+
+def schema(info):
+    """Description of a data set: its columns and their types, the values of
+    its grouping columns and its variables measured over bins"""
+    from pandas.api.types import is_float_dtype
+
+    data_frame = info.data_frame
+    columns = []
+    for name in data_frame.columns:
+        column = {'name': str(name), 'dtype': str(data_frame[name].dtype)}
+        if not is_float_dtype(data_frame[name].dtype):
+            values = info.group_index.values(name)
+            column['levels'] = len(values)
+            if len(values) <= MAX_VALUES:
+                column['values'] = values
+        columns.append(column)
+
+    return {'id': info.data_hash,
+            'filename': info.file_name,
+            'rows': len(data_frame),
+            'columns': columns,
+            'binned': list(info.binned)}
+
+
+def plot_url(plot):
+    return None if plot is None else url_for('plot_file', digest=plot, _external=True)
+
+
+def outcome_entry(spec, key, outcome):
+    """Entry of one analysis in the response: its spec and cache key, and
+    its structured result and plot, or the error that stopped it"""
+
+    stat_func, parms, stat_property = spec
+    entry = {'stat_func': stat_func, 'parms': parms, 'property': stat_property, 'key': key}
+    if isinstance(outcome, str):
+        entry.update(status='failed', error=outcome)
+    else:
+        result, plot = outcome
+        entry.update(status='done', result=result, plot=plot_url(plot))
+    return entry
+
+
+@app.route(API_PREFIX + '/token', methods=['POST'])
+def api_token():
+    """Returns a new API token for the user whose email and password are
+    given as a JSON object. The previous token of the user stops working."""
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error('Expected a JSON object with email and password.')
+
+    user = User.query.filter_by(email=str(body.get('email', ''))).first()
+    if user is None or not bcrypt.check_password_hash(user.password, str(body.get('password', ''))):
+        return api_error('Wrong email or password.', 401)
+
+    token = user.new_api_token()
+    db.session.commit()
+    response = jsonify(token=token)
+    response.status_code = 201
+    return response
+
+
+@app.route(API_PREFIX + '/datasets', methods=['POST'])
+@token_required
+def api_upload():
+    """Uploads a spreadsheet, given as the 'file' field of a multipart form.
+    Returns the id and schema of the data set"""
+
+    upload = request.files.get('file')
+    if upload is None or '.' not in upload.filename or \
+            upload.filename.rsplit('.', 1)[1] not in ALLOWED_EXTENSIONS:
+        return api_error('A spreadsheet (xls or xlsx) is expected in the file field.')
+
+    try:
+        info = FastStat(file=upload, cache=data_cache)
+    except Exception as error:
+        # Any failure to parse the file is reported to the client
+        return api_error(f'Could not read spreadsheet: {error}')
+
+    add_dataset(info)
+    data_store.put(store_key(info.data_hash), info)
+    response = jsonify(schema(info))
+    response.status_code = 201
+    return response
+
+
+@app.route(API_PREFIX + '/datasets/<data_id>/rows', methods=['POST'])
+@token_required
+def api_append(data_id):
+    """Adds the rows of a spreadsheet with the same columns, given as the
+    'file' field of a multipart form, to a data set. The result is a new
+    data set, whose id and schema are returned; the original one is still
+    available under its id"""
+
+    info = api_dataset(data_id)
+    if info is None:
+        return api_error('Unknown data set.', 404)
+
+    upload = request.files.get('file')
+    if upload is None or '.' not in upload.filename or \
+            upload.filename.rsplit('.', 1)[1] not in ALLOWED_EXTENSIONS:
+        return api_error('A spreadsheet (xls or xlsx) is expected in the file field.')
+
+    # Appended to a copy, as other requests may be using the original
+    info = FastStat.from_frame(info.data_frame, info.data_hash, info.file_name)
+    try:
+        added = info.append(upload, data_cache)
+    except ValueError as error:
+        return api_error(str(error))
+    except Exception as error:
+        return api_error(f'Could not read spreadsheet: {error}')
+
+    add_dataset(info)
+    data_store.put(store_key(info.data_hash), info)
+    response = jsonify(dict(schema(info), previous=data_id, added=added))
+    response.status_code = 201
+    return response
+
+
+@app.route(API_PREFIX + '/datasets/<data_id>')
+@token_required
+def api_dataset_schema(data_id):
+    info = api_dataset(data_id)
+    if info is None:
+        return api_error('Unknown data set.', 404)
+    return jsonify(schema(info))
+
+
+@app.route(API_PREFIX + '/datasets/<data_id>/analyses', methods=['POST'])
+@token_required
+def api_analyses(data_id):
+    """Runs a batch of analyses over a data set. The body is a JSON object
+    with a list of analyses, each with stat_func, parms and property (see
+    analysis.parse_spec). Results already known are returned right away;
+    when some must be computed, they run as a single job and the response
+    points to it."""
+
+    info = api_dataset(data_id)
+    if info is None:
+        return api_error('Unknown data set.', 404)
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('analyses'), list):
+        return api_error('Expected a JSON object with a list of analyses.')
+    if not 0 < len(body['analyses']) <= MAX_SPECS:
+        return api_error(f'Between 1 and {MAX_SPECS} analyses are accepted per call.')
+
+    specs = []
+    for position, spec in enumerate(body['analyses']):
+        try:
+            specs.append(parse_spec(spec))
+        except AnalysisError as error:
+            return api_error(f'Analysis {position}: {error}')
+
+    keys = [result_key(info.data_hash, *spec) for spec in specs]
+    outcomes = [result_cache.get(key) for key in keys]
+    pending = [position for position, outcome in enumerate(outcomes) if outcome is None]
+    for (stat_func, _, _), outcome in zip(specs, outcomes):
+        metrics.analyses_total.inc(stat_func=stat_func, source='job' if outcome is None else 'cache')
+
+    if not pending:
+        return jsonify(id=None, status='done',
+                       analyses=[outcome_entry(spec, key, outcome)
+                                 for spec, key, outcome in zip(specs, keys, outcomes)])
+
+    source = job_source(info)
+
+    job_id = job_queue.submit(run_batch, source, [specs[position] for position in pending],
+                              plot_store.folder, app.config['GRID_WORKERS'],
+                              meta={'api': True, 'owner': job_owner(),
+                                    'specs': specs, 'keys': keys,
+                                    'outcomes': outcomes, 'pending': pending})
+
+    response = jsonify(id=job_id, status=job_queue.status(job_id),
+                       url=url_for('api_job', job_id=job_id, _external=True))
+    response.status_code = 202
+    return response
+
+
+@app.route(API_PREFIX + '/jobs/<job_id>')
+@token_required
+def api_job(job_id):
+    """Status of a batch of analyses, with their results once finished"""
+
+    job = job_queue.get(job_id)
+    if job is None or not job.meta.get('api') or job.meta.get('owner') != job_owner():
+        return api_error('Unknown job.', 404)
+
+    status = job.status()
+    if status in ('pending', 'running'):
+        return jsonify(id=job_id, status=status)
+
+    try:
+        computed = job_queue.result(job_id)
+    except (AnalysisError, JobTimeout) as error:
+        return jsonify(id=job_id, status=status, error=str(error))
+    except Exception as error:
+        app.logger.exception('Job %s failed', job_id)
+        return jsonify(id=job_id, status='failed', error=f'{type(error).__name__}: {error}')
+
+    meta = job.meta
+    outcomes = list(meta['outcomes'])
+    # Only the first request for a finished job stores its results
+    store = job_queue.claim(job_id)
+    for position, outcome in zip(meta['pending'], computed):
+        outcomes[position] = outcome
+        if store and not isinstance(outcome, str):
+            result_cache.put(meta['keys'][position], *outcome)
+
+    return jsonify(id=job_id, status=status,
+                   analyses=[outcome_entry(spec, key, outcome) for spec, key, outcome
+                             in zip(meta['specs'], meta['keys'], outcomes)])
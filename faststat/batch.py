@@ -0,0 +1,257 @@
+"""Runs analyses over a directory of spreadsheets from the command line.
+
+    python -m faststat.batch DIRECTORY --spec SPEC.json --output RESULTS.csv
+
+The spec file holds a list of analyses, each with stat_func, parms and
+property, as accepted by the JSON API (see analysis.parse_spec). Every
+analysis is run on every spreadsheet, spreadsheets being processed in
+parallel, and all results are written to a single CSV, JSON or Parquet
+file, chosen by the extension of the output."""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from faststat.analysis import AnalysisError, parse_spec, run_batch
+from faststat.objects import FastStat
+from faststat.results import result_records
+
+# Spreadsheets picked up in the input directory
+EXTENSIONS = ('.xls', '.xlsx')
+
+OUTPUT_FORMATS = ('csv', 'json', 'parquet')
+
+
+def find_workbooks(directory):
+    """Paths of the spreadsheets in directory, sorted by name. Temporary
+    files left by Excel (~$...) are skipped."""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(EXTENSIONS) and not name.startswith('~$'))
+
+
+def load_specs(spec_file):
+    """Reads and checks the analyses of a spec file: a JSON list of
+    analyses, or an object with the list under 'analyses'. Invalid analyses
+    are reported as failed for every spreadsheet, the others still run.
+
+    Returns
+    ---
+
+    list with the (stat_func, parms, property) of each analysis, as given
+    for invalid ones, and dict with the error of each invalid analysis by
+    its position"""
+
+    with open(spec_file) as handle:
+        specs = json.load(handle)
+    if isinstance(specs, dict):
+        specs = specs.get('analyses')
+    if not isinstance(specs, list) or not specs:
+        raise AnalysisError('The spec file must hold a list of analyses.')
+
+    parsed = []
+    invalid = {}
+    for position, spec in enumerate(specs):
+        try:
+            parsed.append(parse_spec(spec))
+        except AnalysisError as error:
+            invalid[position] = f'Invalid analysis: {error}'
+            if isinstance(spec, dict):
+                parsed.append((spec.get('stat_func'), spec.get('parms'), spec.get('property')))
+            else:
+                parsed.append((None, spec, None))
+    return parsed, invalid
+
+
+def process_workbook(path, specs, plot_folder=None, invalid=None):
+    """Reads a spreadsheet and runs every valid analysis on it. Those in
+    invalid (see load_specs) get their error as outcome.
+
+    Returns
+    ---
+
+    dict with the path, the time taken in seconds, and the outcome of each
+    analysis (see analysis.run_batch), or the error that prevented reading
+    the spreadsheet"""
+
+    start = time.perf_counter()
+    try:
+        invalid = invalid or {}
+        data_frame = FastStat().read_data(path)
+        valid = [position for position in range(len(specs)) if position not in invalid]
+        computed = iter(run_batch(data_frame, [specs[position] for position in valid],
+                                  plot_folder))
+        outcomes = [invalid[position] if position in invalid else next(computed)
+                    for position in range(len(specs))]
+        error = None
+    except Exception as exception:
+        # A bad spreadsheet must not stop the rest of the run
+        outcomes = []
+        error = f'{type(exception).__name__}: {exception}'
+
+    return {'file': path, 'seconds': time.perf_counter() - start,
+            'outcomes': outcomes, 'error': error}
+
+
+def run_directory(paths, specs, workers=None, plot_folder=None, progress=None, invalid=None):
+    """Processes spreadsheets in a process pool, one spreadsheet per task.
+
+    Arguments
+    ---
+
+    paths : list
+        Spreadsheets to be processed
+
+    specs : list
+        (stat_func, parms, property) of each analysis
+
+    workers : int
+        Number of processes. Use one per CPU by default, and run in this
+        process if 1
+
+    plot_folder : str
+        Folder where plots are saved. Plots are not rendered without it
+
+    progress : callable
+        Called with the number of spreadsheets done, their total and the
+        report of the last one (see process_workbook)
+
+    invalid : dict
+        Error of each invalid analysis by its position (see load_specs)
+
+    Returns
+    ---
+
+    list with the report of each spreadsheet, in the order of paths"""
+
+    reports = {}
+
+    if workers == 1:
+        for path in paths:
+            reports[path] = process_workbook(path, specs, plot_folder, invalid)
+            if progress is not None:
+                progress(len(reports), len(paths), reports[path])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_workbook, path, specs, plot_folder, invalid)
+                       for path in paths]
+            for future in as_completed(futures):
+                report = future.result()
+                reports[report['file']] = report
+                if progress is not None:
+                    progress(len(reports), len(paths), report)
+
+    return [reports[path] for path in paths]
+
+
+def records(reports, specs):
+    """Flattens the reports into one table with a row per value: the
+    spreadsheet, the analysis and the value (see results.result_records).
+    Failed analyses and spreadsheets get a single row holding the error."""
+
+    rows = []
+    for report in reports:
+        name = os.path.basename(report['file'])
+        if report['error'] is not None:
+            rows.append({'file': name, 'error': report['error']})
+            continue
+
+        for (stat_func, parms, stat_property), outcome in zip(specs, report['outcomes']):
+            analysis = {'file': name, 'stat_func': stat_func,
+                        'parms': json.dumps(parms, default=str), 'property': stat_property}
+            if isinstance(outcome, str):
+                rows.append(dict(analysis, error=outcome))
+                continue
+            for record in result_records(outcome[0]):
+                rows.append(dict(analysis, **record))
+
+    columns = ['file', 'stat_func', 'parms', 'property', 'section', 'row', 'column',
+               'value', 'error']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def write_results(reports, specs, output, output_format):
+    """Writes the results of all spreadsheets to output. JSON keeps the
+    structured results of every analysis; CSV and Parquet hold the flat
+    table built by records."""
+
+    if output_format == 'json':
+        documents = []
+        for report in reports:
+            analyses = []
+            for (stat_func, parms, stat_property), outcome in zip(specs, report['outcomes']):
+                analysis = {'stat_func': stat_func, 'parms': parms, 'property': stat_property}
+                if isinstance(outcome, str):
+                    analysis['error'] = outcome
+                else:
+                    analysis['result'], analysis['plot'] = outcome
+                analyses.append(analysis)
+            documents.append({'file': os.path.basename(report['file']),
+                              'seconds': report['seconds'],
+                              'error': report['error'],
+                              'analyses': analyses})
+        with open(output, 'w') as handle:
+            json.dump(documents, handle, indent=1, default=str)
+
+    elif output_format == 'parquet':
+        records(reports, specs).to_parquet(output, index=False)
+
+    else:
+        records(reports, specs).to_csv(output, index=False)
+
+
+def report_progress(done, total, report):
+    status = 'failed: ' + report['error'] if report['error'] else 'ok'
+    print(f"[{done}/{total}] {os.path.basename(report['file'])} "
+          f"{report['seconds']:.2f}s {status}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m faststat.batch',
+                                     description='Runs FastStat analyses over a directory of spreadsheets.')
+    parser.add_argument('directory', help='directory with xls/xlsx files')
+    parser.add_argument('--spec', required=True, help='JSON file with the analyses to run')
+    parser.add_argument('--output', required=True, help='results file (.csv, .json or .parquet)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        help='output format, taken from the output extension by default')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes, one per CPU by default')
+    parser.add_argument('--plots', default=None,
+                        help='directory where plots are saved; no plots are rendered without it')
+    args = parser.parse_args(argv)
+
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if output_format not in OUTPUT_FORMATS:
+        parser.error(f'Unknown output format: {output_format}')
+
+    try:
+        specs, invalid = load_specs(args.spec)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    for position, error in sorted(invalid.items()):
+        print(f'Analysis {position}: {error}', file=sys.stderr)
+    if len(invalid) == len(specs):
+        parser.error('None of the analyses in the spec file is valid.')
+
+    paths = find_workbooks(args.directory)
+    if not paths:
+        parser.error(f'No spreadsheets found in {args.directory}')
+
+    start = time.perf_counter()
+    reports = run_directory(paths, specs, args.workers, args.plots, report_progress, invalid)
+    write_results(reports, specs, args.output, output_format)
+
+    failed = sum(report['error'] is not None for report in reports)
+    print(f'{len(paths)} spreadsheets, {failed} failed, '
+          f'{time.perf_counter() - start:.2f}s. Results written to {args.output}',
+          file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class DataCache:
+    """Content-addressed, on-disk cache of parsed spreadsheets. Uploads are
+    identified by the SHA-256 of their bytes, parsed once by
+    FastStat.read_data and stored as uncompressed Arrow (Feather v2) files,
+    so later uploads of the same workbook are memory mapped instead of being
+    parsed again by openpyxl/xlrd.
+
+    The cache is bounded in size: whenever it grows past max_bytes, the
+    least recently used files are removed, except those protected (see
+    protect), which may keep it over budget.
+
+    Attributes
+    ---
+
+    folder : str
+        Directory where cached files are kept
+
+    max_bytes : int
+        Upper bound for the total size of the cached files
+    """
+
+    EXTENSION = '.arrow'
+
+    def __init__(self, folder, max_bytes=512 * 1000 * 1000):
+        self._folder = folder
+        self._max_bytes = max_bytes
+        self._protected = None
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def digest(content, **options):
+        """Returns the hex SHA-256 of the uploaded bytes and of the options
+        they are parsed with, if any (see FastStat.read_data), so that the
+        same file parsed differently is cached separately"""
+        digest = hashlib.sha256(content)
+        if options:
+            digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self._folder, digest + self.EXTENSION)
+
+    def __contains__(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def load(self, digest):
+        """Memory maps a cached data frame.
+
+        Arguments
+        ---
+
+        digest : str
+            Content hash of the uploaded file
+
+        Returns
+        ---
+
+        pd.DataFrame, or None if the file is not cached or cannot be read.
+        Unreadable files (truncated, corrupt) are removed, so that the next
+        store writes them again"""
+
+        # pyarrow is only loaded once data is read or written
+        from pyarrow import feather
+
+        path = self.path(digest)
+        try:
+            data_frame = feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # pyarrow.ArrowInvalid is a ValueError
+            logger.warning('Removing unreadable cached data %s', digest, exc_info=True)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        # Refresh the access time used by the eviction policy
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return data_frame
+
+    def store(self, digest, data_frame):
+        """Writes a parsed data frame to the cache and evicts old entries if
+        the cache is over budget. Frames that cannot be represented in Arrow
+        (e.g. non-string column names) are silently not cached.
+
+        Returns
+        ---
+
+        bool telling whether the frame was cached"""
+
+        from pyarrow import feather
+
+        handle, tmp_path = tempfile.mkstemp(dir=self._folder, suffix='.tmp')
+        os.close(handle)
+        try:
+            feather.write_feather(data_frame, tmp_path, compression='uncompressed')
+            # Atomic, so concurrent workers never read a partial file
+            os.replace(tmp_path, self.path(digest))
+        except (ValueError, TypeError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        self.evict(keep=digest)
+        return True
+
+    def protect(self, digests):
+        """Registers a callable returning the digests whose files must not be
+        evicted, e.g. those of the data released by a DataStore"""
+        self._protected = digests
+
+    def evict(self, keep=None):
+        """Removes least recently used files, other than the one of keep and
+        those protected, until the cache fits in max_bytes"""
+
+        protected = self._protected() if self._protected is not None else set()
+        protected.add(keep)
+        entries = []
+        for name in os.listdir(self._folder):
+            if not name.endswith(self.EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._folder, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            if name[:-len(self.EXTENSION)] in protected:
+                continue
+            try:
+                os.remove(os.path.join(self._folder, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @property
+    def folder(self):
+        return self._folder
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
@@ -1,15 +1,14 @@
+import numpy as np
 from numpy import mean, std, loadtxt, where
-from io import BytesIO
-import base64
 import os
-import urllib
 from scipy import stats
-from statsmodels.graphics.factorplots import interaction_plot
-import statistics
-import matplotlib.pyplot as plt
 import pandas as pd
 
-from faststat.dataparse import bin_dataframe_generator, bins_subset, DataSet
+from faststat.anova import GroupStatistics, factorial_anova, one_way_table, two_way_table
+from faststat.dataparse import BinnedVariable
+from faststat.metrics import timed
+from faststat.resampling import RESAMPLES, SEED, bootstrap_intervals, permutation_test
+from faststat.results import summary_section, table_section, test_entry, tests_section
 
 
 def check_outliers(filtered, unfiltered):
@@ -19,8 +18,9 @@ def check_outliers(filtered, unfiltered):
         return where(comparison is False)
 
 
+@timed('display_stat_info')
 def display_stat_info(dataset):
-    """Displays basic statistic information for a data series: means, standard deviation,
+    """Basic statistic information for a data series: means, standard deviation,
     s.e.m., medians and quantiles.
 
     Arguments:
@@ -29,29 +29,25 @@ def display_stat_info(dataset):
 
     Returns:
     ---
-    str in HTML format with results."""
+    dict with a summary section (see results.summary_section)."""
 
-    if dataset.data_set.empty:
+    if dataset.sampling_size() == 0:
         return None
 
+    values = [('No. of samples', dataset.sampling_size())]
+    if dataset.isnormal():
+        values += [('Mean', dataset.mean_value()),
+                   ('Standard deviation', dataset.std_value()),
+                   ('Standard error of the mean', dataset.sem_value())]
     else:
+        values += [('Median', dataset.median_value()),
+                   ('Quantile 25%', dataset.quantile25_value()),
+                   ('Quantile 75%', dataset.quantile75_value())]
 
-        stat_info = "<h3>Statistical Info</h3> <br/>"
-        stat_info += f"Dataset: '{dataset.name}'<br />"
-        stat_info += f'No. of samples: {dataset.sampling_size()}<br />'
-
-        if dataset.isnormal():
-            stat_info += f'Mean: {dataset.mean_value()}<br />'
-            stat_info += f'Standard deviation: {dataset.std_value()}<br />'
-            stat_info += f'Standard error of the mean: {dataset.sem_value()}\n<br />'
-        else:
-            stat_info += f'Median: {dataset.median_value()}<br />'
-            stat_info += f'Quantile 25%: {dataset.quantile25_value()}<br />'
-            stat_info += f'Quantile 75%: {dataset.quantile75_value()}\n<br />'
-
-    return stat_info
+    return summary_section('Statistical Info', dataset.name, values)
 
 
+@timed('null_hypothesis_tests')
 def null_hypothesis_tests(dataset_a, dataset_b):
     """Checks for normality of data. If the data are normally 
     distributed, performs Student's t-test. Else, performs 
@@ -64,22 +60,60 @@ def null_hypothesis_tests(dataset_a, dataset_b):
 
     Returns:
     ---
-    str in HTML with results of normality tests"""
+    dict with a tests section (see results.tests_section)"""
 
-    stat_info = "<h3>Null Hypothesis Tests</h3> <br/>"
-    if dataset_a.isnormal() and dataset_b.isnormal():
-        t_t_test, p_t_test = stats.ttest_ind(dataset_a.data_set, dataset_b.data_set)
-        stat_info += f"Student's t-test results: t = {t_t_test}, P = {p_t_test}\n<br/>"
+    # t-test is performed even if data are not normal
+    t_t_test, p_t_test = stats.ttest_ind(dataset_a.values, dataset_b.values)
+    tests = [test_entry("Student's t-test", 't', t_t_test, p_t_test)]
 
-    else:
-        t_t_test, p_t_test = stats.ttest_ind(dataset_a.data_set,
-                                             dataset_b.data_set)  # performs t-test even if not normal
-        u_rank_sums, p_rank_sums = stats.ranksums(dataset_a.data_set, dataset_b.data_set)
-        stat_info += f"Student's t-test results: t = {t_t_test}, P = {p_t_test}<br/>"
-        stat_info += f"Wilcoxon rank-sum results: u = {u_rank_sums}, P = {p_rank_sums}<br/>"
-    return stat_info
+    if not (dataset_a.isnormal() and dataset_b.isnormal()):
+        u_rank_sums, p_rank_sums = stats.ranksums(dataset_a.values, dataset_b.values)
+        tests.append(test_entry('Wilcoxon rank-sum', 'u', u_rank_sums, p_rank_sums))
+
+    return tests_section('Null Hypothesis Tests', tests)
+
+
+@timed('resampling_tests')
+def resampling_tests(dataset_a, dataset_b, resamples=RESAMPLES, seed=SEED, workers=1):
+    """Permutation tests of the difference of means and of medians between
+    two data sets, and bootstrap confidence intervals of those differences
+    and of the effect size. Unlike the t-test, they make no assumption on
+    the distribution of the data.
+
+    Arguments:
+    ---
+    dataset_a, b: two DataSet type objects
+
+    resamples: int
+        Number of permutations, and of bootstrap resamples
+
+    seed: int
+        Seed of the random generators, so that results can be reproduced
+
+    workers: int
+        Number of processes drawing resamples (see resampling.run_chunks)
+
+    Returns:
+    ---
+    list with a tests section and a table section (see results)"""
+
+    permutation = permutation_test(dataset_a.values, dataset_b.values, resamples, seed, workers)
+    tests = [test_entry('Permutation (mean difference)', 'difference', *permutation['mean']),
+             test_entry('Permutation (median difference)', 'difference', *permutation['median'])]
+
+    intervals = bootstrap_intervals(dataset_a.values, dataset_b.values, resamples,
+                                    seed=seed, workers=workers)
+    table = pd.DataFrame([intervals['mean'], intervals['median'], intervals['effect_size']],
+                         index=['Mean difference', 'Median difference', "Effect size (Cohen's d)"],
+                         columns=['Estimate', 'CI 2.5%', 'CI 97.5%'])
 
+    return [tests_section('Permutation Tests', tests,
+                          [f'P-values estimated from {resamples} permutations.']),
+            table_section('Bootstrap Confidence Intervals', table, statistic='Estimate',
+                          p_column=None)]
 
+
+@timed('normality_tests')
 def normality_tests(dataset_a, dataset_b):
     """Performs Shapiro-Wilk for each data set as input. and Levene 
     tests to assess equality variance between them.
@@ -90,39 +124,43 @@ def normality_tests(dataset_a, dataset_b):
     
     Returns:
     ---
-    str in HTML with results of normality tests"""
-
-    stat_info = "<h3>Normality Tests</h3> <br/>"
-    w_shapiro_wilk_a, p_shapiro_wilk_a = stats.shapiro(dataset_a.data_set)
-    stat_info += "Shapiro-Wilk test results for dataset {0}: <br/> W = {1}, P = {2}".format(dataset_a.name,
-                                                                                            w_shapiro_wilk_a,
-                                                                                            p_shapiro_wilk_a) + "<br/>"
+    dict with a tests section (see results.tests_section)"""
 
-    w_shapiro_wilk_b, p_shapiro_wilk_b = stats.shapiro(dataset_b.data_set)
-    stat_info += "Shapiro-Wilk test results for dataset {0}: <br/> W = {1}, P = {2}".format(dataset_b.name,
-                                                                                            w_shapiro_wilk_b,
-                                                                                            p_shapiro_wilk_b) + "<br/>"
+    w_shapiro_wilk_a, p_shapiro_wilk_a = stats.shapiro(dataset_a.values)
+    w_shapiro_wilk_b, p_shapiro_wilk_b = stats.shapiro(dataset_b.values)
+    w_levene, p_levene = stats.levene(dataset_a.values, dataset_b.values)
 
-    w_levene, p_levene = stats.levene(dataset_a.data_set, dataset_b.data_set)
-    stat_info += f"Levene test results: <br/> W = {w_levene}, P = {p_levene}<br/>"
+    tests = [test_entry('Shapiro-Wilk', 'W', w_shapiro_wilk_a, p_shapiro_wilk_a, dataset_a.name),
+             test_entry('Shapiro-Wilk', 'W', w_shapiro_wilk_b, p_shapiro_wilk_b, dataset_b.name),
+             test_entry('Levene', 'W', w_levene, p_levene)]
+    notes = []
 
     if p_shapiro_wilk_a < 0.05:
-        stat_info += f"Data set '{dataset_a.name}' failed Shapiro-Wilk test.<br/>"
+        notes.append(f"Data set '{dataset_a.name}' failed Shapiro-Wilk test.")
         dataset_a._isnormal = False
 
     if p_shapiro_wilk_b < 0.05:
-        stat_info += f"Data set '{dataset_b.name}' failed Shapiro-Wilk test.<br/>"
+        notes.append(f"Data set '{dataset_b.name}' failed Shapiro-Wilk test.")
         dataset_b._isnormal = False
 
     if p_levene < 0.05:
-        stat_info += "Data sets failed Levene normality test.\n<br/>"
+        notes.append("Data sets failed Levene normality test.")
         dataset_a._isnormal = False
         dataset_b._isnormal = False
 
-    return stat_info
+    return tests_section('Normality Tests', tests, notes)
+
 
+def binned_subset(data_frame, bin_var, binned=None):
+    """Returns the bins of bin_var for the rows of data_frame, from the
+    BinnedVariable built at ingest if there is one"""
+    if binned is None:
+        return BinnedVariable.from_frame(data_frame, bin_var)
+    return binned.take(data_frame.index)
 
-def one_way_anova(data_frame, bin_var):
+
+@timed('one_way_anova')
+def one_way_anova(data_frame, bin_var, binned=None):
     """Performs regular one-way ANOVA for a given feature measured over variables with multiple bins.
 
     Arguments
@@ -134,58 +172,54 @@ def one_way_anova(data_frame, bin_var):
     bin_var: str 
         Name of bin variable
 
+    binned: BinnedVariable
+        Bins of bin_var over the whole spreadsheet. Optional, they are
+        extracted from data_frame if not given
+
     Returns
     ---
     pandas.DataFrame:
         A table with ANOVA information"""
 
-    # counts number of bins for given bin variable
-    bin_num = data_frame.columns.str.contains(bin_var + ' bin ').sum()
-    subdataset = DataSet(data_frame,
-                         data_frame.columns[data_frame.columns.get_loc(bin_var + ' bin 1') + bin_num])
-    anova_dataset = bin_dataframe_generator(bins_subset(data_frame, bin_var),
-                                            bin_var)
-    bin_list = anova_dataset['bin'].unique()
-    bin_size = [anova_dataset[anova_dataset['bin'] == b][bin_var].shape[0] for b in bin_list]
-    bin_avg_size = statistics.mean(bin_size)
-    bin_size.insert(0, 0)
-    bin_mean = [anova_dataset[anova_dataset['bin'] == b][bin_var].mean() for b in bin_list]
-    bin_mean.insert(0, 0)
+    values, bins, _ = binned_subset(data_frame, bin_var, binned).long_format()
+    group_stats = GroupStatistics.from_values(values, bins)
 
-    # Number of samples and mean of all samples
-    n = len(anova_dataset[bin_var])
-    grand_mean = anova_dataset[bin_var].mean()
+    return one_way_table(group_stats)
 
-    # Degrees of freedom - df
-    df_within = sum(bin_size) - bin_num
-    df_between = bin_num - 1
 
-    # Calculating properties between groups
-    ms_within = sum([sum((anova_dataset[anova_dataset['bin'] == b][bin_var] -
-                       bin_mean[b])**2)/(bin_size[b]-1) for b in bin_list]) / bin_num
-    ss_within = ms_within * df_within
+@timed('n_way_anova')
+def n_way_anova(data_frame, response, factors, typ=2):
+    """Performs factorial ANOVA with any number of factors, balanced or
+    not, including all interactions between factors.
 
-    ss_tot = sum([sum((anova_dataset[anova_dataset['bin'] == b][bin_var]**2))
-                  for b in bin_list]) - n * grand_mean**2
-    ss_between = ss_tot - ss_within
+    Arguments
+    ---
+    data_frame: pandas.DataFrame
+        Data in long format, one sample per row
 
+    response: str
+        Name of the measured variable
 
-    anova_list = [anova_dataset[anova_dataset['bin'] == b][bin_var] for b in bin_list]
-    f_one_way_anova, p_one_way_anova = stats.f_oneway(*anova_list)
+    factors: list
+        Names of the columns defining the groups
 
-    results = {'SS': [ss_between, ss_within, ss_tot],
-               'DF': [df_between, df_within, ''],
-               'F': [f_one_way_anova, '', ''],
-               'P': [p_one_way_anova, '', '']}
-    columns = ['SS', 'DF', 'F', 'P']
+    typ: int
+        Type of sums of squares (1, 2 or 3). Use 2 by default
 
-    anova_table = pd.DataFrame(results, columns=columns, index=['Between',
-                                                                'Within', 'Total'])
+    Returns
+    ---
+    pandas.DataFrame with ANOVA information"""
+
+    data_frame = data_frame.dropna(subset=[response] + list(factors))
+    cell_stats = GroupStatistics.from_values(data_frame[response],
+                                             *[data_frame[factor] for factor in factors])
 
-    return anova_table
+    return factorial_anova(cell_stats, tuple(factors), typ)
 
 
-def two_way_anova(dataframe_a, dataframe_b, parameter, parm_val_a, parm_val_b, bin_var):
+@timed('two_way_anova')
+def two_way_anova(dataframe_a, dataframe_b, parameter, parm_val_a, parm_val_b, bin_var,
+                  binned=None):
     """Performs regular two-way ANOVA for a given feature measured over bins.
 
     Arguments
@@ -201,93 +235,30 @@ def two_way_anova(dataframe_a, dataframe_b, parameter, parm_val_a, parm_val_b, b
         Value for the chosen parameter
     :arg bin_var: str representing name of bin variable
 
+    binned: BinnedVariable
+        Bins of bin_var over the whole spreadsheet. Optional, they are
+        extracted from the data frames if not given
+
     Returns
     ---
-    pandas.DataFrame with ANOVA information"""
-
-    # counts number of bins for given bin variable
-    bin_num = dataframe_a.columns.str.contains(bin_var + ' bin ').sum() 
-
-    subdataset_a = DataSet(dataframe_a,
-                           dataframe_a.columns[dataframe_a.columns.get_loc(bin_var + ' bin 1') + bin_num])
-    subdataset_b = DataSet(dataframe_b,
-                           dataframe_b.columns[dataframe_b.columns.get_loc(bin_var + ' bin 1') + bin_num])
-    bin_dataset_a = bin_dataframe_generator(bins_subset(subdataset_a.data_frame, bin_var),
-                            bin_var)
-
-    bin_dataset_b = bin_dataframe_generator(bins_subset(subdataset_b.data_frame, bin_var),
-                            bin_var)
-    bin_dataset_a[parameter] = parm_val_a
-    bin_dataset_b[parameter] = parm_val_b
-    anova_dataset = bin_dataset_a.append(bin_dataset_b)
-
-    fig = interaction_plot(anova_dataset['bin'],
-                           anova_dataset[parameter],
-                           anova_dataset[bin_var],
-                           colors=['red', 'blue'],
-                           markers=['D', '^'], ms=10)
-
-    figfile = BytesIO()
-    plt.savefig(figfile, format='png')
-    figfile.seek(0)
-    figdata_png = base64.b64encode(figfile.getvalue())
-
-    # Degrees of freedom - df
-
-    n = len(anova_dataset[bin_var])
-    df_a = len(anova_dataset['bin'].unique()) - 1
-    df_b = len(anova_dataset[parameter].unique()) - 1
-    dfaxb = df_a * df_b
-    df_within = n - (len(anova_dataset['bin'].unique()) * len(anova_dataset[parameter].unique()))
-
-    # Sum of squares - ssq (factors A, B and total)
-
-    grand_mean = anova_dataset[bin_var].mean()
-    ssq_a = sum([(anova_dataset[anova_dataset[parameter] == l][bin_var].mean() - grand_mean) ** 2 for l in
-                anova_dataset[parameter]])
-    ssq_b = sum(
-        [(anova_dataset[anova_dataset['bin'] == l][bin_var].mean() -
-          grand_mean) ** 2 for l in anova_dataset['bin']])
-    ssq_total = sum((anova_dataset[bin_var] - grand_mean) ** 2)
-
-    # Sum of Squares Within (error/residual)
-
-    bin_means_a = [bin_dataset_a[bin_dataset_a['bin'] == d][bin_var].mean() for d in bin_dataset_a['bin']]
-    bin_means_b = [bin_dataset_b[bin_dataset_b['bin'] == d][bin_var].mean() for d in bin_dataset_b['bin']]
-    ssq_within = sum((bin_dataset_b[bin_var] - bin_means_b) ** 2) + sum((bin_dataset_a[bin_var] - bin_means_a) ** 2)
-
-    # Sum of Squares Interaction
-
-    ssqaxb = ssq_total - ssq_a - ssq_b - ssq_within
-
-    # Mean Squares
-
-    ms_a = ssq_a / df_a
-    ms_b = ssq_b / df_b
-    ms_ax_b = ssqaxb / dfaxb
-    ms_within = ssq_within / df_within
-
-    # F-ratio
-
-    f_a = ms_a / ms_within
-    f_b = ms_b / ms_within
-    faxb = ms_ax_b / ms_within
-
-    # Obtaining p-values
-
-    p_a = stats.f.sf(f_a, df_a, df_within)
-    p_b = stats.f.sf(f_b, df_b, df_within)
-    paxb = stats.f.sf(faxb, dfaxb, df_within)
-
-    # table with results from ANOVA
-
-    results = {'SS': [ssq_a, ssq_b, ssqaxb, ssq_within],
-               'DF': [df_a, df_b, dfaxb, df_within],
-               'F': [f_a, f_b, faxb, ''],
-               'PR(>F)': [p_a, p_b, paxb, '']}
-    columns = ['SS', 'DF', 'F', 'PR(>F)']
-
-    return pd.DataFrame(results, columns=columns,
-                        index=[parameter, 'bin',
-                               parameter + ':bin', 'Residual']), urllib.parse.quote(figdata_png)
-
+    pandas.DataFrame with ANOVA information, and a pandas.DataFrame with the
+    mean of bin_var for each bin and parameter value, used for the
+    interaction plot (see plots.render_interaction_plot)"""
+
+    values_a, bins_a, _ = binned_subset(dataframe_a, bin_var, binned).long_format()
+    values_b, bins_b, _ = binned_subset(dataframe_b, bin_var, binned).long_format()
+    parm_values = np.repeat(np.array([parm_val_a, parm_val_b], dtype=object),
+                            [values_a.size, values_b.size])
+
+    cell_stats = GroupStatistics.from_values(np.concatenate((values_a, values_b)),
+                                             parm_values,
+                                             np.concatenate((bins_a, bins_b)))
+
+    levels, bins = cell_stats.levels
+    present = cell_stats.counts > 0
+    level_idx, bin_idx = np.nonzero(present)
+    cell_means = pd.DataFrame({'bin': bins[bin_idx],
+                               parameter: levels[level_idx],
+                               bin_var: cell_stats.means()[present]})
+
+    return two_way_table(cell_stats, (parameter, 'bin')), cell_means
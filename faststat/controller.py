@@ -1,38 +1,126 @@
-import os
-from flask import render_template, request, redirect, send_from_directory, url_for, flash
+import time
+import uuid
+from flask import render_template, request, redirect, send_from_directory, url_for, flash, session, \
+                  abort, jsonify, g, Response
 
 from flask_login import current_user, login_user, logout_user, login_required
 from sqlalchemy import text
+from sqlalchemy.orm import defer
 from werkzeug.utils import secure_filename
-from pandas import DataFrame
 
-from faststat import app, bcrypt, db, UPLOAD_FOLDER
+from faststat import app, bcrypt, db
+from faststat.cache import DataCache
 from faststat.objects import FastStat
-from faststat.forms import ComputeForm, StatForm, LoginForm, RegisterForm
-from faststat.dataparse import DataSet
+from faststat.plots import PlotStore
+from faststat.store import DataStore
+from faststat.viewer import data_window
+from faststat.forms import StatForm, LoginForm, RegisterForm
+from faststat.analysis import AnalysisError, FACTOR_FUNCS, GRID_FUNCS, ONE_SET_FUNCS, \
+                              TWO_SETS_FUNCS, run_cached_analysis, run_cached_grid, \
+                              run_cached_summary
 from faststat.db_models import User, Compute
-from faststat.compute import display_stat_info, normality_tests, null_hypothesis_tests, one_way_anova, \
-                    two_way_anova
+from faststat.jobs import JobQueue, JobTimeout
+from faststat.memo import ResultCache, result_key
+from faststat import metrics
 
 # Allowed file types for file upload
 ALLOWED_EXTENSIONS = {'xls', 'xlsx'}
 
-# HTML extension that will be added to a data frame converted to HTML format. 
-# Used for rendering
-HTML_EXT = """
-    <!-- Required meta tags -->
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
+# Number of previous calculations shown per page in /old
+HISTORY_PAGE_SIZE = 20
 
-    <!-- Bootstrap CSS -->
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.0/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-KyZXEAg3QhqLMpG8r+8fhAXLRk2vvoC2f3B09zVXn8CA5QIVfZOJ3BCsw2P0p/We" crossorigin="anonymous">
+# Plots are content-addressed, so browsers may keep them for a year
+PLOT_MAX_AGE = 365 * 24 * 3600
 
-    <link rel="stylesheet" type="text/css" href="{{ url_for('static',
-    filename='basic.css') }}">
+# Request header asking for the stage breakdown of a request in a
+# Server-Timing response header
+TIMING_REQUEST_HEADER = 'X-FastStat-Timing'
 
-    """
+data_cache = DataCache(app.config['CACHE_FOLDER'], app.config['CACHE_MAX_BYTES'])
+data_store = DataStore(data_cache, app.config['DATA_STORE_MAX_BYTES'])
+result_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_TIME_LIMIT'],
+                     folder=app.config['JOB_FOLDER'])
+plot_store = PlotStore(app.config['PLOT_FOLDER'])
+
+
+def job_source(info):
+    """Returns where a job finds the data of info: its location in the
+    DataCache, which workers memory map instead of receiving a copy, or the
+    data frame itself if it cannot be cached"""
+    if info.data_hash in data_cache or data_cache.store(info.data_hash, info.data_frame):
+        return (data_cache.folder, info.data_hash)
+    return info.data_frame
+
+
+def session_key():
+    """Returns the id used to find the user's data in the DataStore, creating
+    one for new sessions."""
+    if 'data_id' not in session:
+        session['data_id'] = uuid.uuid4().hex
+    return session['data_id']
+
+
+def current_info():
+    """Returns the FastStat object of the current session. Its state is kept
+    in the session (see save_state), so that requests of a session can be
+    served by any worker process."""
+    g.info = data_store.get(session_key(), session.get('faststat'))
+    return g.info
+
+
+def set_info(info):
+    """Makes info the FastStat object of the current session"""
+    data_store.put(session_key(), info)
+    g.info = info
+
+
+@app.after_request
+def save_state(response):
+    info = g.get('info')
+    if info is not None:
+        state = info.state()
+        if session.get('faststat') != state:
+            session['faststat'] = state
+    return response
+
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    metrics.start_collecting()
+
+
+@app.after_request
+def record_timing(response):
+    """Records the duration of the request and, when asked for, returns the
+    time spent in each stage in a Server-Timing header. Stages of jobs are
+    reported by the request that reads their result."""
+    spans = metrics.stop_collecting()
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+
+    seconds = time.perf_counter() - start
+    endpoint = request.endpoint or 'unknown'
+    metrics.request_seconds.observe(seconds, endpoint=endpoint, method=request.method)
+    metrics.requests_total.inc(endpoint=endpoint, method=request.method,
+                               status=response.status_code)
+
+    if app.config['TIMING_HEADER'] or request.headers.get(TIMING_REQUEST_HEADER):
+        timing = metrics.server_timing(spans)
+        total = f'total;dur={seconds * 1000:.1f}'
+        response.headers['Server-Timing'] = f'{timing}, {total}' if timing else total
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Latency histograms and counters of this process, in the Prometheus
+    text format"""
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
 
-info = FastStat()
 
 def allowed_file(file_name):
     """Function to check if file_name have the right extension.
@@ -47,10 +135,12 @@ def choose_template(func):
     :arg func: str with name of statistical analysis name
     :return str with HTML template name"""
 
-    if func == 'Statistical Info' or func == 'One-way ANOVA':
+    if func in ONE_SET_FUNCS:
         return "view_oneset_analysis.html"
-    elif func == 'Normality Tests' or func == 'Null Hypothesis Tests' or func == 'Two-way ANOVA':
+    elif func in TWO_SETS_FUNCS:
         return "view_twosets_analysis.html"
+    elif func in GRID_FUNCS or func in FACTOR_FUNCS:
+        return "view_grid_analysis.html"
     else:
         return "view_input.html"
 
@@ -59,7 +149,7 @@ def choose_template(func):
 @app.route('/', methods=['GET', 'POST'])
 def index():
     form = StatForm()
-    global info
+    info = current_info()
     plot = None
 
     if request.method == 'POST':
@@ -69,7 +159,8 @@ def index():
 
             if allowed_file(FILE.filename):
                 flash(f'File {FILE.filename} read by the server.', 'success')
-                info = FastStat(file = FILE)
+                info = FastStat(file = FILE, cache = data_cache)
+                set_info(info)
 
             else:
                 flash(f'Invalid file format.', 'danger')
@@ -80,6 +171,12 @@ def index():
             return render_template("view_input.html", form=form,
                                    filename=info.file_name)
 
+        # Data may have been lost if the cache was cleared while the session
+        # was idle
+        if info.data_frame is None and not request.form.get('reset'):
+            flash('No data loaded. Please upload your spreadsheet again.', 'danger')
+            return redirect(url_for('index'))
+
         # Choice of statistical analysis
         if request.form.get('stat_func'):
             info.stat_func = request.form.get('stat_func')
@@ -99,7 +196,7 @@ def index():
                                    parms=[])
 
         # Setup for simple statistical info display: one dataset
-        if info.stat_func in ['Statistical Info', 'One-way ANOVA']:
+        if info.stat_func in ONE_SET_FUNCS:
 
             # Choice of parameters used for filtering data
             if request.form.get('parms'):
@@ -119,8 +216,8 @@ def index():
 
                 # Create a list of values to be displayed on HTML select 
                 # objects for the user to choose from
-                parm_values = [list(set(info.data_frame[parm_a]))]
-                parm_values.append(list(set(info.data_frame[parm_b])))
+                parm_values = [info.group_index.values(parm_a)]
+                parm_values.append(info.group_index.values(parm_b))
 
                 return render_template(info.template, form=form,
                                        filename=info.file_name,
@@ -149,8 +246,7 @@ def index():
                 # The list of parameters in ANOVA is more restricted, so we
                 # need to be able to parse them conditionally
                 if info.stat_func == 'One-way ANOVA':
-                    parm_names = tuple(set([parm[:-6] for parm in info.parm_names 
-                                      if 'bin' in parm]))
+                    parm_names = tuple(info.binned)
                 else:
                     parm_names = info.parm_names
 
@@ -166,55 +262,10 @@ def index():
             # Choice of property to perform statistics on, building dataset and getting results
             elif request.form.get('getproperty'):
                 info.stat_property = request.form.get('statproperty')
-
-                if info.stat_func == 'Statistical Info':
-                    dataset1 = DataSet(info.data_frame, info.stat_property,
-                                       **info.parms)
-                    result = display_stat_info(dataset1)
-                else:
-                    if 'Total ' + info.stat_property in info.parm_names:
-                        prefix = 'Total '
-
-                    elif 'Average ' + info.stat_property in info.parm_names:
-                        prefix = 'Average '
-
-                    else:
-                        flash("""Could not identify any final observable
-                              related to bin variable chosen (is it an 
-                              Average, or a Total?). Please check your 
-                              spreadsheet labeling and correct it.""", 'danger')
-                        info.reset(hard_reset=True)
-                        return redirect(url_for('index'))
-
-                    dataset1 = DataSet(info.data_frame, prefix +
-                                       info.stat_property, **info.parms)
-                    result = one_way_anova(dataset1.data_frame, info.stat_property)
-                    result = result.to_html()
-
-                if dataset1.data_set.empty or len(dataset1.data_set) < 2:
-                    flash('Insufficient data. Please check your input \
-                          variaibles or spreadsheet', 'danger')
-
-                    info.reset(hard_reset=True)
-                    return redirect(url_for('index'))
-
-                if current_user.is_authenticated:
-                    compute_results = Compute()
-                    form.populate_obj(compute_results)
-                    compute_results.result = result
-                    compute_results.plot = plot
-                    compute_results.user = current_user
-                    compute_results.filename = info.file_name
-                    db.session.add(compute_results)
-                    db.session.commit()
-
-                return render_template("view_output.html", 
-                                       form=form, 
-                                       filename=info.file_name,
-                                       result=result, plot=None)
+                return analyze(form, info)
 
         # Setup for statistical tools requiring two datasets
-        elif info.stat_func in ['Normality Tests', 'Null Hypothesis Tests', 'Two-way ANOVA']:
+        elif info.stat_func in TWO_SETS_FUNCS:
 
             # Choice of parameters used for filtering data
             if request.form.get('parms'):
@@ -231,10 +282,10 @@ def index():
 
                 # Create a list of values to be displayed on HTML select 
                 # objects for the user to choose from
-                parm_values = [list(set(info.data_frame[parm_1a]))]
-                parm_values.append(list(set(info.data_frame[parm_1b])))
-                parm_values.append(list(set(info.data_frame[parm_2a])))
-                parm_values.append(list(set(info.data_frame[parm_2b])))
+                parm_values = [info.group_index.values(parm_1a)]
+                parm_values.append(info.group_index.values(parm_1b))
+                parm_values.append(info.group_index.values(parm_2a))
+                parm_values.append(info.group_index.values(parm_2b))
 
                 return render_template(info.template, 
                                        form=form,
@@ -269,8 +320,7 @@ def index():
                 # The list of parameters in ANOVA is more restricted, so we
                 # need to be able to parse them conditionally
                 if info.stat_func == 'Two-way ANOVA':
-                    parm_names = list(set([parm[:-6] for parm in
-                                                info.parm_names if 'bin' in parm]))
+                    parm_names = list(info.binned)
 
                 else:
                     parm_names = info.parm_names
@@ -286,136 +336,24 @@ def index():
 
             elif request.form.get('getproperty'):
                 info.stat_property = request.form.get('statproperty')
-                if info.stat_func in ['Normality Tests', 'Null Hypothesis Tests']:
-                    dataset1 = DataSet(info.data_frame, info.stat_property,
-                                       **info.parms[0])
-                    dataset2 = DataSet(info.data_frame, info.stat_property, 
-                                       **info.parms[1])
-
-                    """Check size of data sets to ensure it is possible to
-                    perform analysis."""
-                    if dataset1.data_set.empty or len(dataset1.data_set) < 2:
-                        flash('Insufficient data for Dataset 1. Please check your input \
-                              variaibles or spreadsheet', 'danger')
-
-                        info.reset(hard_reset=True)
-                        return redirect(url_for('index'))
-
-                    if dataset2.data_set.empty or len(dataset2.data_set) < 2:
-                        flash("""Insufficient data for Dataset 2. Please check
-                              your input variaibles or spreadsheet""", 'danger')
-
-                        info.reset(hard_reset=True)
-                        return redirect(url_for('index'))
-
-                    result = normality_tests(dataset1, dataset2)
-                    result += display_stat_info(dataset1)
-                    result += display_stat_info(dataset2)
-
-                    if info.stat_func == 'Null Hypothesis Tests':
-                        result += null_hypothesis_tests(dataset1, dataset2)
-                else:
-                    if 'Total ' + info.stat_property in info.parm_names:
-                        prefix = 'Total '
-
-                    elif 'Average ' + info.stat_property in info.parm_names:
-                        prefix = 'Average '
-
-                    else:
-                        flash("""Could not identify any final observable
-                              related to bin variable chosen (is it an 
-                              Average, or a Total?). Please check your 
-                              spreadsheet labeling and correct it.""", 'danger')
-                        info.reset(hard_reset=True)
-                        return redirect(url_for('index'))
-
-                    dataset1 = DataSet(info.data_frame, prefix +
-                                       info.stat_property, **info.parms[0])
-                    dataset2 = DataSet(info.data_frame, prefix +
-                                       info.stat_property, **info.parms[1])
-
-                    """Check size of data sets to ensure it is possible to
-                    perform analysis."""
-                    if dataset1.data_set.empty or len(dataset1.data_set) < 2:
-                        flash('Insufficient data for Dataset 1. Please check your input \
-                              variaibles or spreadsheet', 'danger')
-                        info.reset(hard_reset=True)
-
-                        return redirect(url_for('index'))
-
-
-                    if dataset2.data_set.empty or len(dataset2.data_set) < 2:
-                        flash('Insufficient data for Dataset 2. Please check your input \
-                              variaibles or spreadsheet', 'danger')
-                        info.reset(hard_reset=True)
-
-                        return redirect(url_for('index'))
-
-                    parms_1 = tuple(info.parms[0])
-                    parms_2 = tuple(info.parms[1])
-                    parm_1a, parm_1b = parms_1
-                    parm_2a, parm_2b = parms_2
-                    value_1a = info.parms[0][parm_1a]
-                    value_1b = info.parms[0][parm_1b]
-                    value_2a = info.parms[1][parm_2a]
-                    value_2b = info.parms[1][parm_2b]
-
-                    if parm_1a == parm_2a and value_1a != value_2a:
-                        value_a = value_1a
-                        value_b = value_2a
-                        parameter = parm_1a
-                    elif parm_1a == parm_2b and value_1a != value_2b:
-                        value_a = value_1a
-                        value_b = value_2b
-                        parameter = parm1_a
-                    elif parm_1b == parm_2a and value_1b != value_2a:
-                        value_a = value_1b
-                        value_b = value_2a
-                        parameter = parm_1b
-                    elif parm_1b == parm_2b and value_1b != value_2b:
-                        value_a = value_1b
-                        value_b = value_2b
-                        parameter = parm_1b
-                    else:
-                        flash('Cannot perform two-way ANOVA for these \
-                              two datasets', 'danger')
-                        info.reset(hard_reset=True)
-
-                        return redirect(url_for('index'))
-                    try:
-                        result, plot = two_way_anova(dataset1.data_frame, 
-                                                     dataset2.data_frame,
-                                                     parameter, value_a, value_b,
-                                                     info.stat_property)
-                    except ValueError:
-                        flash("""Error due to non-numeric data. Please check your
-                              spreadsheet.""", 'danger')
-                        info.reset(hard_reset=True)
-                        return redirect(url_for('index'))
-                    except KeyError:
-                        flash("""Numerical error while running Smirnov-Grubbs'
-                              test. Check for extreme outliers. If problem
-                              persists, please contact admin.""", 'danger')
-                        info.reset(hard_reset=True)
-                        return redirect(url_for('index'))
-
-                    result = result.to_html()
-
-                if current_user.is_authenticated:
-                    compute_results = Compute()
-                    form.populate_obj(compute_results)
-                    compute_results.result = result
-                    compute_results.plot = plot
-                    compute_results.user = current_user
-                    compute_results.filename = info.file_name
-                    db.session.add(compute_results)
-                    db.session.commit()
-
-                return render_template("view_output.html", 
-                                       form=form,
-                                       filename=info.file_name,
-                                       result=result, 
-                                       plot=plot)
+                return analyze(form, info)
+
+        # Setup for analyses over every combination of the chosen columns,
+        # or with them as factors
+        elif info.stat_func in GRID_FUNCS or info.stat_func in FACTOR_FUNCS:
+            if request.form.get('getproperty'):
+                columns = [column for column in request.form.getlist('grid_columns')
+                           if column in info.parm_names]
+                if not columns:
+                    flash(f'Please choose a parameter.', 'danger')
+                    return render_template(info.template, form=form,
+                                           filename=info.file_name,
+                                           parm_names=info.parm_names,
+                                           stat_func=info.stat_func)
+
+                info.parms = {'columns': columns}
+                info.stat_property = request.form.get('statproperty')
+                return analyze(form, info)
 
         elif request.form.get('reset'):
             info.reset()
@@ -435,12 +373,148 @@ def index():
                                    filename=None)
 
 
-def populate_form_from_instance(instance):
-    """Repopulate form with previous values"""
-    form = ComputeForm()
-    for field in form:
-        field.data = getattr(instance, field.name)
-    return form
+def analyze(form, info):
+    """Runs the analysis chosen in the form. Results already computed for the
+    same data and parameters are shown right away; otherwise the analysis
+    is submitted to the job queue and a page polling for it is returned."""
+
+    key = result_key(info.data_hash, info.stat_func, info.parms, info.stat_property)
+    cached = result_cache.get(key)
+    if cached is not None:
+        metrics.analyses_total.inc(stat_func=info.stat_func, source='cache')
+        return deliver_result(form, info.file_name, key, *cached)
+
+    columns = info.parms.get('columns') if info.stat_func in GRID_FUNCS else None
+    if info.stat_func == 'Grid: Statistical Info' and \
+            info.has_grid_summary(columns, info.stat_property):
+        # Group statistics are built by a job the first time, then kept up
+        # to date as rows are appended, so refreshing them is cheap enough
+        # to be done here
+        try:
+            result = info.grid_summary(info.parms['columns'], info.stat_property).result()
+        except (AttributeError, ValueError):
+            flash(f"""Insufficient or non-numeric data for {info.stat_property}.
+                  Please check your input variables or spreadsheet""", 'danger')
+            info.reset()
+            return redirect(url_for('index'))
+
+        metrics.analyses_total.inc(stat_func=info.stat_func, source='summary')
+        result_cache.put(key, result, None)
+        return deliver_result(form, info.file_name, key, result, None)
+
+    metrics.analyses_total.inc(stat_func=info.stat_func, source='job')
+
+    source = job_source(info)
+
+    meta = {'owner': session_key(), 'key': key, 'filename': info.file_name}
+    if info.stat_func == 'Grid: Statistical Info':
+        meta['summary'] = (info.data_hash, columns, info.stat_property)
+        job_id = job_queue.submit(run_cached_summary, source, columns, info.stat_property,
+                                  meta=meta)
+    elif info.stat_func in GRID_FUNCS:
+        job_id = job_queue.submit(run_cached_grid, source, info.stat_func,
+                                  info.parms['columns'], info.stat_property,
+                                  app.config['GRID_WORKERS'], meta=meta)
+    else:
+        job_id = job_queue.submit(run_cached_analysis, source, info.stat_func,
+                                  info.parms, info.stat_property, plot_store.folder,
+                                  meta=meta)
+
+    return render_template("view_job.html", form=form, filename=info.file_name,
+                           job_id=job_id)
+
+
+def deliver_result(form, filename, key, result, plot):
+    """Saves a result in the user's history and renders it"""
+
+    if current_user.is_authenticated:
+        compute_results = Compute()
+        form.populate_obj(compute_results)
+        compute_results.result_key = key
+        compute_results.user = current_user
+        compute_results.filename = filename
+        with metrics.stage('db_commit'):
+            db.session.add(compute_results)
+            db.session.commit()
+
+    with metrics.stage('render_html'):
+        return render_template("view_output.html",
+                               form=form,
+                               filename=filename,
+                               result=result,
+                               plot=plot)
+
+
+def owned_job(job_id):
+    """Returns a job submitted from the current session, or aborts with 404"""
+    job = job_queue.get(job_id)
+    if job is None or job.meta.get('owner') != session.get('data_id'):
+        abort(404)
+    return job
+
+
+@app.route('/plots/<digest>.png')
+def plot_file(digest):
+    """Serves rendered plots. Their names are content hashes, so they never
+    change and can be cached indefinitely."""
+    response = send_from_directory(plot_store.folder, plot_store.file_name(digest),
+                                   max_age=PLOT_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = owned_job(job_id)
+    return jsonify(id=job_id, status=job.status(),
+                   result=url_for('job_result', job_id=job_id))
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = owned_job(job_id)
+    form = StatForm()
+
+    if job.status() in ('pending', 'running'):
+        return render_template("view_job.html", form=form,
+                               filename=job.meta['filename'], job_id=job_id)
+
+    try:
+        value = job_queue.result(job_id)
+    except AnalysisError as error:
+        flash(str(error), 'danger')
+        # A property without numeric data leaves the data set usable
+        current_info().reset(hard_reset='summary' not in job.meta)
+        return redirect(url_for('index'))
+    except JobTimeout as error:
+        flash(str(error), 'danger')
+        current_info().reset()
+        return redirect(url_for('index'))
+    except Exception:
+        app.logger.exception('Job %s failed', job_id)
+        flash('The analysis failed unexpectedly. Please try again.', 'danger')
+        current_info().reset()
+        return redirect(url_for('index'))
+
+    if 'summary' in job.meta:
+        # Kept with the data set, unless rows were appended meanwhile, so
+        # that later requests only refresh it
+        (summary, result), plot = value, None
+        data_hash, columns, stat_property = job.meta['summary']
+        info = current_info()
+        if info.data_hash == data_hash:
+            info.keep_grid_summary(columns, stat_property, summary)
+    else:
+        result, plot = value
+
+    # Only the first request for a finished job stores it
+    if not job_queue.claim(job_id):
+        return render_template("view_output.html", form=form,
+                               filename=job.meta['filename'],
+                               result=result, plot=plot)
+
+    result_cache.put(job.meta['key'], result, plot)
+    return deliver_result(form, job.meta['filename'], job.meta['key'], result, plot)
 
 
 @app.route("/about")
@@ -478,28 +552,76 @@ def login():
     return render_template("login.html", title='Login', form=form)
 
 
+@app.route('/append', methods=['POST'])
+def append():
+    """Adds the rows of another spreadsheet, with the same columns, to the
+    loaded data"""
+    info = current_info()
+    if info.data_frame is None:
+        return redirect(url_for('index'))
+
+    FILE = request.files.get('file')
+    if FILE is None or not FILE.filename or not allowed_file(FILE.filename):
+        flash(f'Invalid file format.', 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        added = info.append(FILE, data_cache)
+    except ValueError as error:
+        flash(str(error), 'danger')
+        return redirect(url_for('index'))
+
+    set_info(info)
+    flash(f'{added} rows from {FILE.filename} added.', 'success')
+    return redirect(url_for('index'))
+
+
 @app.route('/reset', methods=['GET', 'POST'])
 def reset():
-    info.reset(hard_reset=True)
+    current_info().reset(hard_reset=True)
     return redirect(url_for('index'))
 
 @app.route('/new_calc', methods=['GET', 'POST'])
 def new_calc():
-    info.reset()
+    current_info().reset()
     return redirect(url_for('index'))
 
 @app.route('/get_df/<filename>')
 def get_df(filename):
-    html_form = info.data_frame.to_html()
-    html_form = html_form.replace('<table border="1" class="dataframe">', 
-                      '<table class="table table-striped">')
-    html_filepath = os.path.join(app.config['UPLOAD_FOLDER'],f"{filename}.html")
-    html_file = open(html_filepath, "w")
-    html_file.write(HTML_EXT)
-    html_file.write(html_form)
-    html_file.close()
+    """Spreadsheet viewer. Rows and columns are fetched a page at a time from
+    data_rows"""
+    info = current_info()
+    if info.data_frame is None:
+        return redirect(url_for('index'))
+
+    return render_template('data_viewer.html', filename=filename,
+                           columns=[str(column) for column in info.data_frame.columns])
+
+
+@app.route('/data/rows')
+def data_rows():
+    """Returns a window of rows and columns of the uploaded spreadsheet as
+    JSON, optionally sorted and filtered (see viewer.data_window)"""
+    info = current_info()
+    if info.data_frame is None:
+        abort(404)
+
+    args = request.args
+    try:
+        window = data_window(info.data_frame,
+                             start=args.get('start', 0, type=int),
+                             count=args.get('count', 50, type=int),
+                             column_start=args.get('column_start', 0, type=int),
+                             column_count=args.get('column_count', None, type=int),
+                             sort=args.get('sort'),
+                             ascending=args.get('order', 'asc') != 'desc',
+                             filter_column=args.get('filter_column'),
+                             filter_text=args.get('filter'))
+    except KeyError:
+        abort(400)
+
+    return jsonify(window)
 
-    return render_template(f'{UPLOAD_FOLDER}/{filename}.html')
 
 @app.route('/logout')
 @login_required
@@ -510,22 +632,55 @@ def logout():
 @app.route('/old')
 @login_required
 def old():
+    """Lists previous calculations, newest first, one page at a time. Pages
+    are selected by id (keyset pagination), and results and plots are not
+    loaded here: each one is fetched on demand from old_result."""
     data = []
+    next_page = None
     if current_user.is_authenticated:
-        instances = current_user.Compute.order_by(text('-id')).all()
-        for instance in instances:
-            form = populate_form_from_instance(instance)
+        query = current_user.Compute.options(defer(Compute.result), defer(Compute.plot))
+        before = request.args.get('before', type=int)
+        if before is not None:
+            query = query.filter(Compute.id < before)
+
+        instances = query.order_by(Compute.id.desc()).limit(HISTORY_PAGE_SIZE + 1).all()
+        if len(instances) > HISTORY_PAGE_SIZE:
+            instances = instances[:HISTORY_PAGE_SIZE]
+            next_page = instances[-1].id
 
-            result = instance.result
-            plot = instance.plot
+        for instance in instances:
             if instance.comments:
                 comments = instance.comments
             else:
                 comments = ''
-            data.append({'form': form, 'result': result,
-                         'id': instance.id, 'plot': plot,
+            data.append({'fields': [('File', instance.filename)],
+                         'id': instance.id,
                          'comments': comments})
-    return render_template("old.html", data=data)
+    return render_template("old.html", data=data, next_page=next_page)
+
+
+@app.route('/old/<int:id>/result')
+@login_required
+def old_result(id):
+    """Returns one previous calculation as JSON: its results rendered in HTML,
+    the structured results themselves (None for results saved as HTML) and
+    the URL of its plot"""
+    instance = current_user.Compute.filter_by(id=id).first()
+    if instance is None:
+        abort(404)
+
+    plot = instance.get_plot()
+    if plot is None:
+        plot_url = None
+    elif len(plot) == 64:
+        plot_url = url_for('plot_file', digest=plot)
+    else:
+        # Plots saved before the plot store was introduced
+        plot_url = 'data:image/png;base64,' + plot
+
+    result = instance.get_result()
+    return jsonify(id=instance.id, result=render_template("result.html", result=result),
+                   data=result if isinstance(result, dict) else None, plot=plot_url)
 
 
 @app.route('/add_comment', methods=['GET', 'POST'])
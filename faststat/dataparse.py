@@ -1,6 +1,101 @@
+import numpy as np
 import pandas as pd
-from scipy import stats
-from outliers import smirnov_grubbs as grubbs
+from pandas.api.types import CategoricalDtype, is_numeric_dtype, is_object_dtype, is_string_dtype, \
+                             union_categoricals
+
+from faststat.grubbs import grubbs_test
+from faststat.metrics import stage
+
+
+def infer_dtypes(data_frame, measurements=(), float_dtype='float64'):
+    """Assigns compact, vectorizable types to the columns of a freshly read
+    spreadsheet. Measurement columns become floats, columns that only hold
+    integers (IDs, animal numbers, ...) become nullable integers and any
+    column with text becomes a categorical grouping column.
+
+    Arguments
+    ---
+
+    data_frame : pd.DataFrame
+        Data frame as read from the spreadsheet
+
+    measurements : iterable
+        Columns that are always stored as floats (bins and their
+        Average/Total column)
+
+    float_dtype : str
+        Floating point type used for measurements
+
+    Returns
+    ---
+
+    pd.DataFrame with typed columns"""
+
+    measurements = set(measurements)
+    columns = {}
+
+    for name in data_frame.columns:
+        column = data_frame[name]
+
+        if is_object_dtype(column.dtype) or is_string_dtype(column.dtype):
+            numeric = pd.to_numeric(column, errors='coerce')
+            # Any value that could not be converted means text is present
+            if numeric.notna().sum() != column.notna().sum():
+                columns[name] = column.astype('category')
+                continue
+            column = numeric
+
+        if not is_numeric_dtype(column.dtype) or column.dtype == bool:
+            columns[name] = column
+        elif name in measurements:
+            columns[name] = column.astype(float_dtype)
+        elif column.dropna().mod(1).eq(0).all():
+            columns[name] = column.astype('Int64')
+        else:
+            columns[name] = column.astype(float_dtype)
+
+    return pd.DataFrame(columns, index=data_frame.index)
+
+
+def append_rows(data_frame, new_rows):
+    """Appends the rows of a spreadsheet to another one with the same
+    columns, both typed by infer_dtypes. Rows keep their positions, and the
+    new ones follow them. Grouping columns get the categories of both.
+
+    Arguments
+    ---
+
+    data_frame : pd.DataFrame
+        Rows already loaded
+
+    new_rows : pd.DataFrame
+        Rows to be added
+
+    Returns
+    ---
+
+    pd.DataFrame with the rows of both"""
+
+    if list(new_rows.columns) != list(data_frame.columns):
+        raise ValueError("The new rows must have the same columns as the loaded spreadsheet.")
+
+    columns = {}
+    for name in data_frame.columns:
+        old, new = data_frame[name], new_rows[name]
+
+        if isinstance(old.dtype, CategoricalDtype) or isinstance(new.dtype, CategoricalDtype):
+            try:
+                column = union_categoricals([old.astype('category'), new.astype('category')])
+            except TypeError:
+                # Categories of different types, e.g. text added to a column
+                # of numbers
+                column = pd.concat([old.astype(object), new.astype(object)],
+                                   ignore_index=True).astype('category')
+            columns[name] = pd.Series(column)
+        else:
+            columns[name] = pd.concat([old, new], ignore_index=True)
+
+    return pd.DataFrame(columns)
 
 
 def filter_numeric_data(data_frame, parameter):
@@ -20,32 +115,31 @@ def filter_numeric_data(data_frame, parameter):
     Returns
     ---
 
-    grubbs.test : pd.Series
-        Result from Grubbs' test, telling about outliers removed"""
+    pd.Series
+        Data that passed Grubbs' test, with outliers removed"""
 
     if parameter not in data_frame.columns:
         raise AttributeError(f"Could not find {parameter} in data frame.")
 
     filter_nan = data_frame[pd.notnull(data_frame[parameter])]     # filtering NaN data
     data_series = pd.Series(filter_nan[parameter])
-    data_series.reset_index(drop=True, inplace=True)               # index must be reset to work
+    data_series.reset_index(drop=True, inplace=True)
 
     try:
-        data = pd.to_numeric(data_series) # conversion necessary to use Grubbs' test
+        # Typed frames are already numeric; only convert what is left
+        if is_numeric_dtype(data_series.dtype):
+            data = data_series.astype(float)
+        else:
+            data = pd.to_numeric(data_series.astype(object))
 
     except ValueError:
         raise ValueError("Grubbs' test cannot be performed due to non-numeric data. Please check your data.")
 
-    # There seems to be an issue with the smirnov_grubbs.py when handling
-    # certain large outliers, and I could not figure out why. This is an error
-    # handling to cope with this issue
-    try:
-        return grubbs.test(data, alpha=0.05) 
+    with stage('grubbs_test') as span:
+        span.rows = len(data)
+        _, outliers = grubbs_test(data.to_numpy(), alpha=0.05)
 
-    except KeyError:
-        raise KeyError("""Grubbs' test cannot be performed due to input data. Try
-                       removing manually any outlier that is largely deviating
-                       from the distribution""")
+    return data.drop(data.index[outliers])
 
 
 def subset_data(data_frame, parameter, subset_val):
@@ -53,16 +147,156 @@ def subset_data(data_frame, parameter, subset_val):
     return data_frame[data_frame[parameter] == subset_val], subset_val
 
 
-def bins_subset(data_frame, parameter, bin_num=None):
-    if not bin_num:
-        return data_frame.filter(like=parameter + ' bin')
-    else:
-        return data_frame.filter(like=parameter + ' bin ' + str(bin_num))
+def bin_columns(columns, bin_parm):
+    """Names of the bin columns of a variable ('<bin_parm> bin 1', '<bin_parm>
+    bin 2', ...), in order"""
+    columns = set(columns)
+    names = []
+    while f'{bin_parm} bin {len(names) + 1}' in columns:
+        names.append(f'{bin_parm} bin {len(names) + 1}')
+    return names
+
+
+def bin_variables(data_frame):
+    """Finds every variable measured over bins in a data frame.
+
+    Returns
+    ---
+
+    dict mapping variable names to BinnedVariable objects"""
+
+    suffix = ' bin 1'
+    return {column[:-len(suffix)]: BinnedVariable.from_frame(data_frame, column[:-len(suffix)])
+            for column in data_frame.columns
+            if isinstance(column, str) and column.endswith(suffix)}
+
+
+class BinnedVariable:
+    """A variable measured over several bins, stored as one contiguous
+    (n_rows x n_bins) float array in column-major order, so each bin is a
+    contiguous block of memory.
+
+    Attributes
+    ---
+
+    name : str
+        Name of the variable, as given in the merged spreadsheet cell
+
+    values : np.ndarray
+        Measurements, one column per bin. NaN where missing
+
+    valid : np.ndarray
+        Boolean mask, same shape as values, True where a bin was measured
+
+    summary : str
+        Name of the 'Average' or 'Total' column computed from the bins, or
+        None if the spreadsheet has none
+
+    index : pd.Index
+        Row labels of the data frame the variable was extracted from
+    """
+
+    def __init__(self, name, values, index, summary=None):
+        self._name = name
+        self._values = np.asfortranarray(values, dtype=float)
+        self._valid = ~np.isnan(self._values)
+        self._index = index
+        self._summary = summary
+
+    @classmethod
+    def from_frame(cls, data_frame, bin_parm):
+        columns = bin_columns(data_frame.columns, bin_parm)
+        if not columns:
+            raise AttributeError(f"Could not find bins of {bin_parm} in data frame.")
+
+        summary = None
+        for prefix in ('Total ', 'Average '):
+            if prefix + bin_parm in data_frame.columns:
+                summary = prefix + bin_parm
+                break
+
+        try:
+            values = data_frame[columns].to_numpy(dtype=float, na_value=np.nan)
+        except (ValueError, TypeError):
+            raise ValueError(f"Non-numeric data found in bins of {bin_parm}. Please check your data.")
+
+        return cls(bin_parm, values, data_frame.index, summary)
+
+    def take(self, index):
+        """Returns the variable restricted to the rows labeled by index, e.g.
+        the data frame of a DataSet"""
+        positions = self._index.get_indexer(index)
+        if (positions < 0).any():
+            raise KeyError(f"Rows not found in bins of {self._name}.")
+        return BinnedVariable(self._name, self._values[positions], index, self._summary)
+
+    def long_format(self, filter_outliers=True):
+        """Stacks the bins in long format, one measurement per element,
+        without building any intermediate per-bin frame. Missing values are
+        dropped and, optionally, outliers are removed from each bin with
+        Grubbs' test.
+
+        Returns
+        ---
+
+        np.ndarray with the measurements
+
+        np.ndarray with the bin number (starting from 1) of each measurement
+
+        np.ndarray with the row label of each measurement"""
+
+        # Transposed view is C-contiguous: bin-major order
+        values = self._values.T[self._valid.T]
+        rows = np.nonzero(self._valid.T)[1]
+        bin_sizes = self._valid.sum(axis=0)
+        bins = np.repeat(np.arange(1, self.bin_count() + 1), bin_sizes)
+
+        if filter_outliers:
+            keep = np.ones(values.size, dtype=bool)
+            bounds = np.concatenate(([0], np.cumsum(bin_sizes)))
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                _, outliers = grubbs_test(values[start:stop], alpha=0.05)
+                keep[start + outliers] = False
+            values, bins, rows = values[keep], bins[keep], rows[keep]
+
+        return values, bins, np.asarray(self._index)[rows]
+
+    def bin_count(self):
+        return self._values.shape[1]
+
+    def columns(self):
+        return [f'{self._name} bin {i}' for i in range(1, self.bin_count() + 1)]
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def values(self):
+        return self._values
+
+    @property
+    def valid(self):
+        return self._valid
+
+    @property
+    def summary(self):
+        return self._summary
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def nbytes(self):
+        """Memory used by the measurements and their mask"""
+        return self._values.nbytes + self._valid.nbytes
 
 
 def bin_dataframe_generator(data_frame, bin_parm):
-    """Creates a nenw data frame from an input to handle bins to be used in
-    ANOVA calculations.
+    """Creates a new data frame in long format from the bins of a variable,
+    to be used in ANOVA calculations. Outliers are removed from each bin with
+    Grubbs' test.
 
     Arguments
     ---
@@ -76,49 +310,106 @@ def bin_dataframe_generator(data_frame, bin_parm):
     Returns
     ---
 
-    grubbs.test : pd.Series
-        Result from Grubbs' test, telling about outliers removed"""
-
-    bin_num = data_frame.columns.str.contains(bin_parm + ' bin ').sum()
-    bin_dataframe = pd.DataFrame()  # empty declaration to perform concatenation
-    for i in range(1, bin_num + 1):
-        bin_subset = bins_subset(data_frame, bin_parm, i).dropna()
-        bin_subset = pd.DataFrame(filter_numeric_data(bin_subset, bin_parm + ' bin ' + str(i)))
-        bin_subset['bin'] = i
-        bin_subset.rename(columns={f'{bin_parm} bin {i}': f'{bin_parm}'}, inplace=True)
-        bin_dataframe = bin_dataframe.append(bin_subset)
-    
-    bin_dataframe.reset_index(inplace=True)
-    bin_dataframe.fillna(0, inplace=True)
+    pd.DataFrame
+        Columns 'index' (row of data_frame), bin_parm (measurement) and
+        'bin' (bin number)"""
+
+    values, bins, rows = BinnedVariable.from_frame(data_frame, bin_parm).long_format()
 
-    return bin_dataframe
+    return pd.DataFrame({'index': rows, bin_parm: values, 'bin': bins})
 
 
 class DataSet:
-    def __init__(self, df, events, **parms):
-        self._data_frame = df
+    """Filtered measurements of one variable over a subset of the rows of a
+    data frame. The measurements are kept in a contiguous float64 array, and
+    descriptive statistics are computed on first use and cached: mean,
+    standard deviation and s.e.m. from one pass over the data, and median
+    and quantiles from a single sort.
+
+    Attributes
+    ---
+
+    name : str
+        Values of the parameters defining the subset, followed by the name
+        of the variable
+
+    data_frame : pd.DataFrame
+        Rows of the data frame in the subset. Built on demand
+
+    values : np.ndarray
+        Measurements left after removing NaN and outliers (see
+        filter_numeric_data)
+
+    data_set : pd.Series
+        values, as a Series named after the variable
+    """
+
+    __slots__ = ('_source', '_rows', '_name', '_events', '_values', '_isnormal',
+                 '_moments', '_sorted')
+
+    def __init__(self, df, events, group_index=None, **parms):
         self._name = ""
+        rows = None
 
         # parms is a dictionary that is passes all the chosen parameters and
-        # their values to create a smaller data frame.
-        if parms is not None:
+        # their values to select a subset of df. With a GroupIndex of df,
+        # rows are found by intersecting precomputed positions.
+        if group_index is not None and parms:
+            rows = group_index.subset(**parms)
+            for value in parms.values():
+                self._name += str(value) + " "
+        elif parms:
+            mask = np.ones(len(df), dtype=bool)
             for key, value in parms.items():
-                self._data_frame,  self._parm_name = subset_data(self._data_frame, key, value)
-                self._name += str(self._parm_name) + " "
+                mask &= (df[key] == value).to_numpy(dtype=bool, na_value=False)
+                self._name += str(value) + " "
+            rows = np.flatnonzero(mask)
+
+        self._init(df, events, rows)
+
+    @classmethod
+    def from_rows(cls, df, events, rows, name=""):
+        """DataSet of events over the rows of df at the given positions"""
+        dataset = cls.__new__(cls)
+        dataset._name = name
+        dataset._init(df, events, rows)
+        return dataset
+
+    def _init(self, df, events, rows):
+        # Only the positions of the rows are kept; the subset of df is built
+        # when data_frame is read
+        self._source = df
+        self._rows = rows
+        self._events = events
+        self._isnormal = True  # data is assumed to be normal.
+
+        if events not in df.columns:
+            raise AttributeError(f"Could not find {events} in data frame.")
+
+        # Only the column of events is filtered
+        column = df[events] if rows is None else df[events].iloc[rows]
         try:
-            self._data_set = filter_numeric_data(df, events)
+            data = filter_numeric_data(column.to_frame(), events)
+            self.values = data.to_numpy(dtype=np.float64)
         except ValueError:
-            self._data_set = pd.Series() # returns an empty seriees
-            pass
-        self._isnormal = True  # data is assumed to be normal.
-        self._events = events
+            self.values = np.empty(0)   # no numeric data
+
+    def __getstate__(self):
+        # Data sets are sent to worker processes for their measurements, so
+        # the whole data frame they come from is left behind
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != '_source'}
+
+    def __setstate__(self, state):
+        self._source = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
 
     @property
     def name(self):
-        if self._data_set.empty:
+        if self._values.size == 0:
             return ""
         else:
-            return str(self._name) + " : " + str(self._data_set.name)
+            return str(self._name) + " : " + str(self._events)
 
     @name.setter
     def name(self, name):
@@ -126,19 +417,27 @@ class DataSet:
 
     @property
     def data_frame(self):
-        return self._data_frame
+        if self._source is None or self._rows is None:
+            return self._source
+        return self._source.iloc[self._rows]
 
-    @data_frame.setter
-    def data_frame(self, df):
-        self._data_frame = df
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = np.ascontiguousarray(values, dtype=np.float64)
+        self._moments = None
+        self._sorted = None
 
     @property
     def data_set(self):
-        return self._data_set
+        return pd.Series(self._values, name=self._events, copy=False)
 
     @data_set.setter
     def data_set(self, dataset):
-        self._data_set = dataset
+        self.values = np.asarray(dataset, dtype=np.float64)
 
     def isnormal(self):
         return self._isnormal
@@ -146,23 +445,56 @@ class DataSet:
     def data_events(self):
         return self._events
 
+    def _get_moments(self):
+        """Mean and standard deviation (with n - 1 degrees of freedom), from
+        the sum and sum of squares of the values shifted by the first one, as
+        in incremental.GroupSummary, so the mean is not needed beforehand"""
+        if self._moments is None:
+            n = self._values.size
+            if n == 0:
+                self._moments = (np.nan, np.nan)
+            else:
+                shift = self._values[0]
+                centred = self._values - shift
+                total = centred.sum()
+                if n > 1:
+                    variance = max(centred @ centred - total * total / n, 0.) / (n - 1)
+                else:
+                    variance = np.nan
+                self._moments = (float(shift + total / n), float(np.sqrt(variance)))
+        return self._moments
+
+    def _quantile(self, q):
+        """Quantile q of the values, interpolated linearly like pandas"""
+        if self._sorted is None:
+            self._sorted = np.sort(self._values)
+        if self._sorted.size == 0:
+            return np.nan
+
+        position = q * (self._sorted.size - 1)
+        below = int(np.floor(position))
+        above = min(below + 1, self._sorted.size - 1)
+        fraction = position - below
+        return float(self._sorted[below] +
+                     (self._sorted[above] - self._sorted[below]) * fraction)
+
     def sampling_size(self):
-        return len(self._data_set)   
+        return self._values.size
 
     def mean_value(self):
-        return self._data_set.mean()
+        return self._get_moments()[0]
 
     def median_value(self):
-        return self._data_set.median()
+        return self._quantile(.5)
 
     def quantile25_value(self):
-        return self._data_set.quantile(.25)
+        return self._quantile(.25)
 
     def quantile75_value(self):
-        return self._data_set.quantile(.75)
+        return self._quantile(.75)
     
     def std_value(self):
-        return self._data_set.std()
+        return self._get_moments()[1]
 
     def sem_value(self):
-        return stats.sem(self._data_set) 
+        return self._get_moments()[1] / np.sqrt(self._values.size)
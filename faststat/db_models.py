@@ -1,6 +1,10 @@
-import os
+import hashlib
+import secrets
+from datetime import datetime
 from flask_login import UserMixin
-from faststat import db, login_manager
+from sqlalchemy import inspect, text
+from faststat import app, db, login_manager
+from faststat.results import dumps, loads, statistic_rows
 
 
 @login_manager.user_loader
@@ -16,25 +20,156 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(60))
     email = db.Column(db.String(120), nullable=False)
     notify = db.Column(db.Boolean())
+    api_token = db.Column(db.String(64), index=True)
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def new_api_token(self):
+        """Gives the user a new token for the JSON API, replacing the previous
+        one. Only its hash is stored.
+
+        Returns
+        ---
+            str with the token"""
+        token = secrets.token_urlsafe(32)
+        self.api_token = self.hash_token(token)
+        return token
+
+    @classmethod
+    def from_api_token(cls, token):
+        """Returns the user with the given API token, or None"""
+        if not token:
+            return None
+        return cls.query.filter_by(api_token=cls.hash_token(token)).first()
 
     def __repr__(self):
         return f"<User '{self.username}', '{self.email}'>"
 
 
+class ApiDataset(db.Model):
+    """SQLAlchemy model for the data sets a user uploaded through the JSON
+    API, so that each user can only reach their own. data_hash is the id of
+    the data set in the DataCache."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    data_hash = db.Column(db.String(64), index=True)
+    file_name = db.Column(db.String())
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', backref=db.backref('datasets', lazy='dynamic'))
+
+    def __repr__(self):
+        return f"<ApiDataset '{self.data_hash}', '{self.file_name}'>"
+
+
+class CachedResult(db.Model):
+    """SQLAlchemy model for the persistent tier of the ResultCache. Stores the
+    results and plot of an analysis under a key derived from the data set
+    contents and the analysis parameters. Results are stored as JSON in data
+    (see results.analysis_result), with each test also stored as a
+    ResultStatistic row; result holds the HTML of results saved before."""
+    key = db.Column(db.String(64), primary_key=True)
+    stat_func = db.Column(db.String(60))
+    stat_property = db.Column(db.String(), index=True)
+    data = db.Column(db.Text)
+    result = db.Column(db.String())
+    plot = db.Column(db.String())
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    statistics = db.relationship('ResultStatistic', backref='cached', lazy='dynamic',
+                                 cascade='all, delete-orphan')
+
+    @classmethod
+    def from_result(cls, key, result, plot=None):
+        """Builds the row of a structured result, with its statistics"""
+        row = cls(key=key, stat_func=result['analysis'], stat_property=result['property'],
+                  data=dumps(result), plot=plot)
+        for statistic in statistic_rows(result):
+            row.statistics.append(ResultStatistic(stat_func=row.stat_func,
+                                                  stat_property=row.stat_property,
+                                                  **statistic))
+        return row
+
+    def get_result(self):
+        """Structured result, or the HTML of results saved before"""
+        if self.data is not None:
+            return loads(self.data)
+        return self.result
+
+    def __repr__(self):
+        return f"<CachedResult '{self.key}'>"
+
+
+class ResultStatistic(db.Model):
+    """SQLAlchemy model for a single test of a CachedResult: its statistic and
+    p-value, plus the analysis and property, so that results of many
+    analyses can be queried directly, e.g. every p < 0.05 for a property.
+    For ANOVA tables there is one row per term, named in dataset."""
+    id = db.Column(db.Integer, primary_key=True)
+    result_key = db.Column(db.String(64), db.ForeignKey('cached_result.key'), index=True)
+    stat_func = db.Column(db.String(60))
+    stat_property = db.Column(db.String(), index=True)
+    test = db.Column(db.String(60))
+    dataset = db.Column(db.String())
+    statistic_name = db.Column(db.String(20))
+    statistic = db.Column(db.Float)
+    p_value = db.Column(db.Float, index=True)
+
+    def __repr__(self):
+        return f"<ResultStatistic '{self.test}', '{self.statistic}', '{self.p_value}'>"
+
+
 class Compute(db.Model):
     """SQLAlchemy model for storing results of previous calculations. Includes id to order
     calculations, name of file used (filename), the results, plot (for Two-way ANOVA case),
-    comments to be added to calculation, user_id and user."""
+    comments to be added to calculation, user_id and user. Results and plot may instead be
+    stored once in CachedResult, referenced by result_key."""
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String())
     result = db.Column(db.String())
     plot = db.Column(db.String())
     comments = db.Column(db.Text, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    result_key = db.Column(db.String(64), db.ForeignKey('cached_result.key'), nullable=True)
+    cached = db.relationship('CachedResult')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     user = db.relationship('User', backref=db.backref('Compute', lazy='dynamic'))
 
+    def get_result(self):
+        if self.result is None and self.cached is not None:
+            return self.cached.get_result()
+        return self.result
+
+    def get_plot(self):
+        if self.plot is None and self.cached is not None:
+            return self.cached.plot
+        return self.plot
+
     def __repr__(self):
         return f"<Compute '{self.result}', '{self.plot}'>"
 
-if not os.path.isfile(os.path.join(os.path.dirname(__file__), 'faststat.db')):
+
+def upgrade_schema():
+    """Brings the database up to date with the models. Missing tables are
+    created, and the columns and indexes added to existing tables since they
+    were created are added to them. Every change to the models so far only
+    adds tables, nullable columns and indexes, so this is enough to upgrade
+    any earlier database; it does nothing on an up-to-date one."""
+
     db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} '
+                                            f'ADD COLUMN {column.name} {column_type}'))
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(bind=connection)
+
+
+with app.app_context():
+    upgrade_schema()
@@ -0,0 +1,282 @@
+import os
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from faststat.anova import GroupStatistics, one_way_table
+from faststat.compute import normality_tests, null_hypothesis_tests
+from faststat.dataparse import DataSet
+from faststat.pairwise import all_pairs_sections
+from faststat.results import analysis_result, table_section
+
+# Analyses that can be run over every group of a grid
+GRID_TESTS = ['Statistical Info', 'Normality Tests', 'Null Hypothesis Tests', 'All Pairs']
+
+# Smallest group taking part in pairwise tests (Shapiro-Wilk needs 3 values)
+MIN_PAIR_SIZE = 3
+
+
+def partition(data_frame, columns):
+    """Splits the rows of a data frame by every combination of values of
+    columns, with a single groupby. Rows with missing values in columns are
+    left out.
+
+    Returns
+    ---
+
+    dict mapping each combination of values, as a tuple, to the positions
+    of its rows, in sorted order of the combinations"""
+
+    groups = data_frame.groupby(list(columns), sort=True, observed=True).indices
+    return {key if isinstance(key, tuple) else (key,): positions
+            for key, positions in groups.items()}
+
+
+def group_label(key):
+    """Label of a group, from the values of its grouping columns"""
+    return ' '.join(str(value) for value in key)
+
+
+def group_datasets(data_frame, columns, stat_property):
+    """Builds a DataSet of stat_property for every group of the grid defined
+    by columns. Groups left without data after outliers are removed are
+    skipped.
+
+    Returns
+    ---
+
+    list of (values of columns, DataSet) tuples"""
+
+    datasets = []
+    for key, positions in partition(data_frame, columns).items():
+        dataset = DataSet.from_rows(data_frame, stat_property, positions,
+                                    ''.join(str(value) + ' ' for value in key))
+        if dataset.sampling_size() == 0:
+            continue
+        datasets.append((key, dataset))
+
+    return datasets
+
+
+def summary_table(datasets, columns):
+    """Descriptive statistics of every group, computed in one grouped pass
+    over the values of all groups.
+
+    Arguments
+    ---
+
+    datasets : list
+        (values of columns, DataSet) tuples, see group_datasets
+
+    columns : list
+        Names of the grouping columns
+
+    Returns
+    ---
+
+    pandas.DataFrame with the values of columns and the statistics of each
+    group, one row per group"""
+
+    sizes = [dataset.sampling_size() for _, dataset in datasets]
+    values = pd.Series(np.concatenate([dataset.values
+                                       for _, dataset in datasets]))
+    codes = np.repeat(np.arange(len(datasets)), sizes)
+
+    grouped = values.groupby(codes)
+    table = pd.DataFrame({'No. of samples': grouped.count(),
+                          'Mean': grouped.mean(),
+                          'Standard deviation': grouped.std(),
+                          'Standard error of the mean': grouped.sem(),
+                          'Median': grouped.median(),
+                          'Quantile 25%': grouped.quantile(.25),
+                          'Quantile 75%': grouped.quantile(.75)})
+
+    keys = pd.DataFrame([key for key, _ in datasets], columns=list(columns))
+    table = pd.concat([keys, table.reset_index(drop=True)], axis=1)
+    table.index = [group_label(key) for key, _ in datasets]
+
+    return table
+
+
+def groups_anova(datasets):
+    """One-way ANOVA of the values of all groups, between groups.
+
+    Arguments
+    ---
+
+    datasets : list
+        (values of columns, DataSet) tuples, see group_datasets
+
+    Returns
+    ---
+
+    pandas.DataFrame with the ANOVA table (see anova.one_way_table)"""
+
+    sizes = [dataset.sampling_size() for _, dataset in datasets]
+    values = np.concatenate([dataset.values for _, dataset in datasets])
+    labels = np.repeat([group_label(key) for key, _ in datasets], sizes)
+    return one_way_table(GroupStatistics.from_values(values, labels))
+
+
+def grid_pairs(keys, all_pairs=False):
+    """Pairs of groups to be compared. By default only groups differing in
+    exactly one column are compared, e.g. two genotypes under the same
+    treatment; all pairs are compared if all_pairs is True.
+
+    Returns
+    ---
+
+    list of pairs of positions in keys"""
+
+    pairs = []
+    for first, second in combinations(range(len(keys)), 2):
+        differences = sum(a != b for a, b in zip(keys[first], keys[second]))
+        if all_pairs or differences == 1:
+            pairs.append((first, second))
+    return pairs
+
+
+def compare_pair(dataset_a, dataset_b, null_hypothesis=True):
+    """Runs the pairwise tests of two groups: normality tests and, if
+    null_hypothesis is True, null hypothesis tests (see compute).
+
+    Returns
+    ---
+
+    list with the statistics and p-values of one row of the pairwise table"""
+
+    # Normality tests mark the data sets as not normal; a group is compared
+    # with several others, so each comparison works on its own copies
+    dataset_a, dataset_b = copy(dataset_a), copy(dataset_b)
+
+    normality = normality_tests(dataset_a, dataset_b)['tests']
+    row = [normality[0]['p'], normality[1]['p'],
+           normality[2]['statistic'], normality[2]['p']]
+
+    if null_hypothesis:
+        tests = {test['test']: test for test in null_hypothesis_tests(dataset_a, dataset_b)['tests']}
+        t_test = tests["Student's t-test"]
+        rank_sum = tests.get('Wilcoxon rank-sum', {})
+        row += [t_test['statistic'], t_test['p'], rank_sum.get('statistic'), rank_sum.get('p')]
+
+    return row
+
+
+def _compare_pair(arguments):
+    return compare_pair(*arguments)
+
+
+def pairs_table(datasets, null_hypothesis=True, all_pairs=False, workers=1):
+    """Pairwise tests between the groups of a grid. Pairs are independent,
+    so they are run in a process pool when workers is larger than one.
+
+    Arguments
+    ---
+
+    datasets : list
+        (values of columns, DataSet) tuples, see group_datasets
+
+    null_hypothesis : bool
+        Whether null hypothesis tests are run besides normality tests
+
+    all_pairs : bool
+        Compare every pair of groups, instead of only groups differing in one
+        column (see grid_pairs)
+
+    workers : int
+        Number of processes running the tests. None uses one per CPU
+
+    Returns
+    ---
+
+    pandas.DataFrame with one row per pair"""
+
+    datasets = [(key, dataset) for key, dataset in datasets
+                if dataset.sampling_size() >= MIN_PAIR_SIZE]
+    pairs = grid_pairs([key for key, _ in datasets], all_pairs)
+    arguments = [(datasets[first][1], datasets[second][1], null_hypothesis)
+                 for first, second in pairs]
+    labels = [group_label(key) for key, _ in datasets]
+
+    if workers == 1 or len(arguments) < 2:
+        rows = [compare_pair(*argument) for argument in arguments]
+    else:
+        processes = workers or os.cpu_count() or 1
+        chunksize = max(1, len(arguments) // (4 * processes))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            rows = list(executor.map(_compare_pair, arguments, chunksize=chunksize))
+
+    columns = ['Dataset 1', 'Dataset 2', 'Shapiro-Wilk P (1)', 'Shapiro-Wilk P (2)',
+               'Levene W', 'Levene P']
+    if null_hypothesis:
+        columns += ['t', 't-test P', 'u', 'Rank-sum P']
+
+    table = pd.DataFrame([[labels[first], labels[second]] + row
+                          for (first, second), row in zip(pairs, rows)], columns=columns)
+    table.index = [f'{labels[first]} vs {labels[second]}' for first, second in pairs]
+
+    return table
+
+
+def run_grid(data_frame, stat_func, columns, stat_property, all_pairs=False, workers=1):
+    """Runs an analysis over every combination of values of the grouping
+    columns. The data frame is partitioned once, statistics of all groups
+    are computed together, and pairwise tests are run for the pairs of
+    groups (see grid_pairs).
+
+    Arguments
+    ---
+
+    data_frame : pandas.DataFrame
+        Spreadsheet data
+
+    stat_func : str
+        One of GRID_TESTS
+
+    columns : list
+        Names of the grouping columns
+
+    stat_property : str
+        Name of the property to be analyzed
+
+    all_pairs, workers :
+        See pairs_table
+
+    Returns
+    ---
+
+    dict with the structured results (see results.analysis_result): the
+    statistics of every group with, for Statistical Info, a one-way ANOVA
+    between them and, for tests, the pairwise table (for All
+    Pairs, the matrices of every pair, see pairwise.all_pairs_sections)"""
+
+    if stat_func not in GRID_TESTS:
+        raise ValueError(f'Unknown analysis: {stat_func}')
+
+    datasets = group_datasets(data_frame, columns, stat_property)
+    if not datasets:
+        raise ValueError(f'No data found for {stat_property}.')
+
+    sections = [table_section('Statistical Info', summary_table(datasets, columns),
+                              statistic=None, p_column=None)]
+
+    if stat_func == 'Statistical Info' and len(datasets) > 1:
+        sections.append(table_section('One-way ANOVA between groups', groups_anova(datasets),
+                                      p_column='P'))
+    elif stat_func == 'Normality Tests':
+        table = pairs_table(datasets, False, all_pairs, workers)
+        sections.append(table_section('Normality Tests', table, 'Levene W', 'Levene P'))
+    elif stat_func == 'Null Hypothesis Tests':
+        table = pairs_table(datasets, True, all_pairs, workers)
+        sections.append(table_section('Null Hypothesis Tests', table, 't', 't-test P'))
+    elif stat_func == 'All Pairs':
+        # Every pair is compared, in vectorized form, in this process
+        compared = [(key, dataset) for key, dataset in datasets
+                    if dataset.sampling_size() >= MIN_PAIR_SIZE]
+        sections += all_pairs_sections([dataset for _, dataset in compared],
+                                       [group_label(key) for key, _ in compared])
+
+    return analysis_result(stat_func, stat_property, sections)
@@ -0,0 +1,96 @@
+import numpy as np
+from scipy import stats
+
+
+def critical_values(sizes, alpha=0.05):
+    """Computes the two-sided Smirnov-Grubbs critical values for several
+    sample sizes at once.
+
+    Arguments
+    ---
+
+    sizes : array-like
+        Sample sizes (must be larger than 2)
+
+    alpha : float
+        Significance level
+
+    Returns
+    ---
+
+    np.ndarray with the critical G for each sample size"""
+
+    n = np.asarray(sizes, dtype=float)
+    t = stats.t.isf(alpha / (2 * n), n - 2)
+
+    return (n - 1) / np.sqrt(n) * np.sqrt(t**2 / (n - 2 + t**2))
+
+
+def grubbs_test(values, alpha=0.05):
+    """Iterative two-sided Smirnov-Grubbs test. At each step the value
+    farthest from the mean is removed if its G statistic exceeds the
+    critical value, until no outlier is left.
+
+    Values are sorted once, so the candidate outlier is always at one of the
+    two ends of the remaining range, and mean and variance are updated from
+    running sums as values are removed. All critical values are obtained in
+    a single call to scipy.stats.t.
+
+    Arguments
+    ---
+
+    values : array-like
+        One-dimensional numeric data, without NaN
+
+    alpha : float
+        Significance level. Use 0.05 by default
+
+    Returns
+    ---
+
+    np.ndarray with the values that passed the test, in their original order
+
+    np.ndarray with the positions of the removed outliers in values"""
+
+    values = np.asarray(values, dtype=float)
+    n = values.size
+
+    if n < 3:
+        return values.copy(), np.empty(0, dtype=np.intp)
+
+    order = np.argsort(values, kind='stable')
+    # Centering on the median keeps the running sums well conditioned
+    centred = values[order] - values[order[n // 2]]
+    total = centred.sum()
+    total_sq = np.dot(centred, centred)
+
+    # g_critical[k] is the critical value after k removals
+    g_critical = critical_values(np.arange(n, 2, -1), alpha)
+
+    low, high = 0, n - 1
+    while high - low >= 2:
+        size = high - low + 1
+        mean = total / size
+        variance = (total_sq - total * mean) / (size - 1)
+        if variance <= 0:
+            break
+
+        if centred[high] - mean >= mean - centred[low]:
+            target = high
+        else:
+            target = low
+
+        if abs(centred[target] - mean) / np.sqrt(variance) <= g_critical[n - size]:
+            break
+
+        total -= centred[target]
+        total_sq -= centred[target]**2
+        if target == high:
+            high -= 1
+        else:
+            low += 1
+
+    kept = np.sort(order[low:high + 1])
+    outliers = np.sort(np.concatenate((order[:low], order[high + 1:])))
+
+    return values[kept], outliers
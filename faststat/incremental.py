@@ -0,0 +1,308 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_numeric_dtype
+
+from faststat.anova import GroupStatistics, one_way_table
+from faststat.grubbs import grubbs_test
+from faststat.results import analysis_result, table_section
+
+# Centroids kept by a QuantileSketch. Quantiles are exact for groups of up
+# to this many values
+SKETCH_CAPACITY = 1000
+
+
+class QuantileSketch:
+    """Mergeable summary of a distribution, answering quantile queries. Values
+    are kept as sorted centroids (mean and weight). While there are at most
+    capacity of them, every value is its own centroid and quantiles are
+    exact; beyond that, neighbouring centroids are merged, more finely in
+    the tails than in the middle, as in a t-digest.
+
+    Attributes
+    ---
+
+    means, weights : np.ndarray
+        Sorted centroids
+
+    capacity : int
+        Largest number of centroids kept
+    """
+
+    __slots__ = ('_means', '_weights', '_capacity')
+
+    def __init__(self, values=(), capacity=SKETCH_CAPACITY):
+        self._means = np.sort(np.asarray(values, dtype=float))
+        self._weights = np.ones(self._means.size)
+        self._capacity = capacity
+        self._compress()
+
+    def merge(self, other):
+        """Returns a sketch of the values of both sketches"""
+        merged = QuantileSketch(capacity=self._capacity)
+        order = np.argsort(np.concatenate([self._means, other._means]), kind='stable')
+        merged._means = np.concatenate([self._means, other._means])[order]
+        merged._weights = np.concatenate([self._weights, other._weights])[order]
+        merged._compress()
+        return merged
+
+    def _compress(self):
+        if self._means.size <= self._capacity:
+            return
+
+        # Centroids are grouped by the arcsine of their position in the
+        # distribution, which keeps small centroids near both ends
+        cumulative = np.cumsum(self._weights)
+        middle = (cumulative - self._weights / 2) / cumulative[-1]
+        scale = (self._capacity - 1) / np.pi * (np.arcsin(2 * middle - 1) + np.pi / 2)
+        bins = np.floor(scale).astype(int)
+        _, starts = np.unique(bins, return_index=True)
+
+        weights = np.add.reduceat(self._weights, starts)
+        self._means = np.add.reduceat(self._means * self._weights, starts) / weights
+        self._weights = weights
+
+    def quantile(self, q):
+        """Quantile q of the values, interpolated linearly between centroids
+        like pandas does between values"""
+        if self._means.size == 0:
+            return np.nan
+
+        # Position of the centre of each centroid among the values
+        centres = np.cumsum(self._weights) - (self._weights + 1) / 2
+        return float(np.interp(q * (self._weights.sum() - 1), centres, self._means))
+
+    def count(self):
+        return self._weights.sum()
+
+    @property
+    def nbytes(self):
+        return self._means.nbytes + self._weights.nbytes
+
+    @property
+    def means(self):
+        return self._means
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+
+class GroupSummary:
+    """Mergeable statistics of the values of one group left after removing
+    NaN and outliers: count, sum and sum of squares of (value - shift), and
+    a QuantileSketch. The positions of the rows of the group, and of those
+    kept, are remembered so that outliers can be checked again when rows
+    are added.
+
+    Attributes
+    ---
+
+    rows : np.ndarray
+        Positions of the rows of the group
+
+    kept : np.ndarray
+        Positions of the rows whose value is kept
+
+    count, total, total_sq : float
+        Number, sum and sum of squares of the (value - shift) kept
+
+    sketch : QuantileSketch
+        Distribution of the values kept
+    """
+
+    __slots__ = ('rows', 'kept', 'count', 'total', 'total_sq', 'sketch')
+
+    def __init__(self, rows, kept, values, shift):
+        centred = values - shift
+        self.rows = rows
+        self.kept = kept
+        self.count = float(values.size)
+        self.total = float(centred.sum())
+        self.total_sq = float(centred @ centred)
+        self.sketch = QuantileSketch(values)
+
+    def add(self, rows, kept, values, shift):
+        """Adds rows to the group, whose kept values are values"""
+        centred = values - shift
+        self.rows = np.concatenate([self.rows, rows])
+        self.kept = np.concatenate([self.kept, kept])
+        self.count += values.size
+        self.total += float(centred.sum())
+        self.total_sq += float(centred @ centred)
+        self.sketch = self.sketch.merge(QuantileSketch(values))
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.kept.nbytes + self.sketch.nbytes
+
+
+def kept_rows(column, rows):
+    """Positions among rows of the values of column left after removing NaN
+    and Grubbs' outliers, as filter_numeric_data does
+
+    Returns
+    ---
+
+    np.ndarray with the positions, and np.ndarray with their values"""
+
+    values = column.iloc[rows]
+    if not is_numeric_dtype(values.dtype):
+        values = pd.to_numeric(values.astype(object))
+    values = values.to_numpy(dtype=float, na_value=np.nan)
+    finite = np.flatnonzero(~np.isnan(values))
+    _, outliers = grubbs_test(values[finite], alpha=0.05)
+    kept = np.delete(finite, outliers)
+    return rows[kept], values[kept]
+
+
+class IncrementalSummary:
+    """Statistics of a property in every group defined by some columns, kept
+    up to date as rows are appended to the data frame. Only the groups
+    receiving rows are updated: their outliers are checked again and, when
+    the same old values are kept, the new values are merged into the
+    statistics of the group; otherwise the group alone is summarized again.
+
+    Attributes
+    ---
+
+    columns : list
+        Names of the grouping columns
+
+    stat_property : str
+        Name of the property
+
+    groups : dict
+        GroupSummary of each combination of values of columns, as a tuple
+    """
+
+    def __init__(self, data_frame, columns, stat_property):
+        if stat_property not in data_frame.columns:
+            raise AttributeError(f"Could not find {stat_property} in data frame.")
+        self._columns = list(columns)
+        self._stat_property = stat_property
+        self._groups = {}
+
+        # Sums are accumulated around a value of the data, see
+        # anova.GroupStatistics
+        first = pd.to_numeric(data_frame[stat_property].dropna().iloc[:1].astype(object),
+                              errors='coerce')
+        self._shift = float(first.iloc[0]) if first.size and pd.notnull(first.iloc[0]) else 0.0
+
+        self.append(data_frame, 0)
+
+    def append(self, data_frame, start):
+        """Updates the statistics with the rows of data_frame from position
+        start on, the rows before it being those already summarized.
+
+        Returns
+        ---
+
+        list with the keys of the groups that changed"""
+        from faststat.grid import partition
+
+        column = data_frame[self._stat_property]
+        changed = []
+        for key, positions in partition(data_frame.iloc[start:], self._columns).items():
+            rows = positions + start
+            group = self._groups.get(key)
+            if group is not None:
+                rows = np.concatenate([group.rows, rows])
+
+            try:
+                kept, values = kept_rows(column, rows)
+            except (ValueError, TypeError):
+                kept, values = rows[:0], np.empty(0)
+
+            # Rows before start are those of the group already summarized
+            new = kept >= start
+            if group is not None and np.array_equal(kept[~new], group.kept):
+                group.add(rows[group.rows.size:], kept[new], values[new], self._shift)
+            else:
+                # New group, or the outliers among the old rows changed
+                self._groups[key] = GroupSummary(rows, kept, values, self._shift)
+            changed.append(key)
+
+        # In the order of grid.partition: categories in their order, other
+        # values sorted
+        orders = [data_frame[name].cat.categories.get_loc
+                  if isinstance(data_frame[name].dtype, CategoricalDtype) else None
+                  for name in self._columns]
+        self._groups = dict(sorted(self._groups.items(),
+                                   key=lambda item: tuple(value if order is None else order(value)
+                                                          for order, value in zip(orders, item[0]))))
+        return changed
+
+    def table(self):
+        """Descriptive statistics of every group with data, as in
+        grid.summary_table"""
+        from faststat.grid import group_label
+
+        groups = [(key, group) for key, group in self._groups.items() if group.count]
+        counts = np.array([group.count for _, group in groups])
+        totals = np.array([group.total for _, group in groups])
+        totals_sq = np.array([group.total_sq for _, group in groups])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+            stds = np.sqrt((totals_sq - totals * means) / (counts - 1))
+
+        table = pd.DataFrame({'No. of samples': counts.astype(int),
+                              'Mean': means + self._shift,
+                              'Standard deviation': stds,
+                              'Standard error of the mean': stds / np.sqrt(counts),
+                              'Median': [group.sketch.quantile(.5) for _, group in groups],
+                              'Quantile 25%': [group.sketch.quantile(.25) for _, group in groups],
+                              'Quantile 75%': [group.sketch.quantile(.75) for _, group in groups]})
+
+        keys = pd.DataFrame([key for key, _ in groups], columns=self._columns)
+        table = pd.concat([keys, table], axis=1)
+        table.index = [group_label(key) for key, _ in groups]
+        return table
+
+    def group_statistics(self):
+        """GroupStatistics of the groups with data, e.g. for a one-way ANOVA
+        between them"""
+        from faststat.grid import group_label
+
+        groups = [(key, group) for key, group in self._groups.items() if group.count]
+        return GroupStatistics([np.array([group_label(key) for key, _ in groups])],
+                               [group.count for _, group in groups],
+                               [group.total for _, group in groups],
+                               [group.total_sq for _, group in groups],
+                               self._shift)
+
+    def result(self, stat_func='Grid: Statistical Info'):
+        """Structured result with the statistics of every group and, with
+        two groups or more, a one-way ANOVA between them (see
+        grid.run_grid)"""
+        table = self.table()
+        if table.empty:
+            raise ValueError(f'No data found for {self._stat_property}.')
+
+        sections = [table_section('Statistical Info', table, statistic=None, p_column=None)]
+        if len(table) > 1:
+            sections.append(table_section('One-way ANOVA between groups',
+                                          one_way_table(self.group_statistics()),
+                                          p_column='P'))
+        return analysis_result(stat_func, self._stat_property, sections)
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def stat_property(self):
+        return self._stat_property
+
+    @property
+    def groups(self):
+        return self._groups
+
+    @property
+    def nbytes(self):
+        """Memory used by the statistics of all groups"""
+        return sum(group.nbytes for group in self._groups.values())
@@ -0,0 +1,97 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """Inverted index over the grouping columns of a data frame. For each
+    column, the positions of the rows holding each value are kept as sorted
+    integer arrays, so that a subset defined by several (column, value)
+    pairs is the intersection of a few precomputed arrays instead of a scan
+    of the whole frame per pair. The integer code of every row is kept as
+    well, so intersections cost one lookup per row of the smallest set.
+
+    Columns are indexed the first time they are queried, and the index is
+    built once per uploaded data frame. Missing values are not indexed.
+
+    Attributes
+    ---
+
+    data_frame : pandas.DataFrame
+        Data frame being indexed. Positions refer to its rows
+    """
+
+    def __init__(self, data_frame):
+        self._data_frame = data_frame
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def _column(self, column):
+        entry = self._columns.get(column)
+        if entry is not None:
+            return entry
+
+        if column not in self._data_frame.columns:
+            raise AttributeError(f"Could not find {column} in data frame.")
+
+        codes, uniques = pd.factorize(self._data_frame[column], sort=True)
+        # Stable sort keeps the positions of each value in increasing order
+        order = np.argsort(codes, kind='stable')
+        missing = np.count_nonzero(codes < 0)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        bounds = missing + np.concatenate(([0], np.cumsum(counts)))
+        values = list(uniques.tolist())
+        slots = {value: slot for slot, value in enumerate(values)}
+
+        entry = (values, slots, order, bounds, codes)
+        with self._lock:
+            self._columns[column] = entry
+
+        return entry
+
+    def values(self, column):
+        """Distinct values of a column, sorted when possible"""
+        return list(self._column(column)[0])
+
+    def positions(self, column, value):
+        """Sorted positions of the rows where column equals value"""
+        _, slots, order, bounds, _ = self._column(column)
+        slot = slots.get(value)
+        if slot is None:
+            return np.empty(0, dtype=order.dtype)
+        return order[bounds[slot]:bounds[slot + 1]]
+
+    def subset(self, **parms):
+        """Sorted positions of the rows matching every column=value pair in
+        parms. All rows if parms is empty."""
+        if not parms:
+            return np.arange(len(self._data_frame))
+
+        # Start from the most selective pair, then keep the rows whose codes
+        # match the other pairs
+        sizes = {column: self.positions(column, value).size
+                 for column, value in parms.items()}
+        columns = sorted(parms, key=sizes.get)
+        positions = self.positions(columns[0], parms[columns[0]])
+
+        for column in columns[1:]:
+            if positions.size == 0:
+                break
+            _, slots, _, _, codes = self._column(column)
+            slot = slots.get(parms[column], -2)
+            positions = positions[codes[positions] == slot]
+
+        return positions
+
+    @property
+    def data_frame(self):
+        return self._data_frame
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays of the indexed columns"""
+        with self._lock:
+            entries = list(self._columns.values())
+        return sum(order.nbytes + bounds.nbytes + codes.nbytes
+                   for _, _, order, bounds, codes in entries)
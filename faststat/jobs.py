@@ -0,0 +1,391 @@
+import os
+import pickle
+import signal
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+
+from faststat.metrics import collect, record_spans
+
+# Jobs shared through a folder are reported as timed out this long after
+# their deadline if no outcome was saved, e.g. because their worker died
+SHARED_GRACE = 30
+
+# Files of shared jobs are removed this long after they were written, in
+# seconds, at most once every CLEAN_INTERVAL seconds
+JOB_FILES_MAX_AGE = 24 * 3600
+CLEAN_INTERVAL = 600
+
+
+class JobTimeout(Exception):
+    """Raised inside a worker when a job exceeds its time limit"""
+
+
+def _expire(signum, frame):
+    raise JobTimeout("The analysis took too long and was cancelled.")
+
+
+def run_with_limit(deadline, func, *args, **kwargs):
+    """Runs func in a worker process, interrupting it with JobTimeout when
+    the wall-clock deadline (as given by time.time()) is reached. Pool
+    workers run one job at a time in their main thread, so a timer signal
+    can stop the job without killing the worker.
+
+    Returns
+    ---
+
+    the value returned by func, and the spans of the stages it ran (see
+    metrics.collect), to be recorded by the web app's process"""
+
+    remaining = None if deadline is None else deadline - time.time()
+    if remaining is not None and remaining <= 0:
+        raise JobTimeout("The analysis waited too long in the queue.")
+
+    if remaining is None or not hasattr(signal, 'setitimer'):
+        with collect() as spans:
+            value = func(*args, **kwargs)
+        return value, spans
+
+    previous = signal.signal(signal.SIGALRM, _expire)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        with collect() as spans:
+            value = func(*args, **kwargs)
+        return value, spans
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _write(path, value):
+    """Pickles value to path atomically, so that readers never see a
+    partial file"""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            pickle.dump(value, stream)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_outcome(folder, job_id, outcome):
+    """Saves the outcome of a shared job: ('done', (value, spans)), or
+    ('failed', exception). Exceptions that cannot be pickled are saved as
+    a RuntimeError with their message."""
+    path = os.path.join(folder, job_id + '.outcome')
+    try:
+        _write(path, outcome)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        _write(path, ('failed', RuntimeError(f'{type(outcome[1]).__name__}: {outcome[1]}')))
+
+
+def run_shared(folder, job_id, deadline, func, *args, **kwargs):
+    """Runs a job in a worker process (see run_with_limit) and saves its
+    outcome in folder, where any web process can read it"""
+    try:
+        outcome = run_with_limit(deadline, func, *args, **kwargs)
+    except Exception as error:
+        save_outcome(folder, job_id, ('failed', error))
+        raise
+    save_outcome(folder, job_id, ('done', outcome))
+    return outcome
+
+
+class Job:
+    """A job submitted by this process: its future and the metadata needed
+    to deliver its result (owner, cache key, ...)"""
+
+    def __init__(self, future, deadline, meta):
+        self.future = future
+        self.deadline = deadline
+        self.meta = meta
+        self.timed_out = False
+        self.recorded = False
+
+    def status(self):
+        if self.timed_out:
+            return 'timeout'
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.running():
+            return 'running'
+        if not self.future.done():
+            return 'pending'
+        if isinstance(self.future.exception(), JobTimeout):
+            return 'timeout'
+        if self.future.exception() is not None:
+            return 'failed'
+        return 'done'
+
+    def done(self):
+        return self.timed_out or self.future.done()
+
+    def outcome(self):
+        """The value returned by the job and its spans, raising the
+        exception it raised if it failed"""
+        if self.timed_out:
+            raise JobTimeout("The analysis took too long and was cancelled.")
+        try:
+            return self.future.result(timeout=0)
+        except CancelledError:
+            raise JobTimeout("The analysis was cancelled.")
+
+
+class SharedJob:
+    """A job submitted by another web process, known from the files it
+    left in the folder shared by the JobQueues (see JobQueue.submit)"""
+
+    def __init__(self, folder, job_id, deadline, meta):
+        self._path = os.path.join(folder, job_id + '.outcome')
+        self.deadline = deadline
+        self.meta = meta
+        self.recorded = False
+        self._outcome = None
+
+    def _load(self):
+        if self._outcome is None:
+            try:
+                with open(self._path, 'rb') as stream:
+                    self._outcome = pickle.load(stream)
+            except FileNotFoundError:
+                pass
+        return self._outcome
+
+    def status(self):
+        outcome = self._load()
+        if outcome is None:
+            # The worker may have died, or the job been cancelled in the
+            # queue of the process that submitted it
+            if time.time() > self.deadline + SHARED_GRACE:
+                return 'timeout'
+            return 'running'
+        if outcome[0] == 'done':
+            return 'done'
+        return 'timeout' if isinstance(outcome[1], JobTimeout) else 'failed'
+
+    def done(self):
+        return self.status() not in ('pending', 'running')
+
+    def outcome(self):
+        """See Job.outcome"""
+        outcome = self._load()
+        if outcome is None:
+            raise JobTimeout("The analysis took too long and was cancelled.")
+        if outcome[0] == 'failed':
+            raise outcome[1]
+        return outcome[1]
+
+
+class JobQueue:
+    """Runs heavy analyses in a local process pool, off the request thread.
+    Jobs are identified by a random id that can be polled for status and
+    result. Jobs that run for longer than time_limit are interrupted, and
+    jobs still waiting in the queue past their deadline are cancelled.
+
+    When a folder is given, jobs are shared through it with the JobQueues
+    of other web processes using the same folder: each job's metadata is
+    written there when it is submitted and its outcome when it ends, so
+    that it can be polled from any of them.
+
+    Attributes
+    ---
+
+    max_workers : int
+        Number of worker processes. Use one per CPU by default
+
+    time_limit : float
+        Maximum time in seconds a job may take, queueing included
+
+    max_jobs : int
+        Number of finished jobs remembered for polling
+
+    folder : str
+        Folder where jobs are shared. Optional
+    """
+
+    def __init__(self, max_workers=None, time_limit=300, max_jobs=1000, folder=None):
+        self._max_workers = max_workers
+        self._time_limit = time_limit
+        self._max_jobs = max_jobs
+        self._folder = folder
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._cleaned_at = None
+
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def _pool(self):
+        # Created on first use, so importing the app does not spawn workers
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+        return self._executor
+
+    def submit(self, func, *args, meta=None, **kwargs):
+        """Submits func(*args, **kwargs) to the pool.
+
+        Arguments
+        ---
+
+        func : callable
+            Function to run. It and its arguments must be picklable
+
+        meta : dict
+            Data kept with the job, e.g. its owner. It must be picklable
+            when jobs are shared
+
+        Returns
+        ---
+
+        str with the job id"""
+
+        job_id = uuid.uuid4().hex
+        deadline = time.time() + self._time_limit
+        meta = meta or {}
+
+        if self._folder is None:
+            call = (run_with_limit, deadline, func) + args
+        else:
+            _write(os.path.join(self._folder, job_id + '.job'), (deadline, meta))
+            call = (run_shared, self._folder, job_id, deadline, func) + args
+
+        with self._lock:
+            try:
+                future = self._pool().submit(*call, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory) and took the pool with
+                # it; jobs already submitted fail, new ones get a new pool
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                future = self._pool().submit(*call, **kwargs)
+            self._jobs[job_id] = Job(future, time.monotonic() + self._time_limit, meta)
+            self._trim()
+
+        if self._folder is not None:
+            future.add_done_callback(lambda future: self._save_failure(job_id, future))
+            self._clean()
+        return job_id
+
+    def get(self, job_id):
+        """Returns the Job with the given id, or None. Jobs of other processes
+        are looked for in the shared folder."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+        if job is None and self._folder is not None and job_id.isalnum():
+            try:
+                with open(os.path.join(self._folder, job_id + '.job'), 'rb') as stream:
+                    deadline, meta = pickle.load(stream)
+            except FileNotFoundError:
+                return None
+            job = SharedJob(self._folder, job_id, deadline, meta)
+            if job.done():
+                # Kept, so that it is only read and recorded once here
+                with self._lock:
+                    job = self._jobs.setdefault(job_id, job)
+                    self._trim()
+
+        if job is not None:
+            self._check_deadline(job)
+        return job
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return None if job is None else job.status()
+
+    def result(self, job_id):
+        """Returns the result of a finished job, raising the exception it
+        raised if it failed. The stage timings of the job are added to the
+        metrics of this process the first time its result is read."""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        value, spans = job.outcome()
+
+        if not job.recorded:
+            job.recorded = True
+            record_spans(spans)
+        return value
+
+    def claim(self, job_id):
+        """Tells whether the caller is the first to deliver the result of a
+        job, e.g. to save it in a user's history, across all the processes
+        sharing jobs"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+
+        if self._folder is None:
+            claimed = not job.meta.get('delivered')
+            job.meta['delivered'] = True
+            return claimed
+
+        try:
+            os.close(os.open(os.path.join(self._folder, job_id + '.delivered'),
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        return isinstance(job, Job) and job.future.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _check_deadline(self, job):
+        # Running jobs stop themselves; queued ones are cancelled here.
+        if isinstance(job, Job) and not job.future.done() and time.monotonic() > job.deadline:
+            if job.future.cancel():
+                job.timed_out = True
+
+    def _save_failure(self, job_id, future):
+        # Jobs that never ran, or whose worker died, left no outcome
+        if future.cancelled():
+            error = JobTimeout("The analysis took too long and was cancelled.")
+        else:
+            error = future.exception()
+        if error is not None and not os.path.exists(os.path.join(self._folder,
+                                                                 job_id + '.outcome')):
+            save_outcome(self._folder, job_id, ('failed', error))
+
+    def _clean(self):
+        """Removes the files of shared jobs older than JOB_FILES_MAX_AGE"""
+        if self._cleaned_at is not None and time.monotonic() - self._cleaned_at < CLEAN_INTERVAL:
+            return
+        self._cleaned_at = time.monotonic()
+
+        cutoff = time.time() - JOB_FILES_MAX_AGE
+        for name in os.listdir(self._folder):
+            path = os.path.join(self._folder, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _trim(self):
+        while len(self._jobs) > self._max_jobs:
+            oldest = next(iter(self._jobs))
+            if not self._jobs[oldest].done():
+                break
+            del self._jobs[oldest]
+
+    @property
+    def time_limit(self):
+        return self._time_limit
+
+    @property
+    def folder(self):
+        return self._folder
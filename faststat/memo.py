@@ -0,0 +1,147 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from faststat import db
+from faststat.db_models import CachedResult, Compute, ResultStatistic
+
+# Expired results are removed from the database at most this often, in
+# seconds
+PRUNE_INTERVAL = 600
+
+# Number of results deleted per statement when pruning
+PRUNE_BATCH = 500
+
+
+def result_key(data_hash, stat_func, parms, stat_property):
+    """Builds the cache key of an analysis from the hash of the data set and
+    a canonical form of the analysis parameters. Keys of parms are sorted;
+    the order of data sets, for two-set analyses, is kept."""
+
+    if isinstance(parms, dict):
+        parms = [parms]
+    canonical = json.dumps({'data': data_hash,
+                            'func': stat_func,
+                            'parms': [sorted(p.items(), key=lambda item: str(item[0]))
+                                      for p in parms],
+                            'property': stat_property},
+                           default=str)
+
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of analysis results. Recent results are kept in an
+    in-process LRU with a time-to-live, backed by the CachedResult table so
+    that results survive restarts and are shared between workers. Rows of
+    the table expire after the same time-to-live, unless a user saved the
+    result in their history. Results read from the database expire from
+    memory when their row does, so that memory never holds a result whose
+    row may have been pruned by another worker.
+
+    Attributes
+    ---
+
+    max_entries : int
+        Number of results kept in memory
+
+    ttl : float
+        Time in seconds a result is kept in memory and in the database
+    """
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned_at = None
+
+    def get(self, key):
+        """Returns the (result, plot) stored under key, or None"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        row = CachedResult.query.get(key)
+        if row is None or row.created is None:
+            return None
+
+        # Expired rows are misses, even if kept for a user's history
+        age = (datetime.utcnow() - row.created).total_seconds()
+        if age >= self._ttl:
+            return None
+
+        value = (row.get_result(), row.plot)
+        self._remember(key, value, self._ttl - age)
+        return value
+
+    def put(self, key, result, plot=None):
+        """Stores a structured result (see results.analysis_result) in both
+        tiers"""
+
+        row = CachedResult.query.get(key)
+        ttl = self._ttl
+        if row is None:
+            try:
+                db.session.add(CachedResult.from_result(key, result, plot))
+                db.session.commit()
+            except IntegrityError:
+                # Stored meanwhile by another worker; results of a key are
+                # the same, so its row is kept
+                db.session.rollback()
+        else:
+            age = self._ttl if row.created is None else \
+                  (datetime.utcnow() - row.created).total_seconds()
+            if age >= self._ttl:
+                # Computed again after its row expired
+                row.created = datetime.utcnow()
+                db.session.commit()
+            else:
+                ttl = self._ttl - age
+        self._remember(key, (result, plot), ttl)
+
+        if self._pruned_at is None or time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self):
+        """Deletes the results stored more than ttl seconds ago, with their
+        statistics, from the database. Results referenced by a Compute row
+        of a user's history are kept.
+
+        Returns
+        ---
+
+        int with the number of results deleted"""
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self._ttl)
+        saved = db.session.query(Compute.result_key).filter(Compute.result_key.isnot(None))
+        keys = [key for key, in db.session.query(CachedResult.key)
+                .filter(CachedResult.created < cutoff, CachedResult.key.notin_(saved))]
+
+        for start in range(0, len(keys), PRUNE_BATCH):
+            batch = keys[start:start + PRUNE_BATCH]
+            ResultStatistic.query.filter(ResultStatistic.result_key.in_(batch)) \
+                                 .delete(synchronize_session=False)
+            CachedResult.query.filter(CachedResult.key.in_(batch)) \
+                              .delete(synchronize_session=False)
+        db.session.commit()
+        self._pruned_at = time.monotonic()
+        return len(keys)
+
+    def _remember(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,235 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter, one value per combination of labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _labels(self.label_names, key), value
+
+
+class Histogram:
+    """Distribution of observed values (e.g. latencies) in cumulative
+    buckets, one histogram per combination of labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _labels(self.label_names, key, [('le', bound)]), cumulative)
+            yield self.name + '_sum', _labels(self.label_names, key), total
+            yield self.name + '_count', _labels(self.label_names, key), cumulative
+
+
+class Registry:
+    """Set of metrics exposed together in the Prometheus text format. Values
+    are kept per process: with several server processes, each one exposes
+    its own."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram(
+    'faststat_request_duration_seconds', 'Time spent serving requests.',
+    ('endpoint', 'method')))
+requests_total = registry.register(Counter(
+    'faststat_requests_total', 'Requests served.', ('endpoint', 'method', 'status')))
+stage_seconds = registry.register(Histogram(
+    'faststat_stage_duration_seconds', 'Time spent in each stage of an analysis.',
+    ('stage', 'stat_func')))
+rows_total = registry.register(Counter(
+    'faststat_rows_processed_total', 'Spreadsheet rows processed by each stage.',
+    ('stage', 'stat_func')))
+analyses_total = registry.register(Counter(
+    'faststat_analyses_total', 'Analyses requested, by where their result came from.',
+    ('stat_func', 'source')))
+
+
+class Span:
+    """Timing of one stage. Code running in the stage may set rows to the
+    number of rows it processed."""
+
+    __slots__ = ('name', 'labels', 'seconds', 'rows')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.seconds = 0.0
+        self.rows = None
+
+    def as_tuple(self):
+        return self.name, self.labels, self.seconds, self.rows
+
+
+_local = threading.local()
+
+
+def record(name, labels, seconds, rows=None):
+    """Adds the timing of a stage to the metrics, and to the spans being
+    collected in this thread, if any"""
+
+    stage_seconds.observe(seconds, stage=name, **labels)
+    if rows is not None:
+        rows_total.inc(rows, stage=name, **labels)
+
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append((name, labels, seconds, rows))
+
+
+def record_spans(spans):
+    """Records spans collected elsewhere, e.g. in a worker process"""
+    for name, labels, seconds, rows in spans:
+        record(name, labels, seconds, rows)
+
+
+@contextmanager
+def stage(name, **labels):
+    """Times the enclosed block as a stage of an analysis.
+
+    Arguments
+    ---
+
+    name : str
+        Name of the stage
+
+    labels :
+        Labels of the stage in the metrics, e.g. stat_func
+
+    Returns
+    ---
+
+    Span, whose rows may be set within the block. Stages nested in it
+    inherit its labels"""
+
+    outer = getattr(_local, 'labels', None) or {}
+    labels = {**outer, **labels}
+    span = Span(name, labels)
+    _local.labels = labels
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span.seconds = time.perf_counter() - start
+        _local.labels = outer
+        record(*span.as_tuple())
+
+
+def timed(name):
+    """Decorator timing every call of a function as a stage"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect():
+    """Collects the spans of the stages run by this thread within the block.
+
+    Returns
+    ---
+
+    list of (name, labels, seconds, rows) tuples, filled as stages end"""
+
+    previous = getattr(_local, 'spans', None)
+    _local.spans = []
+    try:
+        yield _local.spans
+    finally:
+        _local.spans = previous
+
+
+def start_collecting():
+    """Starts collecting spans in this thread, e.g. for a request"""
+    _local.spans = []
+
+
+def stop_collecting():
+    """Stops collecting spans in this thread and returns them"""
+    spans = getattr(_local, 'spans', None)
+    _local.spans = None
+    return spans or []
+
+
+def server_timing(spans):
+    """Value of a Server-Timing header with the total time of each stage"""
+
+    totals = {}
+    for name, _, seconds, _ in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items())
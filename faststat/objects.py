@@ -1,5 +1,11 @@
+import logging
+from io import BytesIO
 from werkzeug.utils import secure_filename
-import pandas as pd
+
+from faststat.cache import DataCache
+from faststat.metrics import stage
+
+logger = logging.getLogger(__name__)
 
 class FastStat:
     """A class to handle user inputs within FastStat, from the spreadsheet to
@@ -14,6 +20,10 @@ class FastStat:
     file_name : str
         The uploaded spreasheet file name
 
+    data_hash : str
+        SHA-256 of the uploaded file and of the options it was read with,
+        used as key in the DataCache
+
     parm_names : list
         A list containing all the column names extracted from the spreasheet. 
         Those must be added manually by the spreasheet creator. Specific 
@@ -23,6 +33,14 @@ class FastStat:
         'Total' kind of property of those bins must follow. See 'example'
         folder for a sample file.
 
+    binned : dict
+        Variables measured over bins, as BinnedVariable objects keyed by
+        variable name. Built once per data frame
+
+    group_index : GroupIndex
+        Inverted index used to subset data_frame and list the values of
+        its columns. Built once per data frame
+
     parms : dict
         A dictionary that stores the choice of parameters the user wishes to
         use to define a subset for analysis. Keys are the spreasheet column 
@@ -32,7 +50,7 @@ class FastStat:
     stat_func : str
         Name of the statistical function to be used in the analysis. This
         includes: Basic Statistics, Normality Test, Null-Hypothesis Test, 
-        One- and Two-way ANOVA 
+        One-, Two- and N-way ANOVA
 
     stat_property : str
         Name of the parameter to be analyzed statistically.
@@ -41,24 +59,143 @@ class FastStat:
         HTML template to be rendered
     """
 
-    def __init__(self, file = None):
+    def __init__(self, file = None, cache = None, num_bin = 3, float_dtype = 'float64'):
+        # Options of read_data, used for this file and any appended to it
+        self._read_options = {'num_bin': num_bin, 'float_dtype': float_dtype}
+
         if file is None:
             self._data_frame = None
+            self._data_hash = None
             self._file_name = None
             self._parm_names = None
 
         else:
             self._file_name = secure_filename(file.filename)
-            self._data_frame = self.read_data(file)
+            self._data_frame, self._data_hash = self.load_data(file, cache,
+                                                               **self._read_options)
             self._parm_names = self.data_frame.columns.values.tolist()
 
+        self._frame_bytes = None
+        self._binned = None
+        self._group_index = None
+        self._summaries = {}
         self._parms = {}
         self._stat_func = None
         self._stat_property = None
         self._template = "view_input.html"
 
 
-    def read_data(self, input_file, num_bin = 3):
+    @classmethod
+    def from_cache(cls, cache, data_hash, file_name = None):
+        """Builds a FastStat object from a data frame in the cache, e.g. for a
+        data set uploaded before a restart
+
+        Returns
+        ---
+            FastStat, or None if data_hash is not in the cache"""
+
+        data_frame = cache.load(data_hash)
+        if data_frame is None:
+            return None
+        return cls.from_frame(data_frame, data_hash, file_name)
+
+
+    @classmethod
+    def from_frame(cls, data_frame, data_hash = None, file_name = None):
+        """Builds a FastStat object around a data frame already read
+
+        Returns
+        ---
+            FastStat"""
+
+        info = cls()
+        info._data_frame = data_frame
+        info._data_hash = data_hash
+        info._file_name = file_name
+        info._parm_names = data_frame.columns.values.tolist()
+        return info
+
+
+    @classmethod
+    def from_state(cls, cache, state):
+        """Builds a FastStat object from the state saved by state(), e.g. in
+        a worker process other than the one that served the upload. The
+        data frame is read from the cache.
+
+        Returns
+        ---
+            FastStat, without data if it is no longer in the cache"""
+
+        info = None
+        if state.get('data_hash') is not None:
+            info = cls.from_cache(cache, state['data_hash'], state.get('file_name'))
+        if info is None:
+            info = cls()
+        info.load_state(state)
+        return info
+
+
+    def state(self):
+        """Returns what identifies the data and the analysis being set up, as
+        plain JSON types, to be kept in the user's session. Parameters are
+        kept as pairs, since their order matters."""
+        parms = self._parms if isinstance(self._parms, list) else [self._parms]
+        return {'data_hash': self._data_hash,
+                'file_name': self._file_name,
+                'parms': [[list(item) for item in data_set.items()] for data_set in parms],
+                'two_sets': isinstance(self._parms, list),
+                'stat_func': self._stat_func,
+                'stat_property': self._stat_property,
+                'template': self._template}
+
+
+    def load_state(self, state):
+        """Sets the analysis being set up from the state saved by state()"""
+        parms = [dict(data_set) for data_set in state.get('parms', [[]])]
+        self._parms = parms if state.get('two_sets') else parms[0]
+        self._stat_func = state.get('stat_func')
+        self._stat_property = state.get('stat_property')
+        self._template = state.get('template', "view_input.html")
+
+
+    def load_data(self, input_file, cache = None, num_bin = 3, float_dtype = 'float64'):
+        """Reads an uploaded spreadsheet, going through the content-addressed
+        cache if one is given. The spreadsheet is parsed (and its bins
+        renamed) only the first time its contents are seen with the same
+        options.
+
+        Arguments
+        ---
+
+        input_file : file-like
+            Uploaded xls or xlsx file
+
+        cache : DataCache
+            Cache of previously parsed spreadsheets. Optional
+
+        num_bin, float_dtype :
+            See read_data
+
+        Returns
+        ---
+            pd.DataFrame and the hash of the file contents and options"""
+
+        content = input_file.read()
+        data_hash = DataCache.digest(content, num_bin=num_bin, float_dtype=float_dtype)
+
+        if cache is not None:
+            data_frame = cache.load(data_hash)
+            if data_frame is not None:
+                return data_frame, data_hash
+
+        data_frame = self.read_data(BytesIO(content), num_bin, float_dtype)
+        if cache is not None:
+            cache.store(data_hash, data_frame)
+
+        return data_frame, data_hash
+
+
+    def read_data(self, input_file, num_bin = 3, float_dtype = 'float64'):
         """Opens MS Excel spreadsheet and converts it to a pandas 
         DataFrame
 
@@ -71,12 +208,24 @@ class FastStat:
         num_bin : int
             Number of bins used in this spreadsheet. Use 3 by default
 
+        float_dtype : str
+            Floating point type used for measurements. 'float32' halves
+            the memory footprint at the cost of precision
+
         Returns
         ---
-            pd.DataFrame format of the spreadsheet"""
+            pd.DataFrame format of the spreadsheet, with typed columns (see
+            dataparse.infer_dtypes)"""
+
+        # pandas and the parsing code are loaded with the first spreadsheet
+        import pandas as pd
+        from faststat.dataparse import infer_dtypes
 
-        input_data = pd.read_excel(input_file)
+        with stage('read_excel') as span:
+            input_data = pd.read_excel(input_file)
+            span.rows = len(input_data)
         renamed_columns = list(input_data.columns)
+        measurements = []
 
         for i in range(len(renamed_columns)):
             """Rename 'Unnamed' columns that are formed from merged 
@@ -87,8 +236,142 @@ class FastStat:
 
                 renamed_columns[i-1] += ' bin 1'
 
-        return pd.DataFrame(input_data.values, columns=pd.Index(renamed_columns))
+                # Bins and the Average/Total column that follows them are
+                # measurements, whatever their values look like
+                measurements += renamed_columns[i-1:i+num_bin]
+
+        input_data.columns = pd.Index(renamed_columns)
+
+        with stage('infer_dtypes'):
+            return infer_dtypes(input_data, measurements, float_dtype)
+
+
+
+    def append(self, input_file, cache = None):
+        """Adds the rows of another spreadsheet, with the same columns, to
+        the loaded data, e.g. measurements made after the first upload.
+        Group statistics already computed (see grid_summary) are updated
+        with the new rows only.
+
+        Arguments
+        ---
+
+        input_file : file-like
+            Uploaded xls or xlsx file
+
+        cache : DataCache
+            Where the data is kept. Optional
+
+        Returns
+        ---
+            int with the number of rows added"""
+        from faststat.dataparse import append_rows
+
+        content = input_file.read()
+        new_rows = self.read_data(BytesIO(content), **self._read_options)
+
+        start = len(self._data_frame)
+        with stage('append_rows') as span:
+            span.rows = len(new_rows)
+            self._data_frame = append_rows(self._data_frame, new_rows)
+
+        # The data is identified by everything uploaded so far, in order
+        self._data_hash = DataCache.digest(self._data_hash.encode() + content)
+        if cache is not None:
+            cache.store(self._data_hash, self._data_frame)
+
+        # Rebuilt on first use
+        self._frame_bytes = None
+        self._binned = None
+        self._group_index = None
+
+        with stage('update_summaries'):
+            for summary in self._summaries.values():
+                summary.append(self._data_frame, start)
+
+        return len(new_rows)
+
+
+    def grid_summary(self, columns, stat_property):
+        """Statistics of stat_property in every group of columns, kept up to
+        date as rows are appended.
+
+        Returns
+        ---
+            IncrementalSummary"""
+        from faststat.incremental import IncrementalSummary
+
+        key = (tuple(columns), stat_property)
+        if key not in self._summaries:
+            self._summaries[key] = IncrementalSummary(self._data_frame, columns, stat_property)
+        return self._summaries[key]
+
+
+    def has_grid_summary(self, columns, stat_property):
+        """Tells whether grid_summary is already built for these columns and
+        property, so that it only has to be read"""
+        return (tuple(columns), stat_property) in self._summaries
+
 
+    def keep_grid_summary(self, columns, stat_property, summary):
+        """Keeps an IncrementalSummary of the current data built elsewhere,
+        e.g. in a job, to be returned and updated by grid_summary"""
+        self._summaries[(tuple(columns), stat_property)] = summary
+
+
+    def memory_usage(self):
+        """Returns the size in bytes of the loaded data frame and of what was
+        built from it: binned variables, group index and grid summaries.
+        The data frame is measured once."""
+        if self._data_frame is None:
+            return 0
+
+        if self._frame_bytes is None:
+            self._frame_bytes = int(self._data_frame.memory_usage(deep=True).sum())
+
+        size = self._frame_bytes
+        if self._binned is not None:
+            size += sum(variable.nbytes for variable in self._binned.values())
+        if self._group_index is not None:
+            size += self._group_index.nbytes
+        return size + sum(summary.nbytes for summary in self._summaries.values())
+
+
+    def release(self, cache):
+        """Drops the data frame, and what was built from it, from memory,
+        making sure it can be restored from the cache later on. The data
+        frame is kept if it cannot be written to the cache. The analysis
+        state is kept.
+
+        Returns
+        ---
+            bool telling whether the data frame was released"""
+        if self._data_frame is None:
+            return True
+
+        if self._data_hash not in cache and not cache.store(self._data_hash, self._data_frame):
+            logger.warning('Could not write data %s to the cache, keeping it in memory',
+                           self._data_hash)
+            return False
+
+        self._data_frame = None
+        self._frame_bytes = None
+        self._binned = None
+        self._group_index = None
+        self._summaries = {}
+        return True
+
+
+    def restore(self, cache):
+        """Reloads a released data frame from the cache.
+
+        Returns
+        ---
+            bool telling whether the data frame is available"""
+        if self._data_frame is None and self._data_hash is not None:
+            self._data_frame = cache.load(self._data_hash)
+            self._frame_bytes = None
+        return self._data_frame is not None
 
 
     def reset(self, hard_reset=False):
@@ -107,6 +390,24 @@ class FastStat:
     def data_frame(self):
         return self._data_frame
 
+    @property
+    def data_hash(self):
+        return self._data_hash
+
+    @property
+    def binned(self):
+        if self._binned is None and self._data_frame is not None:
+            from faststat.dataparse import bin_variables
+            self._binned = bin_variables(self._data_frame)
+        return self._binned
+
+    @property
+    def group_index(self):
+        if self._group_index is None and self._data_frame is not None:
+            from faststat.index import GroupIndex
+            self._group_index = GroupIndex(self._data_frame)
+        return self._group_index
+
     @property
     def file_name(self):
         return self._file_name
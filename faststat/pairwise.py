@@ -0,0 +1,142 @@
+import numpy as np
+from scipy import stats
+
+from faststat.results import matrix_section
+
+# Columns of the matrix sections of all-pairs comparisons
+CORRECTIONS = ['P (Holm)', 'P (BH)']
+
+
+def pair_indices(count):
+    """Positions of the groups of every pair, in the order of a condensed
+    upper triangle: (0, 1), (0, 2), ..., (1, 2), ..."""
+    return np.triu_indices(count, k=1)
+
+
+def finite_order(p_values):
+    """Positions of the finite p-values, from the smallest p-value up. Tests
+    that could not be computed (NaN p-value) are left out of the family."""
+    finite = np.flatnonzero(np.isfinite(p_values))
+    return finite[np.argsort(p_values[finite], kind='stable')]
+
+
+def holm(p_values):
+    """Holm-Bonferroni adjusted p-values (family-wise error rate). NaN
+    p-values are kept as NaN and do not count as tests."""
+    p_values = np.asarray(p_values, dtype=float)
+    order = finite_order(p_values)
+    count = order.size
+    adjusted = np.maximum.accumulate((count - np.arange(count)) * p_values[order])
+    result = np.full(p_values.size, np.nan)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (false discovery rate). NaN
+    p-values are kept as NaN and do not count as tests."""
+    p_values = np.asarray(p_values, dtype=float)
+    order = finite_order(p_values)[::-1]
+    count = order.size
+    adjusted = np.minimum.accumulate(p_values[order] * count / np.arange(count, 0, -1))
+    result = np.full(p_values.size, np.nan)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+def pairwise_t_tests(sizes, means, stds):
+    """Student's t-tests (equal variances, as scipy.stats.ttest_ind) of every
+    pair of groups, from the size, mean and standard deviation of each group.
+
+    Returns
+    ---
+
+    np.ndarray with the t statistics and np.ndarray with the p-values, one
+    value per pair (see pair_indices)"""
+
+    first, second = pair_indices(sizes.size)
+    n_a, n_b = sizes[first], sizes[second]
+    df = n_a + n_b - 2
+    pooled_variance = ((n_a - 1) * stds[first] ** 2 + (n_b - 1) * stds[second] ** 2) / df
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (means[first] - means[second]) / np.sqrt(pooled_variance * (1 / n_a + 1 / n_b))
+    return t, 2 * stats.t.sf(np.abs(t), df)
+
+
+def pairwise_rank_sums(values):
+    """Wilcoxon rank-sum tests (as scipy.stats.ranksums) of every pair of
+    groups. Each group is sorted once, and the values of all the groups
+    before it are looked up in it at once; the Mann-Whitney U of every pair
+    with that group is then a weighted count (np.bincount) of the values
+    below each of them, per group.
+
+    Arguments
+    ---
+
+    values : list
+        np.ndarray of the values of each group
+
+    Returns
+    ---
+
+    np.ndarray with the z statistics and np.ndarray with the p-values, one
+    value per pair (see pair_indices)"""
+
+    count = len(values)
+    sizes = np.array([group.size for group in values], dtype=float)
+    pooled = np.concatenate(values)
+    codes = np.repeat(np.arange(count), sizes.astype(int))
+    ends = np.cumsum(sizes.astype(int))
+
+    # u[a, b]: pairs of a value of a and a value of b where a's is larger,
+    # ties counting one half, for every a before b
+    u = np.zeros((count, count))
+    for second in range(1, count):
+        ranked = np.sort(values[second])
+        earlier = pooled[:ends[second - 1]]
+        low = np.searchsorted(ranked, earlier, side='left')
+        high = np.searchsorted(ranked, earlier, side='right')
+        u[:second, second] = np.bincount(codes[:ends[second - 1]], weights=low + 0.5 * (high - low),
+                                         minlength=second)
+
+    first, second = pair_indices(count)
+    n_a, n_b = sizes[first], sizes[second]
+    z = (u[first, second] - n_a * n_b / 2) / np.sqrt(n_a * n_b * (n_a + n_b + 1) / 12)
+    return z, 2 * stats.norm.sf(np.abs(z))
+
+
+def all_pairs_sections(datasets, labels):
+    """Student's t-test and Wilcoxon rank-sum of every pair of data sets,
+    with p-values adjusted for multiple testing within each test.
+
+    Arguments
+    ---
+
+    datasets : list
+        DataSet of each group. Their cached moments are used for t-tests,
+        and their values are ranked together once for rank-sum tests
+
+    labels : list
+        Label of each group
+
+    Returns
+    ---
+
+    list of matrix sections (see results.matrix_section)"""
+
+    sizes = np.array([dataset.sampling_size() for dataset in datasets], dtype=float)
+    means = np.array([dataset.mean_value() for dataset in datasets])
+    stds = np.array([dataset.std_value() for dataset in datasets])
+
+    sections = []
+    for title, statistic, (values, p_values) in [
+            ("Student's t-test (all pairs)", 't', pairwise_t_tests(sizes, means, stds)),
+            ('Wilcoxon rank-sum (all pairs)', 'z',
+             pairwise_rank_sums([dataset.values for dataset in datasets]))]:
+        sections.append(matrix_section(title, labels,
+                                       [statistic, 'P'] + CORRECTIONS,
+                                       [values, p_values, holm(p_values),
+                                        benjamini_hochberg(p_values)],
+                                       statistic=statistic, p_column='P (Holm)'))
+    return sections
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from faststat.metrics import timed
+
+
+@timed('render_interaction_plot')
+def render_interaction_plot(cell_means, x, trace, response):
+    """Renders an interaction plot to PNG. The figure is created on its own
+    Agg canvas, outside pyplot's global state, and released as soon as it is
+    saved, so nothing accumulates between requests.
+
+    Arguments
+    ---
+
+    cell_means : pandas.DataFrame
+        Mean response of each (x, trace) cell
+
+    x, trace, response : str
+        Columns of cell_means used for the x-axis, the traces and the
+        y-axis
+
+    Returns
+    ---
+
+    bytes with the PNG image"""
+
+    # matplotlib and statsmodels are only loaded when a plot is rendered
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from statsmodels.graphics.factorplots import interaction_plot
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    try:
+        interaction_plot(cell_means[x], cell_means[trace], cell_means[response],
+                         ax=figure.subplots(),
+                         colors=['red', 'blue'], markers=['D', '^'], ms=10)
+        png = BytesIO()
+        figure.savefig(png, format='png')
+    finally:
+        figure.clear()
+
+    return png.getvalue()
+
+
+class PlotStore:
+    """Content-addressed store of rendered plots. Images are saved once under
+    the SHA-256 of their bytes, which is all that needs to be kept in the
+    database; since a name always refers to the same image, it can be served
+    with long-lived cache headers.
+
+    Attributes
+    ---
+
+    folder : str
+        Directory where images are kept
+    """
+
+    EXTENSION = '.png'
+
+    def __init__(self, folder):
+        self._folder = folder
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+
+    def save(self, png):
+        """Stores a PNG image and returns its digest"""
+
+        digest = hashlib.sha256(png).hexdigest()
+        path = self.path(digest)
+
+        if not os.path.isfile(path):
+            handle, tmp_path = tempfile.mkstemp(dir=self._folder, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as tmp_file:
+                tmp_file.write(png)
+            os.replace(tmp_path, path)
+
+        return digest
+
+    def path(self, digest):
+        return os.path.join(self._folder, digest + self.EXTENSION)
+
+    def file_name(self, digest):
+        return digest + self.EXTENSION
+
+    @property
+    def folder(self):
+        return self._folder
@@ -0,0 +1,169 @@
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Number of resamples of permutation tests and bootstrap intervals
+RESAMPLES = 10000
+
+# Seed used by default, so that an analysis always gives the same result
+SEED = 0
+
+# Largest number of values drawn at once. Resamples are drawn in chunks of
+# at most this many values (32 MB of float64), whatever their number
+MAX_CHUNK_VALUES = 1 << 22
+
+
+def chunk_counts(resamples, width):
+    """Splits resamples into chunks of at most MAX_CHUNK_VALUES values, for
+    resamples of width values each"""
+    size = max(1, MAX_CHUNK_VALUES // max(1, width))
+    counts = [size] * (resamples // size)
+    if resamples % size:
+        counts.append(resamples % size)
+    return counts
+
+
+def differences(sample_a, sample_b):
+    """Mean difference, median difference and effect size (Cohen's d, with
+    the pooled standard deviation) between the rows of two matrices, each
+    row holding one resample of a group.
+
+    Returns
+    ---
+
+    tuple of three np.ndarray, one value per row"""
+
+    size_a, size_b = sample_a.shape[1], sample_b.shape[1]
+    mean_a, mean_b = sample_a.mean(axis=1), sample_b.mean(axis=1)
+    mean_difference = mean_a - mean_b
+    median_difference = np.median(sample_a, axis=1) - np.median(sample_b, axis=1)
+
+    squares = (np.square(sample_a - mean_a[:, None]).sum(axis=1) +
+               np.square(sample_b - mean_b[:, None]).sum(axis=1))
+    pooled_std = np.sqrt(squares / (size_a + size_b - 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effect_size = mean_difference / pooled_std
+
+    return mean_difference, median_difference, effect_size
+
+
+def _permutation_chunk(arguments):
+    """Number of permutations of the pooled values whose mean and median
+    differences are at least as extreme as the observed ones"""
+    pooled, size_a, count, observed, seed = arguments
+    rng = np.random.default_rng(seed)
+
+    # One permutation of the pooled values per row; the first size_a
+    # columns form group a
+    permuted = rng.permuted(np.broadcast_to(pooled, (count, pooled.size)), axis=1)
+    mean_difference, median_difference, _ = differences(permuted[:, :size_a],
+                                                        permuted[:, size_a:])
+
+    # Tolerance keeps ties computed in a different order as ties
+    tolerance = 1e-12 * np.abs(observed) + 1e-12
+    return (int((np.abs(mean_difference) >= np.abs(observed[0]) - tolerance[0]).sum()),
+            int((np.abs(median_difference) >= np.abs(observed[1]) - tolerance[1]).sum()))
+
+
+def _bootstrap_chunk(arguments):
+    """Differences between bootstrap resamples of each group"""
+    values_a, values_b, count, seed = arguments
+    rng = np.random.default_rng(seed)
+
+    sample_a = values_a[rng.integers(values_a.size, size=(count, values_a.size))]
+    sample_b = values_b[rng.integers(values_b.size, size=(count, values_b.size))]
+    return np.stack(differences(sample_a, sample_b))
+
+
+def run_chunks(function, tasks, workers=1):
+    """Runs function over tasks, in a process pool if workers > 1"""
+    if workers == 1 or len(tasks) == 1:
+        return [function(task) for task in tasks]
+
+    workers = min(workers or os.cpu_count(), len(tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, tasks))
+
+
+def permutation_test(values_a, values_b, resamples=RESAMPLES, seed=SEED, workers=1):
+    """Two-sided permutation tests of the difference of means and of
+    medians between two groups. Permutations are drawn in chunks, each with
+    its own random generator spawned from seed, so that results do not
+    depend on the number of workers.
+
+    Arguments
+    ---
+
+    values_a, values_b : np.ndarray
+        Measurements of each group
+
+    resamples : int
+        Number of permutations
+
+    seed : int
+        Seed of the random generators
+
+    workers : int
+        Number of processes drawing permutations. Use one per CPU if None
+
+    Returns
+    ---
+
+    dict with the observed 'mean' and 'median' differences, and the
+    p-value of each"""
+
+    values_a = np.asarray(values_a, dtype=np.float64)
+    values_b = np.asarray(values_b, dtype=np.float64)
+    pooled = np.concatenate([values_a, values_b])
+
+    observed = np.array([values_a.mean() - values_b.mean(),
+                         np.median(values_a) - np.median(values_b)])
+
+    counts = chunk_counts(resamples, pooled.size)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    extremes = np.sum(run_chunks(_permutation_chunk,
+                                 [(pooled, values_a.size, count, observed, chunk_seed)
+                                  for count, chunk_seed in zip(counts, seeds)],
+                                 workers), axis=0)
+
+    # The observed split counts as one of the permutations
+    p_values = (extremes + 1) / (resamples + 1)
+    return {'mean': (float(observed[0]), float(p_values[0])),
+            'median': (float(observed[1]), float(p_values[1]))}
+
+
+def bootstrap_intervals(values_a, values_b, resamples=RESAMPLES, confidence=0.95, seed=SEED,
+                        workers=1):
+    """Percentile bootstrap confidence intervals of the mean difference,
+    median difference and effect size (Cohen's d) between two groups, each
+    group being resampled with replacement. See permutation_test for
+    chunks, seeds and workers.
+
+    Returns
+    ---
+
+    dict with a (estimate, lower bound, upper bound) tuple for 'mean',
+    'median' and 'effect_size'"""
+
+    values_a = np.asarray(values_a, dtype=np.float64)
+    values_b = np.asarray(values_b, dtype=np.float64)
+
+    counts = chunk_counts(resamples, values_a.size + values_b.size)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    resampled = np.concatenate(run_chunks(_bootstrap_chunk,
+                                          [(values_a, values_b, count, chunk_seed)
+                                           for count, chunk_seed in zip(counts, seeds)],
+                                          workers), axis=1)
+
+    estimates = differences(values_a[None, :], values_b[None, :])
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # Effect sizes are NaN when neither group varies
+        warnings.simplefilter('ignore', RuntimeWarning)
+        bounds = np.nanquantile(resampled, [alpha, 1 - alpha], axis=1)
+
+    return {name: (float(estimate[0]), float(low), float(high))
+            for name, estimate, low, high in zip(('mean', 'median', 'effect_size'),
+                                                 estimates, bounds[0], bounds[1])}
@@ -0,0 +1,227 @@
+import json
+import math
+
+
+def plain(value):
+    """Converts NumPy and pandas scalars to plain Python values, and blank
+    or missing table cells to None, so results can be stored as JSON"""
+    if value is None or isinstance(value, str) and value == '':
+        return None
+    if hasattr(value, 'dtype'):
+        # NumPy scalar
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def analysis_result(stat_func, stat_property, sections):
+    """Builds the structured result of an analysis.
+
+    Arguments
+    ---
+
+    stat_func : str
+        Name of the analysis
+
+    stat_property : str
+        Property (or bin variable) analyzed
+
+    sections : list
+        Sections of the result, as built by summary_section, tests_section
+        and table_section
+
+    Returns
+    ---
+
+    dict with the analysis, the property and its sections"""
+
+    return {'analysis': stat_func, 'property': stat_property,
+            'sections': [section for section in sections if section is not None]}
+
+
+def summary_section(title, dataset, values):
+    """Section with descriptive statistics of a data set.
+
+    Arguments
+    ---
+
+    values : list
+        (label, value) pairs"""
+
+    return {'kind': 'summary', 'title': title, 'dataset': dataset,
+            'values': [[label, plain(value)] for label, value in values]}
+
+
+def test_entry(test, statistic_name, statistic, p_value, dataset=None):
+    """Outcome of a single statistical test"""
+    return {'test': test, 'dataset': dataset, 'statistic_name': statistic_name,
+            'statistic': plain(statistic), 'p': plain(p_value)}
+
+
+def tests_section(title, tests, notes=()):
+    """Section with the outcome of several statistical tests (see
+    test_entry), and notes on their interpretation"""
+    return {'kind': 'tests', 'title': title, 'tests': list(tests), 'notes': list(notes)}
+
+
+def table_section(title, table, statistic='F', p_column='PR(>F)'):
+    """Section holding a table, e.g. an ANOVA table.
+
+    Arguments
+    ---
+
+    title : str
+        Title of the table, also used as test name of its rows
+
+    table : pandas.DataFrame
+        Table to be stored. Blank cells are stored as None
+
+    statistic, p_column : str
+        Columns of table with the test statistic and its p-value
+
+    Returns
+    ---
+
+    dict with the columns, row labels and rows of the table"""
+
+    return {'kind': 'table', 'title': title, 'statistic': statistic, 'p_column': p_column,
+            'columns': [str(column) for column in table.columns],
+            'index': [str(label) for label in table.index],
+            'rows': [[plain(value) for value in row]
+                     for row in table.itertuples(index=False, name=None)]}
+
+
+def matrix_section(title, labels, columns, values, statistic, p_column):
+    """Section holding statistics of every pair of groups. Each statistic is
+    stored as the condensed upper triangle of a matrix over the groups:
+    values of pairs (0, 1), (0, 2), ..., (1, 2), ...
+
+    Arguments
+    ---
+
+    labels : list
+        Label of each group
+
+    columns : list
+        Name of each statistic
+
+    values : list
+        Condensed values of each statistic, one per pair
+
+    statistic, p_column : str
+        Columns with the test statistic and its p-value
+
+    Returns
+    ---
+
+    dict with the labels, columns and values"""
+
+    return {'kind': 'matrix', 'title': title, 'statistic': statistic, 'p_column': p_column,
+            'labels': [str(label) for label in labels], 'columns': list(columns),
+            'values': [[plain(value) for value in column] for column in values]}
+
+
+def matrix_rows(section):
+    """Rows of a matrix section, one per pair of groups.
+
+    Returns
+    ---
+
+    list of (pair label, values of the columns) tuples"""
+
+    labels = section['labels']
+    pairs = [f'{labels[first]} vs {labels[second]}'
+             for first in range(len(labels)) for second in range(first + 1, len(labels))]
+    return list(zip(pairs, zip(*section['values'])))
+
+
+def section_frame(section):
+    """pandas.DataFrame of a table section"""
+    import pandas as pd
+    return pd.DataFrame(section['rows'], columns=section['columns'], index=section['index'])
+
+
+def statistic_rows(result):
+    """Flattens every test of a result into rows: one per test, or per term
+    of a table, holding a statistic and a p-value.
+
+    Returns
+    ---
+
+    list of dicts with test, dataset, statistic_name, statistic and p_value"""
+
+    rows = []
+    for section in result['sections']:
+        if section['kind'] == 'tests':
+            for test in section['tests']:
+                rows.append({'test': test['test'], 'dataset': test['dataset'],
+                             'statistic_name': test['statistic_name'],
+                             'statistic': test['statistic'], 'p_value': test['p']})
+
+        elif section['kind'] in ('table', 'matrix'):
+            if section['p_column'] not in section['columns']:
+                continue
+            statistic = section['columns'].index(section['statistic'])
+            p_value = section['columns'].index(section['p_column'])
+            if section['kind'] == 'table':
+                labeled_rows = zip(section['index'], section['rows'])
+            else:
+                labeled_rows = matrix_rows(section)
+            for label, row in labeled_rows:
+                if row[p_value] is None:
+                    continue
+                rows.append({'test': section['title'], 'dataset': label,
+                             'statistic_name': section['statistic'],
+                             'statistic': row[statistic], 'p_value': row[p_value]})
+
+    return rows
+
+
+def result_records(result):
+    """Flattens every numeric value of a result into records, e.g. to write
+    the results of many analyses in a single table.
+
+    Returns
+    ---
+
+    list of dicts with section (title), row (data set, test or table row),
+    column (name of the value) and value"""
+
+    records = []
+
+    def add(section, row, column, value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            records.append({'section': section['title'], 'row': row,
+                            'column': column, 'value': value})
+
+    for section in result['sections']:
+        if section['kind'] == 'summary':
+            for label, value in section['values']:
+                add(section, section['dataset'], label, value)
+
+        elif section['kind'] == 'tests':
+            for test in section['tests']:
+                row = test['test'] if test['dataset'] is None else f"{test['test']}: {test['dataset']}"
+                add(section, row, test['statistic_name'], test['statistic'])
+                add(section, row, 'P', test['p'])
+
+        elif section['kind'] == 'table':
+            for label, values in zip(section['index'], section['rows']):
+                for column, value in zip(section['columns'], values):
+                    add(section, label, column, value)
+
+        elif section['kind'] == 'matrix':
+            for label, values in matrix_rows(section):
+                for column, value in zip(section['columns'], values):
+                    add(section, label, column, value)
+
+    return records
+
+
+def dumps(result):
+    return json.dumps(result, separators=(',', ':'))
+
+
+def loads(text):
+    return json.loads(text)
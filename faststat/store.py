@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict
+
+from faststat.objects import FastStat
+
+
+class DataStore:
+    """Keeps one FastStat object per user session, under a total memory
+    budget. The size of each session is that of its data frame, measured
+    with DataFrame.memory_usage(deep=True), plus the arrays built from it
+    (see FastStat.memory_usage); when the budget is exceeded, the data
+    frames of the least recently used sessions are released to the on-disk
+    DataCache and reloaded the next time those sessions make a request. The
+    analysis state of a session (parms, stat_func, ...) is kept while its
+    data frame is released. Data frames of the sessions in the store are
+    never evicted from the cache.
+
+    Each worker process has its own store. The state of a session (see
+    FastStat.state) is meant to be kept in the session itself, so that any
+    worker can rebuild it from the cache, which they share.
+
+    Attributes
+    ---
+
+    cache : DataCache
+        Cache used to release and restore data frames
+
+    max_bytes : int
+        Memory budget for all data frames held in the store
+
+    max_sessions : int
+        Maximum number of sessions tracked. Beyond it, the least recently
+        used sessions are forgotten entirely
+    """
+
+    def __init__(self, cache, max_bytes=1000 * 1000 * 1000, max_sessions=1000):
+        self._cache = cache
+        self._max_bytes = max_bytes
+        self._max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        cache.protect(self.data_hashes)
+
+    def get(self, key, state=None):
+        """Returns the FastStat object of a session, creating an empty one for
+        new sessions and reloading the data frame if it was released.
+
+        Arguments
+        ---
+
+        key : str
+            Id of the session
+
+        state : dict
+            State of the session, as saved by FastStat.state, e.g. by
+            another worker process. The session is rebuilt from it when this
+            store has no data for it, or other data. Optional"""
+
+        with self._lock:
+            info = self._entries.get(key)
+            if state is not None and (info is None or info.data_hash != state.get('data_hash')):
+                info = FastStat.from_state(self._cache, state)
+                self._entries[key] = info
+                self._trim_sessions()
+            elif info is None:
+                info = FastStat()
+                self._entries[key] = info
+                self._trim_sessions()
+            elif state is not None:
+                info.load_state(state)
+
+            self._entries.move_to_end(key)
+
+            if info.data_frame is None and info.data_hash is not None:
+                # Data was released, or removed from disk in the meantime
+                if not info.restore(self._cache):
+                    info.reset(hard_reset=True)
+
+            self._measure(key)
+            self.evict()
+
+            return info
+
+    def put(self, key, info):
+        """Assigns a new FastStat object (e.g. after an upload) to a session"""
+
+        with self._lock:
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+            self._trim_sessions()
+            self._measure(key)
+            self.evict()
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._sizes.pop(key, None)
+
+    def evict(self):
+        """Releases data frames, least recently used first, until the store
+        fits in its memory budget. The most recently used session is never
+        released. Sizes are measured again first, since sessions build
+        binned variables and indexes between requests."""
+
+        with self._lock:
+            for key in self._entries:
+                self._measure(key)
+
+            for key in list(self._entries)[:-1]:
+                if self.total_bytes() <= self._max_bytes:
+                    break
+                if self._sizes.get(key, 0) and self._entries[key].release(self._cache):
+                    self._measure(key)
+
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def data_hashes(self):
+        """Hashes of the data of every session in the store, loaded or
+        released"""
+        with self._lock:
+            return {info.data_hash for info in self._entries.values()
+                    if info.data_hash is not None}
+
+    def _measure(self, key):
+        """Updates the recorded size of a session (see FastStat.memory_usage,
+        which measures each data frame once)"""
+        self._sizes[key] = self._entries[key].memory_usage()
+
+    def _trim_sessions(self):
+        while len(self._entries) > self._max_sessions:
+            key, _ = self._entries.popitem(last=False)
+            self._sizes.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
@@ -0,0 +1,96 @@
+import json
+
+# Largest window of rows and columns returned at once
+MAX_ROWS = 500
+MAX_COLUMNS = 100
+
+
+def filter_rows(data_frame, column, text):
+    """Positions of the rows whose value in column contains text, ignoring
+    case"""
+    import numpy as np
+
+    if column not in data_frame.columns:
+        raise KeyError(column)
+    matches = data_frame[column].astype(str).str.contains(text, case=False, regex=False)
+    return np.flatnonzero(matches.to_numpy(dtype=bool, na_value=False))
+
+
+def sort_rows(data_frame, positions, column, ascending=True):
+    """Sorts row positions by the values of column. Missing values are kept
+    last, and ties keep their order in the spreadsheet."""
+    if column not in data_frame.columns:
+        raise KeyError(column)
+    values = data_frame[column].take(positions)
+    order = values.reset_index(drop=True).sort_values(ascending=ascending, kind='stable',
+                                                     na_position='last').index
+    return positions[order.to_numpy()]
+
+
+def data_window(data_frame, start=0, count=50, column_start=0, column_count=None,
+                sort=None, ascending=True, filter_column=None, filter_text=None):
+    """Returns a window of rows and columns of a data frame, after filtering
+    and sorting its rows. Only the window is converted, so the cost of a
+    request does not grow with the width of the spreadsheet, and with its
+    length only when rows are sorted or filtered.
+
+    Arguments
+    ---
+
+    data_frame : pandas.DataFrame
+        Spreadsheet data
+
+    start, count : int
+        First row and number of rows of the window, after filtering and
+        sorting. At most MAX_ROWS rows are returned
+
+    column_start, column_count : int
+        First column and number of columns of the window. Use all columns,
+        up to MAX_COLUMNS, by default
+
+    sort : str
+        Column used to sort the rows. Optional
+
+    ascending : bool
+        Sort order
+
+    filter_column, filter_text : str
+        Only rows whose value in filter_column contains filter_text are
+        kept. Optional
+
+    Returns
+    ---
+
+    dict with the number of rows and columns of the data frame, the number
+    of rows left after filtering, the position of the window, and its
+    column names, row labels and values"""
+    import numpy as np
+
+    count = max(0, min(count, MAX_ROWS))
+    if column_count is None:
+        column_count = MAX_COLUMNS
+    column_count = max(0, min(column_count, MAX_COLUMNS))
+    start = max(0, start)
+    column_start = max(0, column_start)
+
+    if filter_column and filter_text:
+        positions = filter_rows(data_frame, filter_column, filter_text)
+    else:
+        positions = np.arange(len(data_frame))
+
+    if sort:
+        positions = sort_rows(data_frame, positions, sort, ascending)
+
+    window = data_frame.iloc[positions[start:start + count],
+                             column_start:column_start + column_count]
+    # to_json takes care of NaN, NumPy and categorical values
+    split = json.loads(window.to_json(orient='split', date_format='iso', default_handler=str))
+
+    return {'total_rows': len(data_frame),
+            'total_columns': len(data_frame.columns),
+            'matched_rows': int(positions.size),
+            'start': start,
+            'column_start': column_start,
+            'columns': [str(column) for column in window.columns],
+            'index': split['index'],
+            'rows': split['data']}
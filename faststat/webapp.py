@@ -0,0 +1,41 @@
+import os
+from jinja2 import ChoiceLoader, FileSystemLoader
+from flask import Flask
+from flask_bcrypt import Bcrypt
+from flask_login import LoginManager
+from flask_sqlalchemy import SQLAlchemy
+
+# Everything the app writes is kept in the package folder, wherever it is
+# started from
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Parsed spreadsheets are kept here in Arrow format, keyed by the hash of the
+# uploaded file, so that re-uploads skip the Excel parser.
+CACHE_PATH = os.path.join(PACKAGE_PATH, 'cache')
+
+app = Flask(__name__)
+# Set FASTSTAT_SECRET_KEY when running several worker processes, so that
+# they all accept the same session cookies
+app.config['SECRET_KEY'] = os.environ.get('FASTSTAT_SECRET_KEY') or os.urandom(24)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(PACKAGE_PATH, 'faststat.db')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1000 * 1000   # limit uploads to 16 MB
+app.config['CACHE_FOLDER'] = CACHE_PATH
+app.config['CACHE_MAX_BYTES'] = 2000 * 1000 * 1000   # size of parsed data cache, above DATA_STORE_MAX_BYTES
+app.config['DATA_STORE_MAX_BYTES'] = 1000 * 1000 * 1000   # data kept in memory
+app.config['RESULT_CACHE_SIZE'] = 256     # analysis results kept in memory
+app.config['RESULT_CACHE_TTL'] = 3600     # seconds
+app.config['JOB_WORKERS'] = None          # analysis processes, one per CPU if None
+app.config['JOB_TIME_LIMIT'] = 300        # seconds before an analysis is cancelled
+app.config['JOB_FOLDER'] = os.path.join(PACKAGE_PATH, 'jobs')  # shared by all web workers
+app.config['PLOT_FOLDER'] = os.path.join(PACKAGE_PATH, 'plot_store')
+app.config['GRID_WORKERS'] = 1            # processes for pairwise tests of a grid, within its job
+app.config['TIMING_HEADER'] = False       # send Server-Timing on every response, not only on request
+
+db = SQLAlchemy(app)
+bcrypt = Bcrypt(app)
+login_manager = LoginManager(app)
+login_manager.login_view = 'login'
+login_manager.login_message_category = 'info'
+
+from faststat import controller, api
@@ -0,0 +1,37 @@
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy import stats
+
+from faststat.pairwise import benjamini_hochberg, holm, pair_indices, pairwise_rank_sums
+
+
+def test_holm():
+    assert_allclose(holm([0.01, 0.04, 0.03]), [0.03, 0.06, 0.06])
+
+
+def test_benjamini_hochberg():
+    assert_allclose(benjamini_hochberg([0.01, 0.04, 0.03]), [0.03, 0.04, 0.04])
+
+
+def test_nan_p_values_are_not_tests():
+    p_values = [0.01, np.nan, 0.04, 0.03]
+    assert_allclose(holm(p_values), [0.03, np.nan, 0.06, 0.06])
+    assert_allclose(benjamini_hochberg(p_values), [0.03, np.nan, 0.04, 0.04])
+
+
+def test_all_nan_p_values():
+    assert np.isnan(holm([np.nan, np.inf])).all()
+    assert np.isnan(benjamini_hochberg([np.nan, np.nan])).all()
+
+
+def test_rank_sums_match_scipy():
+    rng = np.random.default_rng(0)
+    # Rounded, so that groups share tied values
+    values = [np.round(rng.normal(shift, 1, size), 1)
+              for shift, size in [(0, 30), (0.5, 12), (0, 1), (2, 25)]]
+
+    z, p_values = pairwise_rank_sums(values)
+    for position, (first, second) in enumerate(zip(*pair_indices(len(values)))):
+        expected = stats.ranksums(values[first], values[second])
+        assert_allclose(z[position], expected.statistic)
+        assert_allclose(p_values[position], expected.pvalue)
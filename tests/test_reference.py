@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from faststat.anova import GroupStatistics, factorial_anova
+from faststat.dataparse import append_rows
+from faststat.grid import group_datasets, summary_table
+from faststat.grubbs import grubbs_test
+from faststat.incremental import IncrementalSummary
+from faststat.index import GroupIndex
+
+
+def unbalanced_design(seed=0):
+    """Three crossed factors with unequal, non-empty cells"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for a in ['g1', 'g2', 'g3']:
+        for b in ['t1', 't2']:
+            for c in ['d1', 'd2']:
+                size = rng.integers(2, 9)
+                shift = {'g1': 0, 'g2': 1, 'g3': 3}[a] + (b == 't2') * 2 + (a == 'g3') * (c == 'd2')
+                rows += [(a, b, c, value) for value in rng.normal(shift, 1, size)]
+    return pd.DataFrame(rows, columns=['Genotype', 'Treatment', 'Dose', 'y'])
+
+
+@pytest.mark.parametrize('alpha', [0.01, 0.05, 0.1])
+@pytest.mark.parametrize('seed', range(5))
+def test_grubbs_matches_outlier_utils(seed, alpha):
+    smirnov_grubbs = pytest.importorskip('outliers.smirnov_grubbs')
+    rng = np.random.default_rng(seed)
+    values = np.concatenate([rng.normal(10, 1, 40), [16, 17.5, 3]])
+    rng.shuffle(values)
+
+    kept, removed = grubbs_test(values, alpha)
+
+    # As a Series, as faststat passed data to outlier-utils: the standard
+    # deviation of an array would be that of the population
+    expected = smirnov_grubbs.two_sided_test_indices(pd.Series(values), alpha=alpha)
+    assert_array_equal(np.sort(removed), np.sort(expected))
+    assert_array_equal(kept, np.delete(values, removed))
+
+
+@pytest.mark.parametrize('typ', [1, 2, 3])
+@pytest.mark.parametrize('factors', [['Genotype', 'Treatment'], ['Genotype', 'Treatment', 'Dose']])
+def test_factorial_anova_matches_statsmodels(factors, typ):
+    pytest.importorskip('statsmodels')
+    from statsmodels.formula.api import ols
+    from statsmodels.stats.anova import anova_lm
+
+    data = unbalanced_design()
+    # Sum-to-zero contrasts, as in anova.effect_coding
+    formula = 'y ~ ' + ' * '.join(f'C({factor}, Sum)' for factor in factors)
+    reference = anova_lm(ols(formula, data).fit(), typ=typ).drop('Intercept', errors='ignore')
+
+    table = factorial_anova(GroupStatistics.from_values(data['y'], *[data[f] for f in factors]),
+                            tuple(factors), typ)
+
+    assert list(table.index) == [label.replace(', Sum)', '').replace('C(', '')
+                                 for label in reference.index]
+    assert_allclose(table['SS'].astype(float), reference['sum_sq'], rtol=1e-8)
+    assert_allclose(table['DF'].astype(float), reference['df'])
+    assert_allclose(table['F'].iloc[:-1].astype(float), reference['F'].iloc[:-1], rtol=1e-8)
+    assert_allclose(table['PR(>F)'].iloc[:-1].astype(float), reference['PR(>F)'].iloc[:-1],
+                    rtol=1e-6)
+
+
+def test_incremental_summary_matches_recompute():
+    data = unbalanced_design()
+    data['y'] = np.round(data['y'], 1)
+    first, second = data.iloc[:40].reset_index(drop=True), data.iloc[40:].reset_index(drop=True)
+    # Outliers in an old group and values of a new group
+    second.loc[0, 'y'] = 50.0
+    second = pd.concat([second, pd.DataFrame([('g4', 't1', 'd1', 1.0), ('g4', 't1', 'd1', 2.0)],
+                                             columns=data.columns)],
+                       ignore_index=True)
+    columns = ['Genotype', 'Treatment']
+
+    summary = IncrementalSummary(first, columns, 'y')
+    combined = append_rows(first, second)
+    summary.append(combined, len(first))
+
+    expected = summary_table(group_datasets(combined, columns, 'y'), columns)
+    pd.testing.assert_frame_equal(summary.table(), expected, check_dtype=False)
+
+
+def test_group_index_subset_matches_masking():
+    rng = np.random.default_rng(1)
+    data = pd.DataFrame({'A': rng.choice(['x', 'y', 'z'], 500),
+                         'B': rng.integers(0, 4, 500),
+                         'C': rng.choice([1.5, 2.5, np.nan], 500)})
+    index = GroupIndex(data)
+
+    assert_array_equal(index.subset(), np.arange(len(data)))
+    for parms in [{'A': 'x'}, {'A': 'y', 'B': 2}, {'A': 'z', 'B': 0, 'C': 1.5},
+                  {'B': 3, 'C': 2.5}, {'A': 'missing'}, {'A': 'x', 'B': 9}]:
+        mask = np.ones(len(data), dtype=bool)
+        for column, value in parms.items():
+            mask &= (data[column] == value).to_numpy()
+        assert_array_equal(index.subset(**parms), np.flatnonzero(mask))